@@ -0,0 +1,319 @@
+"""
+Benchmark the matching paths on synthetic datasets of increasing size.
+
+For every dataset size, reports p50/p95/p99 latency and database
+operations per call of each matching function, and saves the results as
+JSON so runs of different versions can be compared.
+
+Usage:
+    python -m benchmarks.bench_matching --sizes 1000 10000 --output results.json
+    python -m benchmarks.bench_matching --sizes 1000 --compare results.json
+"""
+import argparse
+import json
+import logging
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from benchmarks.dataset import configure_environment, connect, generate
+from benchmarks.fake_spoonacular import FakeSpoonacular, start_fake_server
+
+# Calls timed per path even when its time budget runs out
+MIN_CALLS = 5
+
+class OperationCounter:
+    """Count calls to collection methods, i.e. the database operations issued."""
+    
+    def __init__(self):
+        """Initialize the counter."""
+        self.count = 0
+    
+    def wrap_client(self, client):
+        """Wrap a MongoClient so operations on its collections are counted."""
+        return _CountingProxy(client, self, level=0)
+
+class _CountingProxy:
+    """Transparent proxy over a client, database or collection."""
+    
+    # Collection methods that send a request to the server
+    OPERATIONS = {
+        'find', 'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many',
+        'replace_one', 'delete_one', 'delete_many', 'find_one_and_delete', 'find_one_and_update',
+        'count_documents', 'estimated_document_count', 'distinct', 'aggregate', 'bulk_write'
+    }
+    
+    def __init__(self, target, counter, level):
+        """Wrap a target; level is 0 for clients, 1 for databases and 2 for collections."""
+        self._target = target
+        self._counter = counter
+        self._level = level
+    
+    def __getitem__(self, name):
+        """Wrap databases and collections accessed by name."""
+        return _CountingProxy(self._target[name], self._counter, self._level + 1)
+    
+    def __getattr__(self, name):
+        """Wrap databases and collections, and count collection operations."""
+        value = getattr(self._target, name)
+        if self._level == 1 and hasattr(value, 'find_one'):
+            return _CountingProxy(value, self._counter, 2)
+        if self._level == 2 and name in self.OPERATIONS:
+            def counted(*args, **kwargs):
+                self._counter.count += 1
+                return value(*args, **kwargs)
+            return counted
+        return value
+
+def percentile(sorted_values, q):
+    """Get the q-th percentile (0-100) of sorted values by nearest rank."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def measure(func, inputs, counter, max_seconds):
+    """
+    Time a function over a list of inputs.
+    
+    Parameters:
+    - func: Function called with each input tuple
+    - inputs: List of argument tuples
+    - counter: OperationCounter installed on the database client
+    - max_seconds: Time budget for the path
+    
+    Returns:
+    - Dictionary with call count, latency percentiles in ms and operations per call
+    """
+    from utils.metrics import MONGO_OPERATIONS
+    
+    durations = []
+    operations_before = counter.count
+    commands_before = MONGO_OPERATIONS.total()
+    started = time.perf_counter()
+    
+    for args in inputs:
+        start = time.perf_counter()
+        func(*args)
+        durations.append((time.perf_counter() - start) * 1000)
+        if len(durations) >= MIN_CALLS and time.perf_counter() - started > max_seconds:
+            break
+    
+    calls = len(durations)
+    durations.sort()
+    result = {
+        'calls': calls,
+        'p50_ms': percentile(durations, 50),
+        'p95_ms': percentile(durations, 95),
+        'p99_ms': percentile(durations, 99),
+        'mean_ms': sum(durations) / calls if calls else None,
+        'db_ops_per_call': (counter.count - operations_before) / calls if calls else None
+    }
+    # Only a real server reports wire commands, including cursor getMores
+    commands = MONGO_OPERATIONS.total() - commands_before
+    if commands:
+        result['db_commands_per_call'] = commands / calls
+    return result
+
+def benchmark_paths(num_calls, seed, match_table):
+    """
+    Build the inputs of every matching path from the current dataset.
+    
+    Returns:
+    - Dictionary of path name to (function, list of argument tuples)
+    """
+    from models.database import get_database
+    from models.user import User
+    from models.ingredient import Ingredient
+    from services import matching
+    from services import match_store
+    
+    rng = random.Random(seed)
+    db = get_database()
+    
+    sample_ids = [data['_id'] for data in db.users.find({}, {'_id': 1})]
+    sample_ids = rng.sample(sample_ids, min(num_calls, len(sample_ids)))
+    users = [User.find_by_id(user_id) for user_id in sample_ids]
+    
+    offer_inputs = []
+    request_inputs = []
+    for user in users:
+        if user.offers:
+            ingredient = Ingredient.find_by_id(rng.choice(user.offers)['ingredient_id'])
+            if ingredient:
+                offer_inputs.append((user, ingredient))
+        if user.requests:
+            request_inputs.append((user, rng.choice(user.requests)['ingredient']))
+    
+    # Recipe matching runs on the nearby users found beforehand
+    recipe_inputs = [
+        (user, matching.find_nearby_users(user, limit=10))
+        for user in users[:max(MIN_CALLS, num_calls // 10)]
+    ]
+    
+    paths = {
+        'matching.find_nearby_users': (matching.find_nearby_users, [(user,) for user in users]),
+        'matching.find_nearby_users[offer]': (
+            lambda user, ingredient: matching.find_nearby_users(user, ingredient=ingredient), offer_inputs
+        ),
+        'matching.find_nearby_users[request]': (
+            lambda user, name: matching.find_nearby_users(user, name=name), request_inputs
+        ),
+        'matching.find_matching_recipes': (matching.find_matching_recipes, recipe_inputs),
+        'User.find_nearby_users': (
+            lambda user: User.find_nearby_users(user.location), [(user,) for user in users]
+        ),
+        'matching.find_nearby_requesters': (
+            matching.find_nearby_requesters, [(user, ingredient.name) for user, ingredient in offer_inputs]
+        ),
+        'matching.find_nearby_offerers': (matching.find_nearby_offerers, request_inputs),
+        'matching.find_offerers_page': (matching.find_offerers_page, request_inputs)
+    }
+    
+    if match_table:
+        paths['match_store.get_matches_page'] = (
+            lambda user: match_store.get_matches_page(user.id, match_store.REQUEST), [(user,) for user in users]
+        )
+        paths['match_store.get_swaps'] = (
+            lambda user: match_store.get_swaps(user.id, limit=3), [(user,) for user in users]
+        )
+        paths['match_store.refresh_offer'] = (
+            lambda user, ingredient: match_store.refresh_offer(user, ingredient.name), offer_inputs
+        )
+    
+    return paths
+
+def run(sizes, backend, uri, num_calls, max_seconds, seed, match_table):
+    """Generate each dataset size and benchmark every path on it."""
+    from services import availability, match_store
+    
+    counter = OperationCounter()
+    client = connect(backend, uri)
+    results = {}
+    
+    for size in sizes:
+        print(f"\n== {size} users ({backend}) ==")
+        start = time.perf_counter()
+        counts = generate(size, seed=seed)
+        generate_seconds = time.perf_counter() - start
+        print(f"Generated {counts} in {generate_seconds:.1f}s")
+        
+        size_result = {'dataset': counts, 'generate_seconds': round(generate_seconds, 3), 'paths': {}}
+        
+        # Matching consults the availability map, which the generator doesn't fill
+        start = time.perf_counter()
+        availability.ensure_indexes()
+        availability.rebuild()
+        size_result['availability_build_seconds'] = round(time.perf_counter() - start, 3)
+        print(f"Built availability map in {size_result['availability_build_seconds']}s")
+        
+        if match_table:
+            start = time.perf_counter()
+            match_store.ensure_indexes()
+            match_store.rebuild()
+            size_result['match_table_build_seconds'] = round(time.perf_counter() - start, 3)
+            print(f"Built match table in {size_result['match_table_build_seconds']}s")
+        
+        # Count operations only while benchmarking, not while generating
+        from models import database
+        database._client = counter.wrap_client(client)
+        try:
+            for name, (func, inputs) in benchmark_paths(num_calls, seed, match_table).items():
+                result = measure(func, inputs, counter, max_seconds)
+                size_result['paths'][name] = result
+                print(_format_result(name, result))
+        finally:
+            database._client = client
+        
+        results[str(size)] = size_result
+    
+    return results
+
+def compare(previous, current):
+    """Print the p50/p95 change of every path found in both result sets."""
+    print("\n== Comparison with previous run ==")
+    for size, size_result in current['results'].items():
+        old_size = previous.get('results', {}).get(size)
+        if not old_size:
+            continue
+        for name, result in size_result['paths'].items():
+            old = old_size['paths'].get(name)
+            if not old or not old.get('p50_ms') or not result.get('p50_ms'):
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'db_ops_per_call'):
+                if old.get(key) and result.get(key) is not None:
+                    changes.append(f"{key} {(result[key] - old[key]) / old[key] * 100:+.1f}%")
+            print(f"{size:>7} {name:<40} {', '.join(changes)}")
+
+def _format_result(name, result):
+    """Format one path's result as a table row."""
+    if not result['calls']:
+        return f"{name:<40} no inputs"
+    return (
+        f"{name:<40} calls={result['calls']:<5} p50={result['p50_ms']:.2f}ms "
+        f"p95={result['p95_ms']:.2f}ms p99={result['p99_ms']:.2f}ms "
+        f"ops/call={result['db_ops_per_call']:.1f}"
+    )
+
+def _git_revision():
+    """Get the current git revision, if available."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description="Benchmark the matching paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help="Numbers of users")
+    parser.add_argument('--backend', choices=['mongod', 'mongomock'], default='mongod')
+    parser.add_argument('--uri', help="MongoDB URI for the mongod backend (default: MONGODB_URI)")
+    parser.add_argument('--db-name', default='ingredient_exchanger_bench', help="Database to use, dropped first")
+    parser.add_argument('--calls', type=int, default=200, help="Calls per path")
+    parser.add_argument('--max-seconds', type=float, default=30, help="Time budget per path")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed")
+    parser.add_argument(
+        '--match-table', action=argparse.BooleanOptionalAction, default=None,
+        help="Build and benchmark the match table (default: only with mongod, mongomock builds it very slowly)"
+    )
+    parser.add_argument('--fake-recipe-api', action='store_true', help="Serve recipe calls from a local fake API")
+    parser.add_argument('--recipe-latency-ms', type=float, default=0, help="Added latency of the fake recipe API")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write")
+    parser.add_argument('--compare', help="Previous JSON results to compare with")
+    args = parser.parse_args()
+    
+    # Without the fake API recipe calls are disabled, keep their warnings out of the report
+    logging.basicConfig(level=logging.ERROR)
+    recipe_api_url = None
+    if args.fake_recipe_api:
+        _, recipe_api_url = start_fake_server(FakeSpoonacular(latency_ms=args.recipe_latency_ms, seed=args.seed))
+    configure_environment(args.db_name, recipe_api_url)
+    
+    results = run(
+        args.sizes, args.backend, args.uri, args.calls, args.max_seconds,
+        args.seed, args.backend == 'mongod' if args.match_table is None else args.match_table
+    )
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'backend': args.backend,
+        'recipe_api': 'fake' if args.fake_recipe_api else None,
+        'seed': args.seed,
+        'results': results
+    }
+    
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to {args.output}")
+    
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Synthetic city-scale dataset for benchmarks.
+
+Creates users clustered around neighborhood centers, each with a pantry,
+offers and requests drawn from a skewed ingredient popularity, in either
+an in-memory mongomock database or a real mongod.
+
+Usage:
+    python -m benchmarks.dataset --users 10000 --backend mongod --db-name ingredient_exchanger_bench
+"""
+import argparse
+import math
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# City center the neighborhoods are spread around (Berlin)
+CITY_LATITUDE = 52.52
+CITY_LONGITUDE = 13.405
+CITY_RADIUS_KM = 15
+NEIGHBORHOOD_RADIUS_KM = 1.5  # Standard deviation of users around their neighborhood center
+
+BASE_INGREDIENTS = [
+    'flour', 'rice', 'pasta', 'bread', 'oats', 'cereal', 'chicken', 'beef', 'pork', 'fish',
+    'tofu', 'eggs', 'milk', 'cheese', 'yogurt', 'cream', 'butter', 'apple', 'orange', 'banana',
+    'strawberry', 'blueberry', 'lemon', 'carrot', 'tomato', 'potato', 'onion', 'garlic', 'pepper',
+    'spinach', 'lettuce', 'cucumber', 'zucchini', 'broccoli', 'mushroom', 'salt', 'basil', 'oregano',
+    'cinnamon', 'paprika', 'sugar', 'honey', 'maple syrup', 'chocolate', 'olive oil', 'vinegar',
+    'soy sauce', 'ketchup', 'mustard', 'beans', 'lentils', 'chickpeas', 'corn', 'peas', 'coconut milk'
+]
+VARIANTS = ['', 'organic ', 'fresh ', 'dried ', 'frozen ']
+UNITS = ['g', 'kg', 'ml', 'l', 'pcs', '']
+
+def configure_environment(db_name, recipe_api_url=None):
+    """
+    Point the project configuration at a benchmark database.
+    
+    Must run before any project module is imported, since config.py reads
+    the environment at import time. The real recipe API is never used, so
+    runs don't spend quota: recipe calls go to recipe_api_url (usually the
+    fake server from benchmarks.fake_spoonacular) or are disabled.
+    """
+    os.environ['DB_NAME'] = db_name
+    os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+    if recipe_api_url:
+        os.environ['SPOONACULAR_BASE_URL'] = recipe_api_url
+        os.environ['SPOONACULAR_API_KEY'] = 'benchmark'
+    else:
+        os.environ['SPOONACULAR_API_KEY'] = ''
+    os.environ.setdefault('SLOW_UPDATE_THRESHOLD_MS', str(float('inf')))
+
+def ingredient_vocabulary():
+    """Get every ingredient name the generator can use, most popular first."""
+    return [variant + name for variant in VARIANTS for name in BASE_INGREDIENTS]
+
+def connect(backend, uri=None):
+    """
+    Create a MongoDB client for the benchmark and install it as the project's client.
+    
+    Parameters:
+    - backend: 'mongomock' for an in-memory database, 'mongod' for a real server
+    - uri: MongoDB URI, defaults to MONGODB_URI from the configuration
+    
+    Returns:
+    - The client
+    """
+    from models import database
+    
+    if backend == 'mongomock':
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        from config import MONGODB_URI
+        client = MongoClient(uri or MONGODB_URI, event_listeners=[database.CommandMetrics()])
+    
+    database._client = client
+    return client
+
+def generate(num_users, seed=42, neighborhoods=None, batch_size=5000):
+    """
+    Fill the configured database with synthetic users and ingredients.
+    
+    Existing users, ingredients and match rows are dropped first.
+    
+    Parameters:
+    - num_users: Number of users to create
+    - seed: Random seed, so runs with the same arguments get the same data
+    - neighborhoods: Number of population clusters, scaled with num_users by default
+    - batch_size: Documents per insert_many call
+    
+    Returns:
+    - Dictionary with counts of the generated documents
+    """
+    from models.database import get_database
+    from models.user import User, utcnow
+    from models.ingredient import Ingredient
+    from config import REQUEST_TTL_DAYS
+    from utils.geohash import encode
+    
+    db = get_database()
+    db.users.drop()
+    db.ingredients.drop()
+    db.matches.drop()
+    
+    rng = random.Random(seed)
+    vocabulary = ingredient_vocabulary()
+    # Zipf-like popularity: a few staples are in many pantries, most items are rare
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    centers = _neighborhood_centers(rng, neighborhoods or max(5, int(math.sqrt(num_users) / 3)))
+    
+    users = []
+    ingredients = []
+    counts = {'users': 0, 'ingredients': 0, 'offers': 0, 'requests': 0}
+    
+    for index in range(num_users):
+        user_id = str(uuid.uuid4())
+        pantry = set(rng.choices(vocabulary, weights, k=rng.randint(3, 20)))
+        pantry_items = [{
+            '_id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'name': name,
+            'amount': str(rng.randint(1, 1000)),
+            'unit': rng.choice(UNITS),
+            'category': Ingredient.categorize(name),
+            'created_at': datetime.now()
+        } for name in pantry]
+        
+        offered = rng.sample(pantry_items, k=min(len(pantry_items), rng.choice([0, 0, 1, 1, 2, 3])))
+        requested = {
+            name for name in rng.choices(vocabulary, weights, k=rng.choice([0, 1, 1, 2, 3]))
+            if name not in pantry
+        }
+        
+        latitude, longitude = _scatter(rng, rng.choice(centers), NEIGHBORHOOD_RADIUS_KM)
+        users.append({
+            '_id': user_id,
+            'telegram_id': 10_000_000 + index,
+            'name': f"User {index}",
+            'location': {'latitude': latitude, 'longitude': longitude},
+            'geohash': encode(latitude, longitude),
+            'created_at': datetime.now(),
+            'offers': [{
+                'ingredient_id': item['_id'],
+                'created_at': datetime.now(),
+                'expires_at': utcnow() + Ingredient.shelf_life(item['category'])
+            } for item in offered],
+            'requests': [{
+                'ingredient': name,
+                'amount': str(rng.randint(1, 500)),
+                'unit': rng.choice(UNITS),
+                'created_at': datetime.now(),
+                'expires_at': utcnow() + timedelta(days=REQUEST_TTL_DAYS)
+            } for name in requested]
+        })
+        ingredients.extend(pantry_items)
+        
+        counts['users'] += 1
+        counts['ingredients'] += len(pantry_items)
+        counts['offers'] += len(offered)
+        counts['requests'] += len(requested)
+        
+        if len(users) >= batch_size:
+            _flush(db, users, ingredients)
+    
+    _flush(db, users, ingredients)
+    
+    User.ensure_indexes()
+    Ingredient.ensure_indexes()
+    return counts
+
+def _flush(db, users, ingredients):
+    """Insert and clear the buffered documents."""
+    if users:
+        db.users.insert_many(users, ordered=False)
+        users.clear()
+    if ingredients:
+        db.ingredients.insert_many(ingredients, ordered=False)
+        ingredients.clear()
+
+def _neighborhood_centers(rng, count):
+    """Pick neighborhood centers spread over the city."""
+    return [_scatter(rng, (CITY_LATITUDE, CITY_LONGITUDE), CITY_RADIUS_KM / 2) for _ in range(count)]
+
+def _scatter(rng, center, sigma_km):
+    """Pick a point normally distributed around a center."""
+    latitude, longitude = center
+    latitude += rng.gauss(0, sigma_km) / 111.0
+    longitude += rng.gauss(0, sigma_km) / (111.0 * math.cos(math.radians(latitude)))
+    return latitude, longitude
+
+def main():
+    """Generate a dataset from the command line."""
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset for benchmarks")
+    parser.add_argument('--users', type=int, default=10000, help="Number of users")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed")
+    parser.add_argument('--backend', choices=['mongod', 'mongomock'], default='mongod')
+    parser.add_argument('--uri', help="MongoDB URI (default: MONGODB_URI)")
+    parser.add_argument('--db-name', default='ingredient_exchanger_bench', help="Database to fill, dropped first")
+    args = parser.parse_args()
+    
+    configure_environment(args.db_name)
+    connect(args.backend, args.uri)
+    
+    start = time.perf_counter()
+    counts = generate(args.users, seed=args.seed)
+    print(f"Generated {counts} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
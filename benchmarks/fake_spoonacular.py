@@ -0,0 +1,419 @@
+"""
+Local stand-in for the Spoonacular API.
+
+Serves the endpoints the bot uses (findByIngredients, recipe information,
+complexSearch and ingredient substitutes) so recipe features can be load
+tested and benchmarked offline. Latency, error rates and the daily point
+quota are configurable.
+
+Modes:
+- synthetic: answers from a generated recipe catalog, deterministic for a seed
+- record: forwards requests to the real API once and saves the responses
+- replay: serves only previously recorded responses
+
+Usage:
+    python -m benchmarks.fake_spoonacular --port 8081 --latency-ms 150 --error-rate 0.01
+    SPOONACULAR_BASE_URL=http://127.0.0.1:8081 SPOONACULAR_API_KEY=fake python main.py
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+import requests
+from benchmarks.dataset import BASE_INGREDIENTS, ingredient_vocabulary
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_URL = "https://api.spoonacular.com"
+
+DISH_TYPES = ['Stew', 'Salad', 'Bowl', 'Soup', 'Bake', 'Stir-Fry', 'Pie', 'Curry', 'Pancakes', 'Wrap']
+STYLES = ['Rustic', 'Quick', 'Spicy', 'Creamy', 'Classic', 'Summer', 'Weeknight', 'Grandma\'s', 'Easy', 'Hearty']
+
+# Substitutes for some common ingredients, in the API's "amount = amount substitute" format
+SUBSTITUTES = {
+    'butter': ['1 cup = 7/8 cup shortening', '1 cup = 7/8 cup olive oil', '1 cup = 1 cup margarine'],
+    'milk': ['1 cup = 1 cup soy milk', '1 cup = 1/2 cup cream + 1/2 cup water', '1 cup = 1 cup oat milk'],
+    'eggs': ['1 egg = 1/4 cup applesauce', '1 egg = 1 tbsp flax seed + 3 tbsp water'],
+    'sugar': ['1 cup = 3/4 cup honey', '1 cup = 3/4 cup maple syrup'],
+    'cream': ['1 cup = 3/4 cup milk + 1/3 cup butter', '1 cup = 1 cup coconut milk'],
+    'flour': ['1 cup = 1 cup oats', '1 cup = 7/8 cup rice flour'],
+    'honey': ['1 cup = 1 1/4 cup sugar + 1/4 cup water', '1 cup = 1 cup maple syrup'],
+    'yogurt': ['1 cup = 1 cup sour cream', '1 cup = 1 cup buttermilk'],
+    'vinegar': ['1 tsp = 1 tsp lemon juice'],
+    'onion': ['1 onion = 1 tbsp onion powder', '1 onion = 1/2 cup chopped shallots'],
+    'garlic': ['1 clove = 1/8 tsp garlic powder'],
+    'basil': ['1 tbsp = 1 tbsp oregano', '1 tbsp = 1 tbsp parsley'],
+    'rice': ['1 cup = 1 cup quinoa', '1 cup = 1 cup couscous'],
+    'beef': ['1 lb = 1 lb mushroom', '1 lb = 1 lb lentils'],
+    'chicken': ['1 lb = 1 lb tofu', '1 lb = 1 lb turkey']
+}
+
+class FakeSpoonacular:
+    """Answers Spoonacular API requests from a generated catalog or a recording."""
+    
+    def __init__(self, mode='synthetic', cassette=None, upstream=UPSTREAM_URL,
+                 latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limit_rate=0.0,
+                 hang_rate=0.0, hang_seconds=60, quota=0, catalog_size=2000, seed=42):
+        """
+        Initialize the fake API.
+        
+        Parameters:
+        - mode: 'synthetic', 'record' or 'replay'
+        - cassette: JSON file holding recorded responses, required for record and replay
+        - upstream: Real API URL used when recording
+        - latency_ms, jitter_ms: Mean and standard deviation of the added latency
+        - error_rate: Fraction of requests answered with 500
+        - rate_limit_rate: Fraction of requests answered with 429
+        - hang_rate: Fraction of requests that hang for hang_seconds, to exercise client timeouts
+        - quota: Daily points before answering 402, 0 for unlimited
+        - catalog_size: Number of synthetic recipes
+        - seed: Random seed of the catalog and the injected failures
+        """
+        if mode in ('record', 'replay') and not cassette:
+            raise ValueError(f"{mode} mode needs a cassette file")
+        
+        self.mode = mode
+        self.cassette = cassette
+        self.upstream = upstream.rstrip('/')
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.quota = quota
+        self.points_used = 0.0
+        self.requests_served = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recordings = self._load_cassette() if cassette else {}
+        self._recipes, self._recipes_by_ingredient = _build_catalog(catalog_size, seed)
+    
+    def handle(self, path, params):
+        """
+        Answer one request.
+        
+        Parameters:
+        - path: Request path, e.g. /recipes/findByIngredients
+        - params: Dictionary of query parameters
+        
+        Returns:
+        - Tuple of (HTTP status, JSON-serializable body, extra headers)
+        """
+        with self._lock:
+            self.requests_served += 1
+            roll = self._rng.random()
+            delay = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) / 1000 if self.latency_ms else 0.0
+        
+        if delay:
+            time.sleep(delay)
+        
+        if not params.get('apiKey'):
+            return 401, _failure(401, "You are not authorized. Please read https://spoonacular.com/food-api/docs#Authentication"), {}
+        
+        # Failures are injected in a fixed order of precedence from one random roll
+        if roll < self.hang_rate:
+            time.sleep(self.hang_seconds)
+        elif roll < self.hang_rate + self.rate_limit_rate:
+            return 429, _failure(429, "Too many requests"), {}
+        elif roll < self.hang_rate + self.rate_limit_rate + self.error_rate:
+            return 500, _failure(500, "Internal server error"), {}
+        
+        if self.mode == 'record':
+            return self._record(path, params)
+        
+        if self.quota and self.points_used >= self.quota:
+            return 402, _failure(
+                402, f"Your daily points limit of {self.quota} has been reached. Please upgrade your plan to continue using the API."
+            ), self._quota_headers(0)
+        
+        if self.mode == 'replay':
+            recording = self._recordings.get(_recording_key(path, params))
+            if recording is None:
+                return 404, _failure(404, f"No recorded response for {path}"), {}
+            status, body = recording['status'], recording['body']
+        else:
+            status, body = self._synthetic(path, params)
+        
+        return status, body, self._charge(path, params, body) if status == 200 else {}
+    
+    def _synthetic(self, path, params):
+        """Answer from the generated recipe catalog."""
+        number = max(1, min(100, int(params.get('number', 10))))
+        
+        if path == '/recipes/findByIngredients':
+            names = [name.strip().lower() for name in params.get('ingredients', '').split(',') if name.strip()]
+            return 200, self._find_by_ingredients(names, number, params.get('ranking') == '2')
+        
+        match = re.fullmatch(r'/recipes/(\d+)/information', path)
+        if match:
+            recipe = self._recipes.get(int(match.group(1)))
+            if recipe is None:
+                return 404, _failure(404, "A recipe with the id could not be found.")
+            return 200, _information(recipe)
+        
+        if path == '/recipes/complexSearch':
+            query = params.get('query', '').lower()
+            found = [recipe for recipe in self._recipes.values() if query in recipe['title'].lower()]
+            results = found[:number]
+            if params.get('addRecipeInformation', '').lower() == 'true':
+                results = [_information(recipe) for recipe in results]
+            else:
+                results = [{'id': r['id'], 'title': r['title'], 'image': r['image'], 'imageType': 'jpg'} for r in results]
+            return 200, {'results': results, 'offset': 0, 'number': number, 'totalResults': len(found)}
+        
+        if path == '/food/ingredients/substitutes':
+            name = params.get('ingredientName', '').lower()
+            base = next((base for base in SUBSTITUTES if base in name), None)
+            if base is None:
+                return 200, {'status': 'failure', 'message': "Could not find any substitutes for that ingredient."}
+            return 200, {
+                'ingredient': name,
+                'substitutes': SUBSTITUTES[base],
+                'message': f"Found {len(SUBSTITUTES[base])} substitutes for the ingredient.",
+                'status': 'success'
+            }
+        
+        return 404, _failure(404, f"Unknown endpoint {path}")
+    
+    def _find_by_ingredients(self, names, number, minimize_missing):
+        """Rank catalog recipes by the given ingredients, like findByIngredients."""
+        available = set(names)
+        candidates = set()
+        for name in available:
+            candidates.update(self._recipes_by_ingredient.get(name, ()))
+        
+        ranked = []
+        for recipe_id in candidates:
+            recipe = self._recipes[recipe_id]
+            used = [item for item in recipe['ingredients'] if item['name'] in available]
+            missed = [item for item in recipe['ingredients'] if item['name'] not in available]
+            if minimize_missing:
+                key = (len(missed), -len(used), recipe_id)
+            else:
+                key = (-len(used), len(missed), recipe_id)
+            ranked.append((key, recipe, used, missed))
+        ranked.sort(key=lambda entry: entry[0])
+        
+        return [{
+            'id': recipe['id'],
+            'title': recipe['title'],
+            'image': recipe['image'],
+            'imageType': 'jpg',
+            'usedIngredientCount': len(used),
+            'missedIngredientCount': len(missed),
+            'usedIngredients': used,
+            'missedIngredients': missed,
+            'unusedIngredients': [],
+            'likes': recipe['likes']
+        } for _, recipe, used, missed in ranked[:number]]
+    
+    def _charge(self, path, params, body):
+        """Count the points of a successful request and build the quota headers."""
+        if path == '/recipes/findByIngredients':
+            cost = 1 + 0.01 * len(body)
+        elif path == '/recipes/complexSearch':
+            per_result = 0.035 if params.get('addRecipeInformation', '').lower() == 'true' else 0.01
+            cost = 1 + per_result * len(body.get('results', []))
+        else:
+            cost = 1
+        
+        with self._lock:
+            self.points_used += cost
+        return self._quota_headers(cost)
+    
+    def _quota_headers(self, cost):
+        """Build the headers Spoonacular uses to report the quota."""
+        headers = {'X-API-Quota-Request': f"{cost:g}", 'X-API-Quota-Used': f"{self.points_used:g}"}
+        if self.quota:
+            headers['X-API-Quota-Left'] = f"{max(0.0, self.quota - self.points_used):g}"
+        return headers
+    
+    def _record(self, path, params):
+        """Serve a recorded response, fetching and saving it from the real API the first time."""
+        key = _recording_key(path, params)
+        recording = self._recordings.get(key)
+        if recording is not None:
+            return recording['status'], recording['body'], {}
+        
+        try:
+            response = requests.get(f"{self.upstream}{path}", params=params, timeout=30)
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Error recording {path}: {e}")
+            return 502, _failure(502, f"Upstream request failed: {e}"), {}
+        
+        headers = {name: value for name, value in response.headers.items() if name.startswith('X-API-Quota')}
+        # Only successful answers are worth replaying
+        if response.status_code == 200:
+            with self._lock:
+                self._recordings[key] = {'status': response.status_code, 'body': body}
+                self._save_cassette()
+        return response.status_code, body, headers
+    
+    def _load_cassette(self):
+        """Read recorded responses, if the cassette exists yet."""
+        if not os.path.exists(self.cassette):
+            if self.mode == 'replay':
+                raise FileNotFoundError(f"Cassette {self.cassette} does not exist")
+            return {}
+        with open(self.cassette, encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _save_cassette(self):
+        """Write the recorded responses, replacing the file atomically."""
+        temporary = f"{self.cassette}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self._recordings, f, indent=1, sort_keys=True)
+        os.replace(temporary, self.cassette)
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    """Route HTTP requests to the server's FakeSpoonacular."""
+    
+    def do_GET(self):
+        """Answer a GET request."""
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        status, body, headers = self.server.fake.handle(url.path.rstrip('/'), params)
+        
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, format, *args):
+        """Log requests at debug level only."""
+        logger.debug(format % args)
+
+def start_fake_server(fake, host='127.0.0.1', port=0):
+    """
+    Serve a FakeSpoonacular from a background thread.
+    
+    Parameters:
+    - fake: FakeSpoonacular instance
+    - host: Interface to listen on
+    - port: Port to listen on, 0 for any free port
+    
+    Returns:
+    - Tuple of (HTTP server, base URL to use as SPOONACULAR_BASE_URL)
+    """
+    server = _create_server(fake, host, port)
+    thread = threading.Thread(target=server.serve_forever, name="fake-spoonacular", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def _create_server(fake, host, port):
+    """Create the HTTP server answering with a FakeSpoonacular."""
+    server = ThreadingHTTPServer((host, port), _FakeHandler)
+    server.daemon_threads = True
+    server.fake = fake
+    return server
+
+def _build_catalog(size, seed):
+    """Generate recipes and an index from ingredient name to recipe ids."""
+    rng = random.Random(seed)
+    vocabulary = ingredient_vocabulary()
+    # Recipes mostly call for plain staples, so weight base names higher
+    weights = [3.0 if name in BASE_INGREDIENTS else 1.0 for name in vocabulary]
+    
+    recipes = {}
+    by_ingredient = {}
+    for index in range(size):
+        recipe_id = 600000 + index
+        names = sorted(set(rng.choices(vocabulary, weights, k=rng.randint(4, 10))))
+        main = rng.choice(names)
+        recipes[recipe_id] = {
+            'id': recipe_id,
+            'title': f"{rng.choice(STYLES)} {main.title()} {rng.choice(DISH_TYPES)}",
+            'image': f"https://img.spoonacular.com/recipes/{recipe_id}-312x231.jpg",
+            'likes': rng.randint(0, 5000),
+            'readyInMinutes': rng.choice([15, 20, 25, 30, 45, 60, 90]),
+            'servings': rng.randint(1, 8),
+            'ingredients': [{
+                'id': 10000 + vocabulary.index(name),
+                'amount': rng.choice([0.5, 1, 2, 3, 100, 250]),
+                'unit': rng.choice(['cup', 'tbsp', 'g', 'ml', '']),
+                'name': name,
+                'original': name,
+                'image': f"https://img.spoonacular.com/ingredients_100x100/{name.replace(' ', '-')}.jpg"
+            } for name in names]
+        }
+        for name in names:
+            by_ingredient.setdefault(name, []).append(recipe_id)
+    
+    return recipes, by_ingredient
+
+def _information(recipe):
+    """Build the recipe information response of a catalog recipe."""
+    return {
+        'id': recipe['id'],
+        'title': recipe['title'],
+        'image': recipe['image'],
+        'imageType': 'jpg',
+        'readyInMinutes': recipe['readyInMinutes'],
+        'servings': recipe['servings'],
+        'sourceUrl': f"https://example.com/recipes/{recipe['id']}",
+        'aggregateLikes': recipe['likes'],
+        'extendedIngredients': recipe['ingredients'],
+        'summary': f"{recipe['title']} takes {recipe['readyInMinutes']} minutes and serves {recipe['servings']}.",
+        'instructions': "Combine the ingredients and cook until done."
+    }
+
+def _failure(code, message):
+    """Build an error body in the API's format."""
+    return {'status': 'failure', 'code': code, 'message': message}
+
+def _recording_key(path, params):
+    """Key of a recorded response: the path and sorted parameters, without the API key."""
+    query = urlencode(sorted((name, value) for name, value in params.items() if name != 'apiKey'))
+    return f"{path}?{query}"
+
+def main():
+    """Run the fake API from the command line."""
+    parser = argparse.ArgumentParser(description="Local stand-in for the Spoonacular API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--mode', choices=['synthetic', 'record', 'replay'], default='synthetic')
+    parser.add_argument('--cassette', help="JSON file of recorded responses (record and replay modes)")
+    parser.add_argument('--upstream', default=UPSTREAM_URL, help="Real API URL used when recording")
+    parser.add_argument('--latency-ms', type=float, default=0, help="Mean added latency")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Standard deviation of the added latency")
+    parser.add_argument('--error-rate', type=float, default=0, help="Fraction of requests answered with 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0, help="Fraction of requests answered with 429")
+    parser.add_argument('--hang-rate', type=float, default=0, help="Fraction of requests that hang")
+    parser.add_argument('--hang-seconds', type=float, default=60, help="How long hanging requests hang")
+    parser.add_argument('--quota', type=float, default=0, help="Daily points before answering 402, 0 for unlimited")
+    parser.add_argument('--catalog-size', type=int, default=2000, help="Number of synthetic recipes")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    
+    fake = FakeSpoonacular(
+        mode=args.mode, cassette=args.cassette, upstream=args.upstream,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+        quota=args.quota, catalog_size=args.catalog_size, seed=args.seed
+    )
+    server = _create_server(fake, args.host, args.port)
+    logger.info(f"Fake Spoonacular ({args.mode}) listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Served {fake.requests_served} requests, {fake.points_used:g} points used")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,459 @@
+"""
+Load test the bot in-process with synthetic Telegram updates.
+
+Builds the Application from main.py with a stub Bot API that records
+outgoing messages instead of sending them, fills a synthetic dataset and
+feeds commands, callback queries and locations of its users into the
+update queue at a target rate. Reports throughput, end-to-end latency per
+command and event loop lag for every rate step, to find the load at which
+latency degrades.
+
+Usage:
+    python -m benchmarks.load_test --backend mongomock --users 500 --rates 5 10 20 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from telegram import Update
+from telegram.request import BaseRequest
+from benchmarks.bench_matching import percentile
+from benchmarks.dataset import configure_environment, connect, generate
+from benchmarks.fake_spoonacular import FakeSpoonacular, start_fake_server
+
+logger = logging.getLogger(__name__)
+
+BOT_TOKEN = "123456:LOAD-TEST"
+BOT_ID = 123456
+
+# Relative frequency of each kind of update
+ACTION_WEIGHTS = {
+    'start': 4,
+    'help': 2,
+    'profile': 8,
+    'list': 10,
+    'matches': 20,
+    'search': 10,
+    'offer': 4,
+    'request': 4,
+    'callback_offer': 6,
+    'callback_request': 4,
+    'callback_contact': 3,
+    'callback_page': 6,
+    'callback_recipes': 3,
+    'location': 4,
+    'text': 2
+}
+
+class StubTelegramRequest(BaseRequest):
+    """
+    Bot API transport that answers locally and records what the bot sends.
+    
+    Every API method succeeds after an optional delay, with a result shaped
+    like Telegram's so the library can parse it.
+    """
+    
+    def __init__(self, latency_ms=0):
+        """Initialize the stub."""
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+        self.recipients = set()
+        self._message_id = 0
+    
+    @property
+    def read_timeout(self):
+        """Default read timeout, unused by the stub."""
+        return 5.0
+    
+    async def initialize(self):
+        """Nothing to set up."""
+    
+    async def shutdown(self):
+        """Nothing to clean up."""
+    
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        """Answer a Bot API call."""
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        
+        if endpoint == 'getMe':
+            result = {
+                'id': BOT_ID, 'is_bot': True, 'first_name': 'Load Test', 'username': 'load_test_bot',
+                'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False
+            }
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            self.recipients.add(chat_id)
+            self._message_id += 1
+            result = {
+                'message_id': int(params.get('message_id', self._message_id)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Load Test'},
+                'text': params.get('text', '')
+            }
+        else:
+            result = True
+        
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+class UpdateFactory:
+    """Build synthetic updates for the users of the generated dataset."""
+    
+    def __init__(self, bot, users, ingredients_by_user, seed=42):
+        """
+        Initialize the factory.
+        
+        Parameters:
+        - bot: The application's bot, attached to the updates
+        - users: User documents of the active users
+        - ingredients_by_user: Dictionary of user id to that user's ingredient documents
+        - seed: Random seed
+        """
+        self.bot = bot
+        self.users = users
+        self.ingredients_by_user = ingredients_by_user
+        self.rng = random.Random(seed)
+        self.actions = list(ACTION_WEIGHTS)
+        self.weights = list(ACTION_WEIGHTS.values())
+        self._update_id = 0
+        self._message_id = 0
+    
+    def next_update(self):
+        """Build a random update of a random active user."""
+        user = self.rng.choice(self.users)
+        action = self.rng.choices(self.actions, self.weights)[0]
+        pantry = self.ingredients_by_user.get(user['_id'], [])
+        names = [item['name'] for item in pantry if ' ' not in item['name']] or ['flour']
+        
+        if action == 'search':
+            return self._command(user, f"/search {self.rng.choice(names)}")
+        if action == 'offer':
+            return self._command(user, f"/offer {self.rng.choice(names)}")
+        if action == 'request':
+            return self._command(user, f"/request {self.rng.choice(names)}")
+        if action == 'callback_offer' and pantry:
+            return self._callback(user, f"offer_{self.rng.choice(pantry)['_id']}")
+        if action == 'callback_request':
+            return self._callback(user, f"request_{self.rng.choice(names)}")
+        if action == 'callback_contact':
+            return self._callback(user, f"contact_{self.rng.choice(self.users)['_id']}")
+        if action == 'callback_page':
+            return self._callback(user, self.rng.choice(['mpage_offer_1', 'mpage_request_1', 'matches']))
+        if action == 'callback_recipes':
+            return self._callback(user, 'recipe_details')
+        if action == 'location':
+            return self._location(user)
+        if action == 'text':
+            return self._message(user, {'text': "hello there"})
+        if action in ('help', 'profile', 'list', 'matches'):
+            return self._command(user, f"/{action}")
+        return self._command(user, "/start")
+    
+    def _command(self, user, text):
+        """Build a command message."""
+        command = text.split()[0]
+        return self._message(user, {
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        })
+    
+    def _location(self, user):
+        """Build a location message near the user's current location."""
+        location = user['location']
+        return self._message(user, {'location': {
+            'latitude': location['latitude'] + self.rng.uniform(-0.005, 0.005),
+            'longitude': location['longitude'] + self.rng.uniform(-0.005, 0.005)
+        }})
+    
+    def _message(self, user, fields):
+        """Build a private message update from a user."""
+        self._update_id += 1
+        self._message_id += 1
+        data = {
+            'update_id': self._update_id,
+            'message': {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': user['telegram_id'], 'type': 'private', 'first_name': user['name']},
+                'from': self._sender(user),
+                **fields
+            }
+        }
+        return Update.de_json(data, self.bot)
+    
+    def _callback(self, user, callback_data):
+        """Build a callback query update for a button under an earlier bot message."""
+        self._update_id += 1
+        data = {
+            'update_id': self._update_id,
+            'callback_query': {
+                'id': str(self._update_id),
+                'from': self._sender(user),
+                'chat_instance': str(user['telegram_id']),
+                'data': callback_data,
+                'message': {
+                    'message_id': self.rng.randint(1, 1000),
+                    'date': int(time.time()),
+                    'chat': {'id': user['telegram_id'], 'type': 'private', 'first_name': user['name']},
+                    'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Load Test'},
+                    'text': "Previous message"
+                }
+            }
+        }
+        return Update.de_json(data, self.bot)
+    
+    @staticmethod
+    def _sender(user):
+        """Build the Telegram user of a dataset user."""
+        return {'id': user['telegram_id'], 'is_bot': False, 'first_name': user['name']}
+
+class LoadStats:
+    """End-to-end latency of updates, from entering the queue to being handled."""
+    
+    def __init__(self):
+        """Initialize the stats."""
+        self.sent_at = {}
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+    
+    def sent(self, update):
+        """Record that an update entered the queue."""
+        self.sent_at[update.update_id] = time.perf_counter()
+    
+    def done(self, update):
+        """Record that an update has been handled."""
+        from bot.update_processor import describe_update
+        
+        sent_at = self.sent_at.pop(update.update_id, None)
+        if sent_at is not None:
+            self.latencies[describe_update(update)].append((time.perf_counter() - sent_at) * 1000)
+    
+    @property
+    def pending(self):
+        """Number of updates sent but not handled yet."""
+        return len(self.sent_at)
+
+def measuring_processor(stats, max_concurrent_updates):
+    """Create a PerUserUpdateProcessor that reports finished updates to stats."""
+    from bot.update_processor import PerUserUpdateProcessor
+    
+    class MeasuringUpdateProcessor(PerUserUpdateProcessor):
+        """Update processor that records when each update is done."""
+        
+        async def _timed(self, update, coroutine):
+            """Process the update and record its end-to-end latency."""
+            try:
+                await PerUserUpdateProcessor._timed(update, coroutine)
+            finally:
+                stats.done(update)
+    
+    return MeasuringUpdateProcessor(max_concurrent_updates)
+
+async def monitor_loop_lag(samples, interval=0.05):
+    """Measure how late the event loop wakes up a sleeping task, in ms."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, (time.perf_counter() - start - interval) * 1000))
+
+async def run_step(application, factory, rate, duration, drain_seconds):
+    """
+    Feed updates at a fixed rate and measure how the bot keeps up.
+    
+    Parameters:
+    - application: Started Application
+    - factory: UpdateFactory
+    - rate: Updates per second
+    - duration: Seconds to keep sending
+    - drain_seconds: Seconds to wait for queued updates after sending stops
+    
+    Returns:
+    - Dictionary with the step's results
+    """
+    from utils.metrics import UPDATES_DROPPED
+    
+    stats = application.bot_data['load_stats']
+    stats.latencies.clear()
+    stats.errors.clear()
+    lag_samples = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples))
+    dropped_before = UPDATES_DROPPED.total()
+    
+    total = int(rate * duration)
+    started = time.perf_counter()
+    # Open loop: updates are sent on schedule whether or not the bot keeps up
+    for index in range(total):
+        delay = started + index / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        update = factory.next_update()
+        stats.sent(update)
+        await application.update_queue.put(update)
+    send_seconds = time.perf_counter() - started
+    
+    deadline = time.perf_counter() + drain_seconds
+    while stats.pending and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    
+    lag_task.cancel()
+    all_latencies = sorted(value for values in stats.latencies.values() for value in values)
+    handled = len(all_latencies)
+    lag_samples.sort()
+    
+    result = {
+        'target_rate': rate,
+        'sent': total,
+        'sent_rate': total / send_seconds if send_seconds else None,
+        'handled': handled,
+        'unfinished': stats.pending,
+        'dropped': UPDATES_DROPPED.total() - dropped_before,
+        'errors': dict(stats.errors),
+        'throughput': handled / elapsed if elapsed else None,
+        'latency_ms': _summary(all_latencies),
+        'commands': {name: _summary(sorted(values)) for name, values in sorted(stats.latencies.items())},
+        'loop_lag_ms': {
+            'p50': percentile(lag_samples, 50),
+            'p99': percentile(lag_samples, 99),
+            'max': lag_samples[-1] if lag_samples else None
+        }
+    }
+    # Updates that never finished are forgotten so they don't count in the next step
+    stats.sent_at.clear()
+    return result
+
+async def run(args):
+    """Prepare the dataset and the bot, then run every rate step."""
+    from main import build_application, prepare_database
+    
+    client = connect(args.backend, args.uri)
+    counts = generate(args.users, seed=args.seed)
+    print(f"Generated {counts}")
+    start = time.perf_counter()
+    await asyncio.to_thread(prepare_database)
+    print(f"Prepared database in {time.perf_counter() - start:.1f}s")
+    
+    db = client[args.db_name]
+    rng = random.Random(args.seed)
+    users = list(db.users.find({}, {'offers': 0, 'requests': 0}))
+    users = rng.sample(users, min(args.active_users, len(users)))
+    ingredients_by_user = defaultdict(list)
+    for item in db.ingredients.find({'user_id': {'$in': [user['_id'] for user in users]}}, {'name': 1, 'user_id': 1}):
+        ingredients_by_user[item['user_id']].append(item)
+    
+    stats = LoadStats()
+    request = StubTelegramRequest(args.api_latency_ms)
+    application = build_application(
+        BOT_TOKEN, update_processor=measuring_processor(stats, args.max_concurrent_updates), request=request
+    )
+    application.bot_data['load_stats'] = stats
+    
+    async def count_error(update, context):
+        """Count handler exceptions by type."""
+        stats.errors[type(context.error).__name__] += 1
+    application.add_error_handler(count_error)
+    
+    factory = UpdateFactory(application.bot, users, ingredients_by_user, args.seed)
+    notifier = application.bot_data['notifier']
+    
+    steps = []
+    await application.initialize()
+    await application.start()
+    await notifier.start()
+    try:
+        for rate in args.rates:
+            print(f"\n== {rate} updates/s for {args.duration}s ==")
+            step = await run_step(application, factory, rate, args.duration, args.drain_seconds)
+            steps.append(step)
+            print(_format_step(step))
+            
+            # Stop once the bot clearly can't keep up, higher rates only take longer
+            p95 = step['latency_ms']['p95']
+            if step['unfinished'] or (p95 is not None and p95 > args.latency_slo_ms):
+                print(f"Latency objective of {args.latency_slo_ms:g}ms exceeded, stopping")
+                break
+    finally:
+        await notifier.stop()
+        await application.stop()
+        await application.shutdown()
+    
+    return {'dataset': counts, 'steps': steps, 'bot_api_calls': dict(request.calls)}
+
+def _summary(sorted_values):
+    """Summarize sorted latencies."""
+    return {
+        'count': len(sorted_values),
+        'p50': percentile(sorted_values, 50),
+        'p95': percentile(sorted_values, 95),
+        'p99': percentile(sorted_values, 99),
+        'max': sorted_values[-1] if sorted_values else None
+    }
+
+def _format_step(step):
+    """Format the results of one step for the console."""
+    def ms(value):
+        return f"{value:.0f}ms" if value is not None else "-"
+    
+    latency = step['latency_ms']
+    lines = [
+        f"sent {step['sent']} ({step['sent_rate']:.1f}/s), handled {step['handled']} "
+        f"({step['throughput']:.1f}/s), unfinished {step['unfinished']}, dropped {step['dropped']:g}, "
+        f"errors {sum(step['errors'].values())}",
+        f"latency p50={ms(latency['p50'])} p95={ms(latency['p95'])} p99={ms(latency['p99'])} max={ms(latency['max'])}",
+        f"event loop lag p50={ms(step['loop_lag_ms']['p50'])} p99={ms(step['loop_lag_ms']['p99'])} "
+        f"max={ms(step['loop_lag_ms']['max'])}"
+    ]
+    for name, summary in step['commands'].items():
+        lines.append(f"  {name:<24} n={summary['count']:<5} p50={ms(summary['p50'])} p95={ms(summary['p95'])}")
+    return "\n".join(lines)
+
+def main():
+    """Run the load test from the command line."""
+    parser = argparse.ArgumentParser(description="Load test the bot with synthetic updates")
+    parser.add_argument('--rates', type=float, nargs='+', default=[5, 10, 20, 50], help="Updates per second, one step each")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds per rate step")
+    parser.add_argument('--drain-seconds', type=float, default=30, help="Seconds to wait for queued updates after each step")
+    parser.add_argument('--latency-slo-ms', type=float, default=2000, help="Stop once p95 latency exceeds this")
+    parser.add_argument('--users', type=int, default=1000, help="Users in the generated dataset")
+    parser.add_argument('--active-users', type=int, default=200, help="Users sending updates")
+    parser.add_argument('--max-concurrent-updates', type=int, default=32)
+    parser.add_argument('--api-latency-ms', type=float, default=30, help="Simulated Bot API round trip")
+    parser.add_argument('--backend', choices=['mongod', 'mongomock'], default='mongod')
+    parser.add_argument('--uri', help="MongoDB URI for the mongod backend (default: MONGODB_URI)")
+    parser.add_argument('--db-name', default='ingredient_exchanger_bench', help="Database to use, dropped first")
+    parser.add_argument('--fake-recipe-api', action='store_true', help="Serve recipe calls from a local fake API")
+    parser.add_argument('--recipe-latency-ms', type=float, default=150, help="Added latency of the fake recipe API")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="JSON file to write the results to")
+    args = parser.parse_args()
+    
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.ERROR)
+    recipe_api_url = None
+    if args.fake_recipe_api:
+        _, recipe_api_url = start_fake_server(FakeSpoonacular(latency_ms=args.recipe_latency_ms, seed=args.seed))
+    configure_environment(args.db_name, recipe_api_url)
+    
+    results = asyncio.run(run(args))
+    if args.output:
+        report = {
+            'created_at': datetime.now().isoformat(),
+            'backend': args.backend,
+            'options': vars(args),
+            **results
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+if __name__ == '__main__':
+    main()
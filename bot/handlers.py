@@ -1,16 +1,285 @@
+import asyncio
+import io
+import itertools
 import logging
+import time
+from datetime import timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram.error import TelegramError
 from telegram.ext import CallbackContext, ConversationHandler
 from models.user import User
 from models.ingredient import Ingredient
-from services.matching import find_nearby_users, find_matching_recipes
+from services.matching import find_matching_recipes, find_offerers_page
+from services.communities import find_community_recipes
+from services.availability import available_near, OFFERED, REQUESTED
+from services.match_store import (
+    get_matches_page, count_matches, get_ingredient_matches, get_swaps, data_version, OFFER, REQUEST
+)
+from config import MATCH_SESSION_TTL_SECONDS, MAX_IMPORT_FILE_BYTES, MAX_OFFER_DAYS, RECIPE_LOOKUP_DEADLINE_SECONDS
+from utils.metrics import CACHE_REQUESTS
+from utils.deadline import budget, detached
 from services.recipe_service import get_recipe_by_ingredients
+from services.pantry_import import parse_pantry_line, import_pantry, format_import_summary
+from services.expiry import format_time_left
 
 logger = logging.getLogger(__name__)
 
 # Conversation states
 NAME, LOCATION = range(2)
 
+# Keys in context.user_data holding the last computed matches and page cursors
+MATCH_SESSION_KEY = 'match_session'
+MATCH_PAGES_KEY = 'match_pages'
+SEARCH_PAGES_KEY = 'search_pages'
+# Key in context.user_data holding, per message ID, the view waiting for recipes to replace its placeholder
+PENDING_VIEWS_KEY = 'pending_views'
+
+# Results shown per page
+MATCHES_PAGE_SIZE = 5
+SEARCH_PAGE_SIZE = 8
+RECIPE_SUGGESTIONS = 5  # Recipes shown in the recipe details view
+SWAPS_SHOWN = 3  # Two-way swaps shown in the matches view
+
+# Time a recipe lookup gets past its budget to hand back its partial results
+RECIPE_LOOKUP_GRACE_SECONDS = 2
+
+async def respond(update: Update, text, **kwargs):
+    """Reply to a message, or edit the message whose button was pressed, and return the message shown."""
+    if update.callback_query:
+        return await update.callback_query.edit_message_text(text, **kwargs)
+    return await update.message.reply_text(text, **kwargs)
+
+async def find_recipes_before_deadline(user_data, matches, limit=None):
+    """
+    Find recipes for a user's matches in a thread, within RECIPE_LOOKUP_DEADLINE_SECONDS.
+    
+    The lookup runs on a time budget of its own, since it outlives the
+    update that started it. Once the budget runs out it stops asking the
+    recipe API and returns what it found so far.
+    
+    Returns:
+    - List of recipe matches, or None if the budget ran out before any were found
+    """
+    with budget('recipe_lookup', RECIPE_LOOKUP_DEADLINE_SECONDS) as lookup:
+        try:
+            # Waited for a little longer, the thread returns its partial results by itself
+            recipe_matches = await asyncio.wait_for(
+                asyncio.to_thread(find_matching_recipes, user_data, matches, limit),
+                RECIPE_LOOKUP_DEADLINE_SECONDS + RECIPE_LOOKUP_GRACE_SECONDS
+            )
+        except asyncio.TimeoutError:
+            recipe_matches = None
+        
+        if lookup.exhausted() and not recipe_matches:
+            logger.warning(f"Recipe lookup for user {user_data.id} missed its deadline")
+            return None
+        return recipe_matches
+
+_view_tokens = itertools.count()
+
+def track_view(context: CallbackContext, message):
+    """
+    Remember that a message shows a placeholder to be replaced once recipes are found.
+    
+    Returns:
+    - Token of the view, current until the message shows something else
+    """
+    token = next(_view_tokens)
+    context.user_data.setdefault(PENDING_VIEWS_KEY, {})[message.message_id] = token
+    return token
+
+def start_task(context: CallbackContext, coroutine, update=None):
+    """Run a coroutine in the background, outside of the time budget of the update starting it."""
+    return detached(context.application.create_task, coroutine, update=update)
+
+def start_recipe_lookup(context: CallbackContext, session):
+    """
+    Start finding the recipes of a match session in the background, unless already started.
+    
+    Returns:
+    - The task, which fills in session['recipe_matches'] and returns whether it did
+    """
+    task = session.get('recipe_task')
+    if task is None:
+        task = start_task(context, _lookup_session_recipes(session))
+        session['recipe_task'] = task
+    return task
+
+async def _lookup_session_recipes(session):
+    """Find the recipes of a match session, leaving it to be retried if the lookup runs out of time."""
+    user_data = await asyncio.to_thread(User.find_by_id, session['user_id'])
+    recipe_matches = None
+    if user_data:
+        recipe_matches = await find_recipes_before_deadline(
+            user_data, session['offer_matches'] + session['request_matches'], RECIPE_SUGGESTIONS
+        )
+    
+    if recipe_matches is None:
+        session['recipe_task'] = None
+        return False
+    session['recipe_matches'] = recipe_matches
+    return True
+
+async def edit_when_recipes_found(context: CallbackContext, session, message, render, view):
+    """
+    Wait for a session's recipes, then replace a placeholder message.
+    
+    The message is left alone if the user moved on to another view of it,
+    like another page or the recipe details, in the meantime.
+    
+    Parameters:
+    - session: Match session whose recipes are being looked up
+    - message: Message showing the placeholder
+    - render: Function building the (text, reply_markup) of the message from the session
+    - view: Token track_view() returned when the placeholder was shown
+    """
+    found = await start_recipe_lookup(context, session)
+    pending = context.user_data.get(PENDING_VIEWS_KEY, {})
+    if pending.get(message.message_id) != view:
+        return
+    del pending[message.message_id]
+    
+    text, reply_markup = render(session, timed_out=not found)
+    try:
+        await message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    except TelegramError as e:
+        # The user may have moved on to another view or deleted the message
+        logger.info(f"Could not show found recipes: {e}")
+
+async def add_recipe_count(user_data, matches, message, text):
+    """Look for recipes with the given matches, then replace a message's placeholder with what was found."""
+    recipe_matches = await find_recipes_before_deadline(user_data, matches)
+    if recipe_matches:
+        text += (
+            f"\n\n🍳 I found {len(recipe_matches)} recipes you could make by combining pantries with neighbors!\n"
+            f"Use /matches to see recipe suggestions."
+        )
+    
+    try:
+        await message.edit_text(text)
+    except TelegramError as e:
+        logger.info(f"Could not show found recipes: {e}")
+
+def compute_match_session(user_data):
+    """
+    Read a user's matches and the recipes of their neighborhood.
+    
+    Recipes for pairs of neighbors take many recipe API calls, so they are
+    left as None to be found in the background by start_recipe_lookup().
+    """
+    # Take the version first so changes made while computing invalidate the result
+    version = data_version(user_data.id)
+    
+    # Only the first page of each section is loaded
+    offer_matches, next_offer_page = get_matches_page(user_data.id, OFFER, limit=MATCHES_PAGE_SIZE)
+    request_matches, next_request_page = get_matches_page(user_data.id, REQUEST, limit=MATCHES_PAGE_SIZE)
+    
+    # Neighbors who have what the user needs and need what the user has
+    swaps = get_swaps(user_data.id, limit=SWAPS_SHOWN)
+    
+    # Counting is only needed when there is more than one page
+    offer_count = count_matches(user_data.id, OFFER) if next_offer_page else len(offer_matches)
+    request_count = count_matches(user_data.id, REQUEST) if next_request_page else len(request_matches)
+    
+    # Recipes of the user's neighborhood are precomputed, pairs of neighbors are only tried outside one
+    recipe_matches = find_community_recipes(user_data, limit=RECIPE_SUGGESTIONS)
+    if not recipe_matches:
+        recipe_matches = None if offer_matches or request_matches else []
+    
+    return {
+        'user_id': user_data.id,
+        'version': version,
+        'expires_at': time.monotonic() + MATCH_SESSION_TTL_SECONDS,
+        'offer_matches': offer_matches,
+        'request_matches': request_matches,
+        'offer_count': offer_count,
+        'request_count': request_count,
+        'swaps': swaps,
+        'recipe_matches': recipe_matches,
+        'page_cursors': {
+            OFFER: [None, next_offer_page] if next_offer_page else [None],
+            REQUEST: [None, next_request_page] if next_request_page else [None]
+        }
+    }
+
+def load_match_session(context: CallbackContext):
+    """Get the user's last computed matches if they are still current."""
+    session = context.user_data.get(MATCH_SESSION_KEY)
+    if not session:
+        CACHE_REQUESTS.inc(cache='match_session', result='miss')
+        return None
+    
+    if session['expires_at'] < time.monotonic() or session['version'] != data_version(session['user_id']):
+        del context.user_data[MATCH_SESSION_KEY]
+        CACHE_REQUESTS.inc(cache='match_session', result='miss')
+        return None
+    
+    CACHE_REQUESTS.inc(cache='match_session', result='hit')
+    return session
+
+async def get_match_session(update: Update, context: CallbackContext):
+    """
+    Get the user's matches and recipe suggestions.
+    
+    The result is kept in user_data for a short time, so navigating between
+    the matches and recipe views doesn't query Mongo or the recipe API again.
+    Returns None after telling the user why if there is nothing to show.
+    """
+    session = load_match_session(context)
+    if session:
+        return session
+    
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, update.effective_user.id)
+    
+    if not user_data:
+        await respond(update, "You need to register first! Use /register to create your profile.")
+        return None
+    
+    if not user_data.location:
+        await respond(update, "You need to set your location first! Use /setlocation to continue.")
+        return None
+    
+    session = await asyncio.to_thread(compute_match_session, user_data)
+    context.user_data[MATCH_SESSION_KEY] = session
+    context.user_data[MATCH_PAGES_KEY] = {'user_id': user_data.id, **session['page_cursors']}
+    return session
+
+def get_notifier(context: CallbackContext):
+    """Get the notification dispatcher shared by all handlers."""
+    return context.bot_data['notifier']
+
+def cook_names(match):
+    """Name the neighbors a recipe suggestion needs, like "Anna" or "Anna and 2 more neighbors"."""
+    others = len(match.get('partners', [])) - 1
+    if others > 0:
+        return f"{match['user'].name} and {others} more neighbor{'s' if others > 1 else ''}"
+    return match['user'].name
+
+def find_ingredient_matches(user_data, name, direction):
+    """
+    Read a user's matches for one ingredient.
+    
+    Nobody nearby offering or requesting it is seen in the availability map
+    first, without reading any matches.
+    """
+    if not available_near(user_data.location, name, REQUESTED if direction == OFFER else OFFERED):
+        return []
+    return get_ingredient_matches(user_data.id, name, direction)
+
+def notify_matches(context: CallbackContext, user_data, matches, ingredient_name) -> None:
+    """Let matched neighbors know about a new offer or request."""
+    notifier = get_notifier(context)
+    
+    for match in matches:
+        distance = match['distance']
+        if match.get('match_type') == 'offer':
+            text = f"📣 {user_data.name} (within {distance:.1f}km) is offering {ingredient_name}, which you requested!\n"
+        else:
+            text = f"📣 {user_data.name} (within {distance:.1f}km) is looking for {ingredient_name}, which you're offering!\n"
+        text += "Use /matches to get in touch."
+        
+        notifier.notify(match['user'].telegram_id, text)
+
 async def start_command(update: Update, context: CallbackContext) -> None:
     """Send a welcome message when the command /start is issued."""
     user = update.effective_user
@@ -44,13 +313,14 @@ async def help_command(update: Update, context: CallbackContext) -> None:
         "/setlocation - Update your location\n\n"
         
         "*Ingredient Management:*\n"
-        "/add <ingredient name> <amount> <unit> - Add ingredient to your pantry\n"
+        "/add <ingredient name> <amount> <unit> - Add ingredient to your pantry "
+        "(one per line to add several, or send a CSV file)\n"
         "/remove <ingredient name> - Remove ingredient from your pantry\n"
         "/list - List all your ingredients\n\n"
         
         "*Exchange Functions:*\n"
-        "/offer <ingredient> - Offer an ingredient to share\n"
-        "/request <ingredient> - Request an ingredient you need\n"
+        "/offer <ingredient> [days] - Offer an ingredient to share, for as long as it keeps or the given days\n"
+        "/request <ingredient> - Request an ingredient you need for the next week\n"
         "/matches - See potential ingredient matches nearby\n"
         "/search <ingredient> - Search for specific ingredient offers nearby\n\n"
         
@@ -63,7 +333,7 @@ async def register_command(update: Update, context: CallbackContext) -> int:
     user = update.effective_user
     
     # Check if user is already registered
-    existing_user = User.find_by_telegram_id(user.id)
+    existing_user = await asyncio.to_thread(User.find_by_telegram_id, user.id)
     if existing_user:
         await update.message.reply_text(
             f"You're already registered as {existing_user.name}!\n"
@@ -79,7 +349,7 @@ async def register_command(update: Update, context: CallbackContext) -> int:
 async def profile_command(update: Update, context: CallbackContext) -> None:
     """Show user profile and settings."""
     user = update.effective_user
-    user_data = User.find_by_telegram_id(user.id)
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
     
     if not user_data:
         await update.message.reply_text(
@@ -88,7 +358,7 @@ async def profile_command(update: Update, context: CallbackContext) -> None:
         return
     
     # Get user's ingredients
-    ingredients = Ingredient.find_by_user_id(user_data.id)
+    ingredients = await asyncio.to_thread(Ingredient.find_by_user_id, user_data.id)
     ingredient_list = "\n".join([f"• {ing.name} ({ing.amount} {ing.unit})" for ing in ingredients]) if ingredients else "No ingredients added yet"
     
     profile_text = (
@@ -96,8 +366,8 @@ async def profile_command(update: Update, context: CallbackContext) -> None:
         f"Name: {user_data.name}\n"
         f"Location: {'Set' if user_data.location else 'Not set'}\n"
         f"Total Ingredients: {len(ingredients)}\n"
-        f"Active Offers: {len(user_data.offers)}\n"
-        f"Active Requests: {len(user_data.requests)}\n\n"
+        f"Active Offers: {len(user_data.active_offers())}\n"
+        f"Active Requests: {len(user_data.active_requests())}\n\n"
         f"*Your Ingredients:*\n{ingredient_list}"
     )
     
@@ -113,7 +383,7 @@ async def profile_command(update: Update, context: CallbackContext) -> None:
 async def set_location_command(update: Update, context: CallbackContext) -> int:
     """Set or update user location."""
     user = update.effective_user
-    user_data = User.find_by_telegram_id(user.id)
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
     
     if not user_data:
         await update.message.reply_text(
@@ -128,7 +398,7 @@ async def set_location_command(update: Update, context: CallbackContext) -> int:
             "longitude": update.message.location.longitude
         }
         
-        User.update_location(user_data.id, location)
+        await asyncio.to_thread(User.update_location, user_data.id, location)
         await update.message.reply_text(
             "Your location has been updated successfully! Now you can start sharing ingredients with neighbors."
         )
@@ -148,7 +418,7 @@ async def set_location_command(update: Update, context: CallbackContext) -> int:
 async def add_ingredient_command(update: Update, context: CallbackContext) -> None:
     """Add an ingredient to user's pantry."""
     user = update.effective_user
-    user_data = User.find_by_telegram_id(user.id)
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
     
     if not user_data:
         await update.message.reply_text(
@@ -156,32 +426,71 @@ async def add_ingredient_command(update: Update, context: CallbackContext) -> No
         )
         return
     
-    args = context.args
-    if len(args) < 2:
+    # Everything after the command, one ingredient per line
+    first_line, _, rest = update.message.text.partition('\n')
+    lines = [first_line.partition(' ')[2]] + rest.split('\n')
+    lines = [line for line in lines if line.strip()]
+    if not lines:
         await update.message.reply_text(
             "Please provide ingredient name and amount.\n"
-            "Example: /add flour 500 g"
+            "Example: /add flour 500 g\n\n"
+            "To add several at once, put one ingredient per line after /add, "
+            "or send me a CSV or text file with one ingredient per line."
         )
         return
     
-    name = args[0].lower()
-    amount = args[1]
-    unit = args[2] if len(args) > 2 else ""
+    result = await asyncio.to_thread(import_pantry, user_data.id, lines)
     
-    result = Ingredient.add(user_data.id, name, amount, unit)
-    if result:
+    if len(lines) == 1 and result['added'] + result['updated'] == 1:
+        name, amount, unit = parse_pantry_line(lines[0])
         await update.message.reply_text(
             f"✅ Added {amount} {unit} of {name} to your pantry!"
         )
+    elif len(lines) == 1 and result['invalid']:
+        await update.message.reply_text(
+            "Please provide ingredient name and amount.\n"
+            "Example: /add flour 500 g"
+        )
     else:
+        await update.message.reply_text(format_import_summary(result))
+
+async def import_pantry_document(update: Update, context: CallbackContext) -> None:
+    """Add the ingredients listed in an uploaded CSV or text file."""
+    user = update.effective_user
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
+    
+    if not user_data:
         await update.message.reply_text(
-            "Failed to add ingredient. Please try again."
+            "You need to register first! Use /register to create your profile."
         )
+        return
+    
+    document = update.message.document
+    file_name = (document.file_name or "").lower()
+    if not (file_name.endswith(('.csv', '.txt')) or (document.mime_type or "").startswith('text/')):
+        await update.message.reply_text(
+            "I can only import CSV or text files with one ingredient per line, like:\n"
+            "flour,500,g\neggs,12"
+        )
+        return
+    
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_BYTES:
+        await update.message.reply_text(
+            f"That file is too big. Please send at most {MAX_IMPORT_FILE_BYTES // 1024} KB."
+        )
+        return
+    
+    telegram_file = await document.get_file()
+    content = await telegram_file.download_as_bytearray()
+    lines = io.StringIO(bytes(content).decode('utf-8-sig', errors='replace'))
+    
+    result = await asyncio.to_thread(import_pantry, user_data.id, lines)
+    await update.message.reply_text(format_import_summary(result))
 
 async def remove_ingredient_command(update: Update, context: CallbackContext) -> None:
     """Remove an ingredient from user's pantry."""
     user = update.effective_user
-    user_data = User.find_by_telegram_id(user.id)
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
     
     if not user_data:
         await update.message.reply_text(
@@ -198,7 +507,7 @@ async def remove_ingredient_command(update: Update, context: CallbackContext) ->
         return
     
     name = args[0].lower()
-    result = Ingredient.remove(user_data.id, name)
+    result = await asyncio.to_thread(Ingredient.remove, user_data.id, name)
     
     if result:
         await update.message.reply_text(
@@ -212,7 +521,7 @@ async def remove_ingredient_command(update: Update, context: CallbackContext) ->
 async def list_ingredients_command(update: Update, context: CallbackContext) -> None:
     """List all ingredients in user's pantry."""
     user = update.effective_user
-    user_data = User.find_by_telegram_id(user.id)
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
     
     if not user_data:
         await update.message.reply_text(
@@ -220,7 +529,7 @@ async def list_ingredients_command(update: Update, context: CallbackContext) ->
         )
         return
     
-    ingredients = Ingredient.find_by_user_id(user_data.id)
+    ingredients = await asyncio.to_thread(Ingredient.find_by_user_id, user_data.id)
     
     if not ingredients:
         await update.message.reply_text(
@@ -252,7 +561,7 @@ async def list_ingredients_command(update: Update, context: CallbackContext) ->
 async def offer_command(update: Update, context: CallbackContext) -> None:
     """Offer an ingredient to share with neighbors."""
     user = update.effective_user
-    user_data = User.find_by_telegram_id(user.id)
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
     
     if not user_data:
         await update.message.reply_text(
@@ -269,7 +578,7 @@ async def offer_command(update: Update, context: CallbackContext) -> None:
     args = context.args
     if not args:
         # Show list of user's ingredients as buttons
-        ingredients = Ingredient.find_by_user_id(user_data.id)
+        ingredients = await asyncio.to_thread(Ingredient.find_by_user_id, user_data.id)
         
         if not ingredients:
             await update.message.reply_text(
@@ -290,9 +599,19 @@ async def offer_command(update: Update, context: CallbackContext) -> None:
         )
         return
     
-    # User specified ingredient in command
+    # User specified ingredient in command, optionally followed by how many days to offer it
     name = args[0].lower()
-    ingredient = Ingredient.find_by_name_and_user(user_data.id, name)
+    shelf_life = None
+    if len(args) > 1:
+        if not args[1].isdigit() or not 1 <= int(args[1]) <= MAX_OFFER_DAYS:
+            await update.message.reply_text(
+                f"Please give the number of days to offer {name} for, between 1 and {MAX_OFFER_DAYS}.\n"
+                f"Example: /offer {name} 3"
+            )
+            return
+        shelf_life = timedelta(days=int(args[1]))
+    
+    ingredient = await asyncio.to_thread(Ingredient.find_by_name_and_user, user_data.id, name)
     
     if not ingredient:
         await update.message.reply_text(
@@ -301,18 +620,21 @@ async def offer_command(update: Update, context: CallbackContext) -> None:
         return
     
     # Create offer
-    result = User.add_offer(user_data.id, ingredient.id)
+    if shelf_life is None:
+        shelf_life = Ingredient.shelf_life(ingredient.category)
+    expires_at = await asyncio.to_thread(User.add_offer, user_data.id, ingredient.id, shelf_life)
     
-    if result:
+    if expires_at:
         await update.message.reply_text(
-            f"✅ You're now offering {name} to your neighbors!\n"
+            f"✅ You're now offering {name} to your neighbors for the next {format_time_left(expires_at)}!\n"
             f"I'll notify you when someone nearby is interested."
         )
         
         # Find matching requests in the area
-        matches = find_nearby_users(user_data, ingredient)
+        matches = await asyncio.to_thread(find_ingredient_matches, user_data, name, OFFER)
         
         if matches:
+            notify_matches(context, user_data, matches, name)
             await update.message.reply_text(
                 f"📣 Good news! {len(matches)} neighbors are looking for {name}!\n"
                 f"Use /matches to see potential matches."
@@ -325,7 +647,7 @@ async def offer_command(update: Update, context: CallbackContext) -> None:
 async def request_command(update: Update, context: CallbackContext) -> None:
     """Request an ingredient from neighbors."""
     user = update.effective_user
-    user_data = User.find_by_telegram_id(user.id)
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
     
     if not user_data:
         await update.message.reply_text(
@@ -352,30 +674,29 @@ async def request_command(update: Update, context: CallbackContext) -> None:
     unit = args[2] if len(args) > 2 else ""
     
     # Create request
-    result = User.add_request(user_data.id, name, amount, unit)
+    expires_at = await asyncio.to_thread(User.add_request, user_data.id, name, amount, unit)
     
-    if result:
+    if expires_at:
         await update.message.reply_text(
-            f"✅ You're now requesting {amount} {unit} {name} from neighbors!\n"
+            f"✅ You're now requesting {amount} {unit} {name} from neighbors for the next {format_time_left(expires_at)}!\n"
             f"I'll notify you when someone nearby can help."
         )
         
         # Find matching offers in the area
-        matches = find_nearby_users(user_data, name=name)
+        matches = await asyncio.to_thread(find_ingredient_matches, user_data, name, REQUEST)
         
         if matches:
-            await update.message.reply_text(
+            notify_matches(context, user_data, matches, name)
+            good_news = (
                 f"📣 Good news! {len(matches)} neighbors are offering {name}!\n"
                 f"Use /matches to see potential matches."
             )
+            message = await update.message.reply_text(
+                good_news + "\n\n🍳 Looking for recipes you could make with them..."
+            )
             
-            # Check if we can suggest recipes
-            recipe_matches = find_matching_recipes(user_data, matches)
-            if recipe_matches:
-                await update.message.reply_text(
-                    f"🍳 I found {len(recipe_matches)} recipes you could make by combining pantries with neighbors!\n"
-                    f"Use /matches to see recipe suggestions."
-                )
+            # Check if we can suggest recipes, without keeping the user waiting
+            start_task(context, add_recipe_count(user_data, matches, message, good_news), update=update)
     else:
         await update.message.reply_text(
             "Failed to create request. Please try again."
@@ -383,80 +704,81 @@ async def request_command(update: Update, context: CallbackContext) -> None:
 
 async def matches_command(update: Update, context: CallbackContext) -> None:
     """Show potential matches for user's offers and requests."""
-    user = update.effective_user
-    user_data = User.find_by_telegram_id(user.id)
-    
-    if not user_data:
-        await update.message.reply_text(
-            "You need to register first! Use /register to create your profile."
-        )
-        return
-    
-    if not user_data.location:
-        await update.message.reply_text(
-            "You need to set your location first! Use /setlocation to continue."
-        )
+    session = await get_match_session(update, context)
+    if not session:
         return
     
-    # Get matches for user's offers
-    offer_matches = []
-    for offer in user_data.offers:
-        ing = Ingredient.find_by_id(offer['ingredient_id'])
-        if ing:
-            nearby_matches = find_nearby_users(user_data, ing)
-            offer_matches.extend(nearby_matches)
-    
-    # Get matches for user's requests
-    request_matches = []
-    for request in user_data.requests:
-        nearby_matches = find_nearby_users(user_data, name=request['ingredient'])
-        request_matches.extend(nearby_matches)
-    
-    # Get recipe suggestions
-    recipe_matches = []
-    all_matches = offer_matches + request_matches
-    if all_matches:
-        recipe_matches = find_matching_recipes(user_data, all_matches)
-    
-    if not (offer_matches or request_matches):
-        await update.message.reply_text(
+    if not (session['offer_matches'] or session['request_matches']):
+        await respond(
+            update,
             "No matches found nearby yet. Try offering or requesting more ingredients!"
         )
         return
     
+    # Matches are shown right away, recipes are filled in once found
+    message, reply_markup = render_matches(session)
+    message = await respond(update, message, reply_markup=reply_markup, parse_mode="Markdown")
+    if session['recipe_matches'] is None:
+        view = track_view(context, message)
+        start_task(context, edit_when_recipes_found(context, session, message, render_matches, view), update=update)
+
+def render_matches(session, timed_out=False):
+    """Build the text and buttons of the matches view."""
+    offer_matches = session['offer_matches']
+    request_matches = session['request_matches']
+    offer_count = session['offer_count']
+    request_count = session['request_count']
+    recipe_matches = session['recipe_matches']
+    swaps = session['swaps']
+    
     # Build the message
     message = "🔍 *Your Matches* 🔍\n\n"
     
+    if swaps:
+        message += "*Swap* - you each have what the other needs:\n"
+        for swap in swaps:
+            distance = swap['distance']
+            user_name = swap['user'].name
+            message += (
+                f"• {user_name} (within {distance:.1f}km): "
+                f"your {', '.join(swap['gives'])} for their {', '.join(swap['gets'])}\n"
+            )
+        message += "\n"
+    
     if offer_matches:
         message += "*People who need your ingredients:*\n"
-        for match in offer_matches[:5]:  # Limit to 5 matches
+        for match in offer_matches:
             distance = match['distance']
             user_name = match['user'].name
             ing_name = match['ingredient']
             message += f"• {user_name} (within {distance:.1f}km) needs {ing_name}\n"
         
-        if len(offer_matches) > 5:
-            message += f"...and {len(offer_matches) - 5} more\n"
+        if offer_count > len(offer_matches):
+            message += f"...and {offer_count - len(offer_matches)} more\n"
         message += "\n"
     
     if request_matches:
         message += "*People who have ingredients you need:*\n"
-        for match in request_matches[:5]:  # Limit to 5 matches
+        for match in request_matches:
             distance = match['distance']
             user_name = match['user'].name
             ing_name = match['ingredient']
             message += f"• {user_name} (within {distance:.1f}km) has {ing_name}\n"
         
-        if len(request_matches) > 5:
-            message += f"...and {len(request_matches) - 5} more\n"
+        if request_count > len(request_matches):
+            message += f"...and {request_count - len(request_matches)} more\n"
         message += "\n"
     
-    if recipe_matches:
+    if recipe_matches is None:
+        if timed_out:
+            message += "🍳 Finding recipes took too long, try again in a moment.\n"
+        else:
+            message += "🍳 _Finding recipes you could make together..._\n"
+    elif recipe_matches:
         message += "*Recipe Suggestions:*\n"
         for match in recipe_matches[:3]:  # Limit to 3 recipe suggestions
             recipe = match['recipe']
-            user_name = match['user'].name
-            message += f"• You and {user_name} could make {recipe['title']}\n"
+            message += f"• You and {cook_names(match)} could make {recipe['title']}\n"
         
         if len(recipe_matches) > 3:
             message += f"...and {len(recipe_matches) - 3} more recipe ideas\n"
@@ -464,25 +786,68 @@ async def matches_command(update: Update, context: CallbackContext) -> None:
     # Add contact buttons
     keyboard = []
     
-    all_user_matches = set()
-    for match in offer_matches + request_matches:
-        all_user_matches.add(match['user'].id)
+    all_user_matches = {}
+    for match in swaps + offer_matches + request_matches:
+        all_user_matches.setdefault(match['user'].id, match['user'])
+    
+    for user_id, user_obj in list(all_user_matches.items())[:5]:  # Limit to 5 users
+        keyboard.append([InlineKeyboardButton(f"Contact {user_obj.name}", callback_data=f"contact_{user_id}")])
     
-    for user_id in list(all_user_matches)[:5]:  # Limit to 5 users
-        user_obj = User.find_by_id(user_id)
-        if user_obj:
-            keyboard.append([InlineKeyboardButton(f"Contact {user_obj.name}", callback_data=f"contact_{user_id}")])
+    if offer_count > len(offer_matches):
+        keyboard.append([InlineKeyboardButton("More people who need your ingredients ▶", callback_data=f"mpage_{OFFER}_1")])
+    if request_count > len(request_matches):
+        keyboard.append([InlineKeyboardButton("More people who have what you need ▶", callback_data=f"mpage_{REQUEST}_1")])
     
     keyboard.append([InlineKeyboardButton("See Recipe Details", callback_data="recipe_details")])
     keyboard.append([InlineKeyboardButton("Close", callback_data="cancel")])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(message, reply_markup=reply_markup, parse_mode="Markdown")
+    return message, InlineKeyboardMarkup(keyboard)
+
+def render_recipes(session, timed_out=False):
+    """Build the text and buttons of the recipe details view."""
+    recipe_matches = session['recipe_matches']
+    back = InlineKeyboardMarkup([[InlineKeyboardButton("Back", callback_data="matches")]])
+    
+    if recipe_matches is None:
+        if timed_out:
+            return "🍳 Finding recipes took too long, try again in a moment.", back
+        return "🍳 *Recipe Suggestions* 🍳\n\n_Finding recipes you could make with your neighbors..._", back
+    
+    if not recipe_matches:
+        return "No recipe suggestions found. Try adding more ingredients or connecting with more neighbors!", None
+    
+    # Build the message
+    message = "🍳 *Recipe Suggestions* 🍳\n\n"
+    
+    for i, match in enumerate(recipe_matches[:RECIPE_SUGGESTIONS]):
+        recipe = match['recipe']
+        missing_ingredients = match.get('missing_ingredients', [])
+        
+        message += f"*{i+1}. {recipe['title']}*\n"
+        message += f"Cook with: {cook_names(match)}\n"
+        message += f"Cook time: {recipe.get('readyInMinutes', 'N/A')} minutes\n"
+        message += f"Servings: {recipe.get('servings', 'N/A')}\n"
+        
+        if missing_ingredients:
+            message += f"Still needed: {', '.join(missing_ingredients)}\n"
+        
+        message += "\n"
+    
+    # Add action buttons
+    keyboard = []
+    for i, match in enumerate(recipe_matches[:3]):
+        recipe = match['recipe']
+        keyboard.append([InlineKeyboardButton(f"View Recipe #{i+1}", url=recipe.get('sourceUrl', ''))])
+    
+    keyboard.append([InlineKeyboardButton("Contact Cooks", callback_data="contact_cooks")])
+    keyboard.append([InlineKeyboardButton("Back", callback_data="matches")])
+    
+    return message, InlineKeyboardMarkup(keyboard)
 
 async def search_command(update: Update, context: CallbackContext) -> None:
     """Search for specific ingredients offered by neighbors."""
     user = update.effective_user
-    user_data = User.find_by_telegram_id(user.id)
+    user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
     
     if not user_data:
         await update.message.reply_text(
@@ -506,11 +871,39 @@ async def search_command(update: Update, context: CallbackContext) -> None:
     
     ingredient_name = args[0].lower()
     
-    # Find users offering this ingredient
-    matches = find_nearby_users(user_data, name=ingredient_name)
+    # Keep what later pages need, so paging doesn't look the user up again
+    context.user_data[SEARCH_PAGES_KEY] = {
+        'user_id': user_data.id,
+        'location': user_data.location,
+        'ingredient': ingredient_name,
+        'cursors': [None]
+    }
+    await show_search_page(update, context, 0)
+
+async def show_search_page(update: Update, context: CallbackContext, page) -> None:
+    """Show one page of the neighbors offering the searched ingredient."""
+    search = context.user_data.get(SEARCH_PAGES_KEY)
+    if not search:
+        await respond(update, "This search has expired. Please use /search again.")
+        return
+    
+    ingredient_name = search['ingredient']
+    cursors = search['cursors']
+    page = min(page, len(cursors) - 1)
+    
+    # Find users offering this ingredient, starting after the previous page
+    searcher = User({'_id': search['user_id'], 'location': search['location']})
+    matches, next_cursor, total = await asyncio.to_thread(
+        find_offerers_page, searcher, ingredient_name, cursors[page], SEARCH_PAGE_SIZE
+    )
+    
+    del cursors[page + 1:]
+    if next_cursor:
+        cursors.append(next_cursor)
     
     if not matches:
-        await update.message.reply_text(
+        await respond(
+            update,
             f"No neighbors offering {ingredient_name} found nearby.\n"
             f"Try /request {ingredient_name} to let others know you need it!"
         )
@@ -518,15 +911,15 @@ async def search_command(update: Update, context: CallbackContext) -> None:
     
     # Build the message
     message = f"🔍 *Search Results for {ingredient_name}* 🔍\n\n"
-    message += f"Found {len(matches)} neighbors offering {ingredient_name}:\n\n"
+    message += f"Found {total} neighbors offering {ingredient_name}:\n\n"
     
-    for match in matches[:8]:  # Limit to 8 matches
+    for match in matches:
         distance = match['distance']
         user_name = match['user'].name
         message += f"• {user_name} (within {distance:.1f}km)\n"
     
-    if len(matches) > 8:
-        message += f"...and {len(matches) - 8} more\n"
+    if total > SEARCH_PAGE_SIZE:
+        message += f"\nPage {page + 1} of {(total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE}\n"
     
     # Add contact buttons
     keyboard = []
@@ -534,11 +927,79 @@ async def search_command(update: Update, context: CallbackContext) -> None:
         user_obj = match['user']
         keyboard.append([InlineKeyboardButton(f"Contact {user_obj.name}", callback_data=f"contact_{user_obj.id}")])
     
+    navigation = page_navigation("spage", page, next_cursor is not None)
+    if navigation:
+        keyboard.append(navigation)
+    
     keyboard.append([InlineKeyboardButton("Request This Ingredient", callback_data=f"request_{ingredient_name}")])
     keyboard.append([InlineKeyboardButton("Close", callback_data="cancel")])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(message, reply_markup=reply_markup, parse_mode="Markdown")
+    await respond(update, message, reply_markup=reply_markup, parse_mode="Markdown")
+
+async def show_match_page(update: Update, context: CallbackContext, direction, page) -> None:
+    """Show one page of the user's matches in one direction."""
+    pages = context.user_data.get(MATCH_PAGES_KEY)
+    if not pages:
+        session = await get_match_session(update, context)
+        if not session:
+            return
+        pages = context.user_data[MATCH_PAGES_KEY]
+    
+    cursors = pages[direction]
+    page = min(page, len(cursors) - 1)
+    
+    matches, next_cursor = await asyncio.to_thread(
+        get_matches_page, pages['user_id'], direction, cursors[page], MATCHES_PAGE_SIZE
+    )
+    
+    del cursors[page + 1:]
+    if next_cursor:
+        cursors.append(next_cursor)
+    
+    if direction == OFFER:
+        message = f"🔍 *People who need your ingredients* (page {page + 1})\n\n"
+        verb = "needs"
+    else:
+        message = f"🔍 *People who have ingredients you need* (page {page + 1})\n\n"
+        verb = "has"
+    
+    if not matches:
+        message += "No more matches.\n"
+    
+    for match in matches:
+        distance = match['distance']
+        user_name = match['user'].name
+        ing_name = match['ingredient']
+        message += f"• {user_name} (within {distance:.1f}km) {verb} {ing_name}\n"
+    
+    # Add contact buttons
+    keyboard = []
+    
+    page_users = {}
+    for match in matches:
+        page_users.setdefault(match['user'].id, match['user'])
+    
+    for user_id, user_obj in page_users.items():
+        keyboard.append([InlineKeyboardButton(f"Contact {user_obj.name}", callback_data=f"contact_{user_id}")])
+    
+    navigation = page_navigation(f"mpage_{direction}", page, next_cursor is not None)
+    if navigation:
+        keyboard.append(navigation)
+    
+    keyboard.append([InlineKeyboardButton("Back", callback_data="matches")])
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await respond(update, message, reply_markup=reply_markup, parse_mode="Markdown")
+
+def page_navigation(prefix, page, has_next):
+    """Build the Prev/Next button row of a paged view."""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀ Prev", callback_data=f"{prefix}_{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next ▶", callback_data=f"{prefix}_{page + 1}"))
+    return buttons
 
 async def button_handler(update: Update, context: CallbackContext) -> None:
     """Handle button callbacks."""
@@ -546,6 +1007,9 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
     await query.answer()
     
     data = query.data
+    if query.message:
+        # Whatever the button shows replaces a placeholder still waiting for recipes
+        context.user_data.get(PENDING_VIEWS_KEY, {}).pop(query.message.message_id, None)
     
     if data == "cancel":
         await query.edit_message_text("Action cancelled.")
@@ -555,22 +1019,25 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
         # Handle offer selection
         ingredient_id = data.split("_")[1]
         user = update.effective_user
-        user_data = User.find_by_telegram_id(user.id)
+        user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
         
         if user_data:
-            ingredient = Ingredient.find_by_id(ingredient_id)
+            ingredient = await asyncio.to_thread(Ingredient.find_by_id, ingredient_id)
             if ingredient:
-                result = User.add_offer(user_data.id, ingredient_id)
-                if result:
+                expires_at = await asyncio.to_thread(
+                    User.add_offer, user_data.id, ingredient_id, Ingredient.shelf_life(ingredient.category)
+                )
+                if expires_at:
                     await query.edit_message_text(
-                        f"✅ You're now offering {ingredient.name} to your neighbors!\n"
+                        f"✅ You're now offering {ingredient.name} to your neighbors for the next {format_time_left(expires_at)}!\n"
                         f"I'll notify you when someone nearby is interested."
                     )
                     
                     # Find matching requests in the area
-                    matches = find_nearby_users(user_data, ingredient)
+                    matches = await asyncio.to_thread(find_ingredient_matches, user_data, ingredient.name, OFFER)
                     
                     if matches:
+                        notify_matches(context, user_data, matches, ingredient.name)
                         await context.bot.send_message(
                             chat_id=user.id,
                             text=f"📣 Good news! {len(matches)} neighbors are looking for {ingredient.name}!\n"
@@ -581,16 +1048,16 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
             else:
                 await query.edit_message_text("Ingredient not found. Please try again.")
     
-    elif data.startswith("contact_"):
+    elif data.startswith("contact_") and data != "contact_cooks":
         # Handle contact request
         target_user_id = data.split("_")[1]
         user = update.effective_user
-        user_data = User.find_by_telegram_id(user.id)
-        target_user = User.find_by_id(target_user_id)
+        user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
+        target_user = await asyncio.to_thread(User.find_by_id, target_user_id)
         
         if user_data and target_user:
             # Create chat or get existing one
-            chat_id = User.create_chat(user_data.id, target_user_id)
+            chat_id = await asyncio.to_thread(User.create_chat, user_data.id, target_user_id)
             
             if chat_id:
                 await query.edit_message_text(
@@ -599,16 +1066,16 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
                 )
                 
                 # Send a message to both users
-                await context.bot.send_message(
-                    chat_id=user.id,
-                    text=f"🤝 You're now connected with {target_user.name} for ingredient exchange.\n"
-                        f"Use /chat_{chat_id} to send messages."
+                notifier = get_notifier(context)
+                notifier.notify(
+                    user.id,
+                    f"🤝 You're now connected with {target_user.name} for ingredient exchange.\n"
+                    f"Use /chat_{chat_id} to send messages."
                 )
-                
-                await context.bot.send_message(
-                    chat_id=target_user.telegram_id,
-                    text=f"🤝 {user_data.name} wants to exchange ingredients with you!\n"
-                        f"Use /chat_{chat_id} to respond."
+                notifier.notify(
+                    target_user.telegram_id,
+                    f"🤝 {user_data.name} wants to exchange ingredients with you!\n"
+                    f"Use /chat_{chat_id} to respond."
                 )
             else:
                 await query.edit_message_text("Failed to create chat. Please try again later.")
@@ -617,10 +1084,10 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
         # Handle request creation from search
         ingredient_name = data.split("_")[1]
         user = update.effective_user
-        user_data = User.find_by_telegram_id(user.id)
+        user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
         
         if user_data:
-            result = User.add_request(user_data.id, ingredient_name)
+            result = await asyncio.to_thread(User.add_request, user_data.id, ingredient_name)
             
             if result:
                 await query.edit_message_text(
@@ -629,9 +1096,10 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
                 )
                 
                 # Find matching offers in the area
-                matches = find_nearby_users(user_data, name=ingredient_name)
+                matches = await asyncio.to_thread(find_ingredient_matches, user_data, ingredient_name, REQUEST)
                 
                 if matches:
+                    notify_matches(context, user_data, matches, ingredient_name)
                     await context.bot.send_message(
                         chat_id=user.id,
                         text=f"📣 Good news! {len(matches)} neighbors are offering {ingredient_name}!\n"
@@ -641,60 +1109,25 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
                 await query.edit_message_text("Failed to create request. Please try again.")
     
     elif data == "recipe_details":
-        # Show recipe details
-        user = update.effective_user
-        user_data = User.find_by_telegram_id(user.id)
+        # Show recipe details, reusing the result of the matches view
+        session = await get_match_session(update, context)
         
-        if user_data:
-            all_matches = []
-            
-            # Get matches for user's offers
-            for offer in user_data.offers:
-                ing = Ingredient.find_by_id(offer['ingredient_id'])
-                if ing:
-                    nearby_matches = find_nearby_users(user_data, ing)
-                    all_matches.extend(nearby_matches)
-            
-            # Get matches for user's requests
-            for request in user_data.requests:
-                nearby_matches = find_nearby_users(user_data, name=request['ingredient'])
-                all_matches.extend(nearby_matches)
-            
-            # Get recipe suggestions
-            recipe_matches = find_matching_recipes(user_data, all_matches)
-            
-            if recipe_matches:
-                # Build the message
-                message = "🍳 *Recipe Suggestions* 🍳\n\n"
-                
-                for i, match in enumerate(recipe_matches[:5]):  # Limit to 5 recipes
-                    recipe = match['recipe']
-                    user_name = match['user'].name
-                    missing_ingredients = match.get('missing_ingredients', [])
-                    
-                    message += f"*{i+1}. {recipe['title']}*\n"
-                    message += f"Cook with: {user_name}\n"
-                    message += f"Cook time: {recipe.get('readyInMinutes', 'N/A')} minutes\n"
-                    message += f"Servings: {recipe.get('servings', 'N/A')}\n"
-                    
-                    if missing_ingredients:
-                        message += f"Still needed: {', '.join(missing_ingredients)}\n"
-                    
-                    message += "\n"
-                
-                # Add action buttons
-                keyboard = []
-                for i, match in enumerate(recipe_matches[:3]):
-                    recipe = match['recipe']
-                    keyboard.append([InlineKeyboardButton(f"View Recipe #{i+1}", url=recipe.get('sourceUrl', ''))])
-                
-                keyboard.append([InlineKeyboardButton("Contact Cooks", callback_data="contact_cooks")])
-                keyboard.append([InlineKeyboardButton("Back", callback_data="matches")])
-                
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(message, reply_markup=reply_markup, parse_mode="Markdown")
-            else:
-                await query.edit_message_text("No recipe suggestions found. Try adding more ingredients or connecting with more neighbors!")
+        if session:
+            # Recipes still being looked up show a placeholder that is replaced once they are found
+            text, reply_markup = render_recipes(session)
+            message = await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+            if session['recipe_matches'] is None:
+                view = track_view(context, message)
+                start_task(context, edit_when_recipes_found(context, session, message, render_recipes, view), update=update)
+    
+    elif data.startswith("mpage_"):
+        # Show another page of matches
+        _, direction, page = data.split("_")
+        await show_match_page(update, context, direction, int(page))
+    
+    elif data.startswith("spage_"):
+        # Show another page of search results
+        await show_search_page(update, context, int(data.split("_")[1]))
     
     elif data == "matches":
         # Go back to matches view
@@ -703,25 +1136,17 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
     
     elif data == "contact_cooks":
         # Show a list of potential cooking partners
-        user = update.effective_user
-        user_data = User.find_by_telegram_id(user.id)
+        session = await get_match_session(update, context)
         
-        if user_data:
-            all_matches = []
-            
+        if session:
             # Get all possible matches
-            for offer in user_data.offers:
-                ing = Ingredient.find_by_id(offer['ingredient_id'])
-                if ing:
-                    nearby_matches = find_nearby_users(user_data, ing)
-                    all_matches.extend(nearby_matches)
-            
-            for request in user_data.requests:
-                nearby_matches = find_nearby_users(user_data, name=request['ingredient'])
-                all_matches.extend(nearby_matches)
+            all_matches = session['offer_matches'] + session['request_matches']
             
-            # Get unique users
+            # Get unique users, the ones the suggested recipes need first
             unique_users = {}
+            for match in session['recipe_matches'] or []:
+                for partner in match.get('partners', [match['user']]):
+                    unique_users.setdefault(partner.id, partner)
             for match in all_matches:
                 if match['user'].id not in unique_users:
                     unique_users[match['user'].id] = match['user']
@@ -767,16 +1192,16 @@ async def text_handler(update: Update, context: CallbackContext) -> None:
         
         # Forward the message to the other user in the chat
         user = update.effective_user
-        user_data = User.find_by_telegram_id(user.id)
+        user_data = await asyncio.to_thread(User.find_by_telegram_id, user.id)
         
         if user_data:
             # Get the chat
-            chat = User.get_chat(chat_id)
+            chat = await asyncio.to_thread(User.get_chat, chat_id)
             
             if chat and (user_data.id == chat['user1_id'] or user_data.id == chat['user2_id']):
                 # Get the other user
                 other_user_id = chat['user1_id'] if user_data.id == chat['user2_id'] else chat['user2_id']
-                other_user = User.find_by_id(other_user_id)
+                other_user = await asyncio.to_thread(User.find_by_id, other_user_id)
                 
                 if other_user:
                     # Send the message
@@ -0,0 +1,39 @@
+import asyncio
+import logging
+from telegram.ext import CallbackContext
+from services.expiry import sweep, collect_warnings
+from services.communities import refresh_communities
+
+logger = logging.getLogger(__name__)
+
+async def expiry_job(context: CallbackContext) -> None:
+    """Remove expired offers and requests, and warn users about the ones expiring soon."""
+    try:
+        await asyncio.to_thread(sweep)
+        warnings = await asyncio.to_thread(collect_warnings)
+    except Exception as e:
+        logger.error(f"Error running expiry job: {e}", exc_info=True)
+        return
+    
+    notifier = context.bot_data['notifier']
+    for telegram_id, text in warnings:
+        notifier.notify(telegram_id, text)
+
+async def cycle_job(context: CallbackContext) -> None:
+    """Search changed cells for multi-party exchange cycles and tell the users in new ones."""
+    try:
+        messages = await context.bot_data['cycle_solver'].run()
+    except Exception as e:
+        logger.error(f"Error running exchange cycle job: {e}", exc_info=True)
+        return
+    
+    notifier = context.bot_data['notifier']
+    for telegram_id, text in messages:
+        notifier.notify(telegram_id, text)
+
+async def community_job(context: CallbackContext) -> None:
+    """Regroup users into neighborhoods and fetch recipes for each community pantry."""
+    try:
+        await asyncio.to_thread(refresh_communities)
+    except Exception as e:
+        logger.error(f"Error running community job: {e}", exc_info=True)
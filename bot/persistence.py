@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import logging
+import bson
+from bson.errors import InvalidDocument
+from pymongo import DeleteOne, ReplaceOne
+from telegram.ext import BasePersistence, PersistenceInput
+from models.database import get_database
+
+logger = logging.getLogger(__name__)
+
+# How long writes are collected before they go out as one batch
+BATCH_DELAY_SECONDS = 0.05
+
+# Keys of the documents standing for values BSON has no type of. Field names
+# starting with $ or holding dots are refused by older servers, dictionaries
+# with such keys are stored as items too
+TUPLE_KEY = '~tuple'  # A tuple, BSON would read it back as a list
+ITEMS_KEY = '~items'  # A dictionary with other keys than plain strings, as a list of [key, value] pairs
+
+class MongoPersistence(BasePersistence):
+    """
+    Keeps conversation states, user_data and chat_data in MongoDB across restarts.
+    
+    The Application hands over changed data every update_interval seconds.
+    Each round is written as one bulk write, and entries that serialize to
+    the same bytes as last time aren't written at all. Data is stored as
+    BSON documents, decoded by the driver, and everything is read with a
+    single query at startup. Unlike pickle, loading them can't run code
+    someone with write access to the collection put there. Only plain data
+    is saved: strings, numbers, dates, lists, tuples and dictionaries.
+    
+    bot_data holds live objects like the notifier and is not persisted.
+    Keys in transient_keys are left out of user_data, for caches that are
+    cheap to rebuild or only make sense within one process.
+    """
+    
+    def __init__(self, update_interval=30, transient_keys=()):
+        """
+        Initialize the persistence.
+        
+        Parameters:
+        - update_interval: Seconds between saves of changed data
+        - transient_keys: user_data keys that are never saved
+        """
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.transient_keys = frozenset(transient_keys)
+        self._loaded = None  # (user_data, chat_data, conversations) read at startup
+        self._load_lock = asyncio.Lock()
+        self._pending = {}  # document ID -> write waiting for the next batch
+        self._written = {}  # document ID -> digest of the data last written
+        self._batch = None
+        self._write_lock = asyncio.Lock()  # Keeps batches in order
+    
+    @staticmethod
+    def get_collection():
+        """Get the persistence collection from MongoDB."""
+        db = get_database()
+        return db.persistence if db is not None else None
+    
+    async def get_user_data(self):
+        """Get the saved user_data of every user."""
+        user_data, _, _ = await self._load()
+        return user_data
+    
+    async def get_chat_data(self):
+        """Get the saved chat_data of every chat."""
+        _, chat_data, _ = await self._load()
+        return chat_data
+    
+    async def get_bot_data(self):
+        """bot_data is not persisted."""
+        return {}
+    
+    async def get_callback_data(self):
+        """Arbitrary callback data is not used."""
+        return None
+    
+    async def get_conversations(self, name):
+        """Get the saved states of a conversation handler."""
+        _, _, conversations = await self._load()
+        return conversations.get(name, {})
+    
+    async def update_user_data(self, user_id, data):
+        """Save a user's user_data."""
+        data = {key: value for key, value in data.items() if key not in self.transient_keys}
+        await self._save(f"user_data:{user_id}", {'kind': 'user_data', 'key': user_id}, data)
+    
+    async def update_chat_data(self, chat_id, data):
+        """Save a chat's chat_data."""
+        await self._save(f"chat_data:{chat_id}", {'kind': 'chat_data', 'key': chat_id}, data)
+    
+    async def update_conversation(self, name, key, new_state):
+        """Save the state of one conversation, dropping it once it ended."""
+        document_id = f"conversation:{name}:{':'.join(map(str, key))}"
+        if new_state is None:
+            await self._drop(document_id)
+        else:
+            await self._save(document_id, {'kind': 'conversation', 'name': name, 'key': list(key)}, new_state)
+    
+    async def update_bot_data(self, data):
+        """bot_data is not persisted."""
+    
+    async def update_callback_data(self, data):
+        """Arbitrary callback data is not used."""
+    
+    async def drop_user_data(self, user_id):
+        """Delete a user's saved user_data."""
+        await self._drop(f"user_data:{user_id}")
+    
+    async def drop_chat_data(self, chat_id):
+        """Delete a chat's saved chat_data."""
+        await self._drop(f"chat_data:{chat_id}")
+    
+    async def refresh_user_data(self, user_id, user_data):
+        """Nothing to refresh, only the process serving a user changes their data."""
+    
+    async def refresh_chat_data(self, chat_id, chat_data):
+        """Nothing to refresh, only the process serving a chat changes its data."""
+    
+    async def refresh_bot_data(self, bot_data):
+        """bot_data is not persisted."""
+    
+    async def flush(self):
+        """Write everything still pending, called when the application stops."""
+        if self._batch:
+            await self._batch
+        if self._pending:
+            await self._write_batch()
+    
+    async def _load(self):
+        """Read all saved data once, with a single query."""
+        async with self._load_lock:
+            if self._loaded is None:
+                self._loaded = await asyncio.to_thread(self._read_all)
+        return self._loaded
+    
+    def _read_all(self):
+        """Read and decode all saved data."""
+        user_data, chat_data, conversations = {}, {}, {}
+        collection = self.get_collection()
+        if collection is None:
+            return user_data, chat_data, conversations
+        
+        try:
+            documents = list(collection.find({}))
+        except Exception as e:
+            logger.error(f"Error loading persisted bot data: {e}")
+            return user_data, chat_data, conversations
+        
+        for document in documents:
+            if isinstance(document['data'], bytes):
+                # Pickled by an older version, never loaded since it could run any code
+                logger.warning(f"Skipping persisted entry {document['_id']} saved in the old pickle format")
+                continue
+            try:
+                value = _decode(document['data'])
+            except Exception as e:
+                logger.warning(f"Skipping unreadable persisted entry {document['_id']}: {e}")
+                continue
+            
+            self._written[document['_id']] = _digest(document['data'])
+            if document['kind'] == 'user_data':
+                user_data[document['key']] = value
+            elif document['kind'] == 'chat_data':
+                chat_data[document['key']] = value
+            elif document['kind'] == 'conversation':
+                conversations.setdefault(document['name'], {})[tuple(document['key'])] = value
+        
+        logger.info(
+            f"Loaded persisted data of {len(user_data)} users, {len(chat_data)} chats "
+            f"and {sum(len(states) for states in conversations.values())} conversations"
+        )
+        return user_data, chat_data, conversations
+    
+    async def _save(self, document_id, fields, value):
+        """Queue a document for the next batch, unless its data didn't change."""
+        # Encoded now, the application keeps changing the live object
+        try:
+            data = _encode(value)
+            digest = _digest(data)
+        except (InvalidDocument, TypeError) as e:
+            logger.error(f"Not saving persisted entry {document_id}, it holds more than plain data: {e}")
+            return
+        if self._written.get(document_id) == digest and document_id not in self._pending:
+            return
+        
+        self._pending[document_id] = (
+            ReplaceOne({'_id': document_id}, {**fields, 'data': data}, upsert=True), digest
+        )
+        await self._schedule()
+    
+    async def _drop(self, document_id):
+        """Queue the deletion of a document for the next batch."""
+        if document_id not in self._written and document_id not in self._pending:
+            return
+        self._pending[document_id] = (DeleteOne({'_id': document_id}), None)
+        await self._schedule()
+    
+    async def _schedule(self):
+        """Wait for the batch the queued write goes out with."""
+        if self._batch is None:
+            self._batch = asyncio.ensure_future(self._write_soon())
+        await asyncio.shield(self._batch)
+    
+    async def _write_soon(self):
+        """Collect the writes of one persistence round, then write them."""
+        await asyncio.sleep(BATCH_DELAY_SECONDS)
+        self._batch = None
+        await self._write_batch()
+    
+    async def _write_batch(self):
+        """Write all pending documents with one bulk write."""
+        async with self._write_lock:
+            pending, self._pending = self._pending, {}
+            collection = self.get_collection()
+            if collection is None or not pending:
+                return
+            
+            try:
+                await asyncio.to_thread(
+                    collection.bulk_write, [operation for operation, _ in pending.values()], ordered=False
+                )
+            except Exception as e:
+                logger.error(f"Error saving {len(pending)} persisted entries: {e}")
+                # Retried with the next batch, unless newer data was queued meanwhile
+                for document_id, write in pending.items():
+                    self._pending.setdefault(document_id, write)
+                return
+            
+            for document_id, (_, digest) in pending.items():
+                if digest is None:
+                    self._written.pop(document_id, None)
+                else:
+                    self._written[document_id] = digest
+
+def _encode(value):
+    """Turn a value into data BSON stores as it is, marking tuples and dictionaries with other keys."""
+    if isinstance(value, tuple):
+        return {TUPLE_KEY: [_encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        if all(isinstance(key, str) and key[:1] not in ('$', '~') and '.' not in key for key in value):
+            return {key: _encode(item) for key, item in value.items()}
+        return {ITEMS_KEY: [[_encode(key), _encode(item)] for key, item in value.items()]}
+    return value
+
+def _decode(data):
+    """Turn data read from MongoDB back into the value _encode() was given."""
+    if isinstance(data, list):
+        return [_decode(item) for item in data]
+    if isinstance(data, dict):
+        if TUPLE_KEY in data:
+            return tuple(_decode(item) for item in data[TUPLE_KEY])
+        if ITEMS_KEY in data:
+            return {_decode(key): _decode(item) for key, item in data[ITEMS_KEY]}
+        return {key: _decode(item) for key, item in data.items()}
+    return data
+
+def _digest(data):
+    """Hash encoded data, raising InvalidDocument if BSON can't store it."""
+    return hashlib.blake2b(bson.encode({'data': data}), digest_size=16).digest()
@@ -0,0 +1,272 @@
+"""
+Front process of a geo-partitioned deployment.
+
+Polls Telegram, the only process that does, and forwards every update to
+the worker serving the region of its sender. All workers share one
+MongoDB, so a worker still sees neighbors across its region's border.
+
+Usage:
+    python -m bot.router
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+import httpx
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from models.user import User
+from services.regions import get_regions, region_of
+from bot.update_receiver import SECRET_HEADER
+from utils.metrics import ROUTED_UPDATES, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+# Updates held for a worker that can't be reached, the oldest are dropped beyond this
+MAX_BACKLOG_PER_REGION = 10_000
+
+# Updates sent to a worker in one request
+MAX_BATCH_SIZE = 100
+
+# Wait between attempts to reach a worker, doubled up to the maximum while it stays down
+FIRST_RETRY_DELAY_SECONDS = 0.5
+MAX_RETRY_DELAY_SECONDS = 30
+
+# Users whose region is remembered before expired entries are pruned
+MAX_CACHED_USERS = 100_000
+
+def parse_worker_urls(spec):
+    """Parse a worker map like "north=http://10.0.0.2:8081;rest=http://10.0.0.3:8081"."""
+    workers = {}
+    for part in spec.replace(' ', '').split(';'):
+        if not part:
+            continue
+        name, _, url = part.partition('=')
+        if not name or not url:
+            raise ValueError(f"Invalid worker {part!r}, expected region=url")
+        workers[name] = url.rstrip('/')
+    return workers
+
+class UpdateRouter:
+    """
+    Forwards updates to the worker of their sender's region.
+    
+    The region comes from the geohash stored with the sender's location and
+    is cached for a short time. Users without a location belong to the
+    catch-all region. Location messages go to the worker the user belonged
+    to until then, which keeps conversations on one worker. Their cached
+    region is dropped, so later updates follow the new location.
+    
+    Every region has a backlog of updates its worker hasn't taken yet,
+    delivered in order by a task of its own. A worker that is down, for a
+    restart or a deploy, gets its updates once it is back, while the other
+    regions keep flowing. Backlogs live in the router's memory: Telegram
+    is told the updates were received as soon as they are in one.
+    """
+    
+    def __init__(self, bot, workers, regions=None, secret="", cache_seconds=30, client=None,
+                 max_backlog=MAX_BACKLOG_PER_REGION):
+        """Initialize the router."""
+        self.bot = bot
+        self.workers = workers
+        self.regions = get_regions() if regions is None else regions
+        self.secret = secret
+        self.cache_seconds = cache_seconds
+        self.client = client or httpx.AsyncClient(timeout=30)
+        self.max_backlog = max_backlog
+        self._regions_by_user = {}  # telegram_id -> (region, time the entry expires)
+        self._backlogs = {}  # region -> deque of updates not delivered yet
+        self._senders = {}  # region -> task delivering its backlog
+    
+    async def region_for(self, telegram_id):
+        """Get the region of a Telegram user."""
+        now = time.monotonic()
+        cached = self._regions_by_user.get(telegram_id)
+        if cached and cached[1] > now:
+            return cached[0]
+        
+        geohash = await asyncio.to_thread(User.find_geohash, telegram_id) if telegram_id else None
+        region = region_of(geohash, self.regions)
+        
+        if len(self._regions_by_user) >= MAX_CACHED_USERS:
+            self._regions_by_user = {
+                key: value for key, value in self._regions_by_user.items() if value[1] > now
+            }
+        self._regions_by_user[telegram_id] = (region, now + self.cache_seconds)
+        return region
+    
+    async def route(self, updates):
+        """
+        Group updates by the region they go to, keeping their order.
+        
+        Parameters:
+        - updates: List of Update objects
+        
+        Returns:
+        - Dictionary of region name to list of updates
+        """
+        batches = {}
+        for update in updates:
+            user = update.effective_user
+            region = await self.region_for(user.id if user else None)
+            batches.setdefault(region, []).append(update)
+            
+            if update.effective_message and update.effective_message.location and user:
+                self._regions_by_user.pop(user.id, None)
+        return batches
+    
+    def enqueue(self, region, updates):
+        """
+        Add updates to the backlog of a region, and start delivering it unless already delivering.
+        
+        Updates beyond max_backlog push out the oldest ones, which are
+        logged by ID and counted as dropped.
+        """
+        if not self.workers.get(region):
+            logger.warning(f"No worker for region {region}, dropping updates {_update_ids(updates)}")
+            ROUTED_UPDATES.inc(len(updates), region=region or "", result='unroutable')
+            return
+        
+        backlog = self._backlogs.setdefault(region, deque())
+        backlog.extend(updates)
+        overflow = len(backlog) - self.max_backlog
+        if overflow > 0:
+            dropped = [backlog.popleft() for _ in range(overflow)]
+            logger.error(f"Backlog of worker {region} is full, dropped updates {_update_ids(dropped)}")
+            ROUTED_UPDATES.inc(overflow, region=region, result='dropped')
+        
+        sender = self._senders.get(region)
+        if sender is None or sender.done():
+            self._senders[region] = asyncio.create_task(self._deliver(region))
+    
+    def pending(self):
+        """Count the updates not delivered yet."""
+        return sum(len(backlog) for backlog in self._backlogs.values())
+    
+    async def close(self):
+        """Stop delivering, logging what is left undelivered."""
+        for sender in self._senders.values():
+            sender.cancel()
+        await asyncio.gather(*self._senders.values(), return_exceptions=True)
+        for region, backlog in self._backlogs.items():
+            if backlog:
+                logger.warning(f"Stopping with updates {_update_ids(backlog)} not delivered to worker {region}")
+    
+    async def _deliver(self, region):
+        """Deliver the backlog of a region in order until it is empty, waiting for its worker while it is down."""
+        backlog = self._backlogs[region]
+        delay = FIRST_RETRY_DELAY_SECONDS
+        while backlog:
+            batch = list(itertools.islice(backlog, MAX_BATCH_SIZE))
+            delivered = await self.forward(region, batch)
+            if delivered is None:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY_SECONDS)
+                continue
+            
+            delay = FIRST_RETRY_DELAY_SECONDS
+            # Dropped for a full backlog meanwhile or not, nothing up to the batch's last update is left to send
+            last_id = batch[-1].update_id
+            while backlog and backlog[0].update_id <= last_id:
+                backlog.popleft()
+    
+    async def forward(self, region, updates):
+        """
+        Send a batch of updates to the worker of a region, once.
+        
+        Returns:
+        - True if the worker took the updates, False if it rejected them
+          and they are dropped, None if it couldn't be reached and they
+          should be sent again
+        """
+        url = self.workers[region]
+        headers = {SECRET_HEADER: self.secret} if self.secret else {}
+        payload = [update.to_dict() for update in updates]
+        
+        try:
+            response = await self.client.post(f"{url}/updates", json=payload, headers=headers)
+        except httpx.HTTPError as e:
+            logger.warning(f"Error forwarding updates to worker {region}, {len(updates)} waiting: {e}")
+            return None
+        
+        if response.status_code < 300:
+            ROUTED_UPDATES.inc(len(updates), region=region, result='forwarded')
+            return True
+        if response.status_code in (400, 403):
+            # Retrying a rejected batch won't help
+            logger.error(f"Worker {region} rejected updates {_update_ids(updates)} with HTTP {response.status_code}")
+            ROUTED_UPDATES.inc(len(updates), region=region, result='rejected')
+            return False
+        logger.warning(f"Worker {region} answered HTTP {response.status_code}, {len(updates)} updates waiting")
+        return None
+    
+    async def run(self, poll_timeout=30, drop_pending_updates=True):
+        """Poll Telegram and forward updates until cancelled."""
+        if drop_pending_updates:
+            await self.bot.delete_webhook(drop_pending_updates=True)
+        
+        offset = None
+        while True:
+            try:
+                updates = await self.bot.get_updates(
+                    offset=offset, timeout=poll_timeout, allowed_updates=Update.ALL_TYPES
+                )
+            except TelegramError as e:
+                logger.warning(f"Error getting updates: {e}")
+                await asyncio.sleep(1)
+                continue
+            
+            if not updates:
+                continue
+            
+            batches = await self.route(updates)
+            for region, batch in batches.items():
+                self.enqueue(region, batch)
+            offset = updates[-1].update_id + 1
+
+def _update_ids(updates):
+    """Describe the IDs of updates for the log, as a range when there are many."""
+    ids = [update.update_id for update in updates]
+    if len(ids) > 10:
+        return f"{ids[0]}..{ids[-1]} ({len(ids)} updates)"
+    return ", ".join(str(update_id) for update_id in ids)
+
+async def main():
+    """Run the router."""
+    from config import (
+        TELEGRAM_TOKEN, WORKER_URLS, ROUTER_SECRET, ROUTER_CACHE_SECONDS, METRICS_HOST, METRICS_PORT,
+        DROP_PENDING_UPDATES
+    )
+    
+    workers = parse_worker_urls(WORKER_URLS)
+    if not get_regions() or not workers:
+        logger.error("Set REGIONS and WORKER_URLS to run the router")
+        return
+    
+    missing = set(get_regions()) - set(workers)
+    if missing:
+        logger.warning(f"No worker configured for regions {', '.join(sorted(missing))}, their updates will be dropped")
+    
+    metrics_server = start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    
+    async with Bot(TELEGRAM_TOKEN) as bot:
+        router = UpdateRouter(bot, workers, secret=ROUTER_SECRET, cache_seconds=ROUTER_CACHE_SECONDS)
+        logger.info(f"Routing updates to {len(workers)} workers")
+        try:
+            await router.run(drop_pending_updates=DROP_PENDING_UPDATES)
+        finally:
+            await router.close()
+            await router.client.aclose()
+            if metrics_server:
+                metrics_server.shutdown()
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Router stopped by user")
@@ -0,0 +1,130 @@
+import logging
+import time
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import MAX_PENDING_UPDATES_PER_USER, UPDATE_BUDGET_SECONDS
+from utils.deadline import budget
+from utils.metrics import UPDATE_LATENCY, UPDATES_DROPPED
+from utils.tracing import trace_update
+
+logger = logging.getLogger(__name__)
+
+# Commands registered in main.build_application, any other command is labelled 'other'
+COMMANDS = frozenset({
+    'start', 'help', 'profile', 'register', 'cancel', 'setlocation', 'add', 'remove', 'list',
+    'offer', 'request', 'matches', 'search'
+})
+
+def describe_update(update):
+    """
+    Get a short label for the kind of update, used to group metrics.
+    
+    Commands are labelled by name, callback queries by the prefix of their
+    data (so offer_<id> becomes callback:offer), and other messages by type.
+    Labels come from a fixed set, so users typing made-up commands or
+    /chat_<id> don't create new metric series: /chat_<id> is labelled
+    chat, and unknown commands other.
+    """
+    if not isinstance(update, Update):
+        return 'other'
+    
+    if update.callback_query:
+        return f"callback:{(update.callback_query.data or '').split('_')[0]}"
+    
+    message = update.effective_message
+    if message is None:
+        return 'other'
+    if message.text and message.text.startswith('/'):
+        command = message.text.split()[0][1:].split('@')[0].lower()
+        if command in COMMANDS:
+            return command
+        return 'chat' if command.startswith('chat_') else 'other'
+    if message.location:
+        return 'location'
+    if message.document:
+        return 'document'
+    return 'text'
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates concurrently while keeping updates of the same user in order.
+    
+    Updates from different users run in parallel, limited by max_concurrent_updates.
+    Updates from the same user (or chat, for updates without a user) are queued
+    behind the one currently running and processed one after another by the same
+    task, so waiting updates never hold a concurrency slot. At most
+    max_pending_per_user updates are queued per user; newer ones are dropped.
+    """
+    
+    def __init__(self, max_concurrent_updates, max_pending_per_user=MAX_PENDING_UPDATES_PER_USER):
+        """Initialize the processor."""
+        super().__init__(max_concurrent_updates)
+        self.max_pending_per_user = max_pending_per_user
+        self._queues = {}
+    
+    @staticmethod
+    def ordering_key(update):
+        """Get the key whose updates must be processed in order."""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return ('user', update.effective_user.id)
+        if update.effective_chat:
+            return ('chat', update.effective_chat.id)
+        return None
+    
+    async def do_process_update(self, update, coroutine):
+        """Run the update now, or queue it behind the running update of the same user."""
+        key = self.ordering_key(update)
+        if key is None:
+            await self._timed(update, coroutine)
+            return
+        
+        queue = self._queues.get(key)
+        if queue is not None:
+            # The task processing this user's current update will run it next
+            if len(queue) >= self.max_pending_per_user:
+                logger.warning(f"Dropping update for {key[0]} {key[1]}: too many pending updates")
+                UPDATES_DROPPED.inc()
+                coroutine.close()
+                return
+            queue.append((update, coroutine))
+            return
+        
+        queue = self._queues[key] = deque()
+        try:
+            while True:
+                try:
+                    await self._timed(update, coroutine)
+                except Exception as e:
+                    logger.error(f"Error processing update for {key[0]} {key[1]}: {e}", exc_info=True)
+                
+                if not queue:
+                    break
+                update, coroutine = queue.popleft()
+        finally:
+            del self._queues[key]
+            # Only reached with leftovers if the task was cancelled
+            while queue:
+                queue.popleft()[1].close()
+    
+    @staticmethod
+    async def _timed(update, coroutine):
+        """Process an update within its time budget, and record how long it took and where the time went."""
+        command = describe_update(update)
+        start = time.perf_counter()
+        try:
+            with trace_update(command), budget(command, UPDATE_BUDGET_SECONDS):
+                await coroutine
+        finally:
+            UPDATE_LATENCY.observe(time.perf_counter() - start, command=command)
+    
+    async def initialize(self):
+        """Nothing to set up."""
+    
+    async def shutdown(self):
+        """Close updates that are still queued."""
+        for queue in self._queues.values():
+            while queue:
+                queue.popleft()[1].close()
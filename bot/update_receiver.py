@@ -0,0 +1,108 @@
+import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Header carrying the shared secret of the router
+SECRET_HEADER = 'X-Router-Secret'
+
+# How long a request waits for its updates to be queued
+QUEUE_TIMEOUT_SECONDS = 10
+
+class _UpdateHandler(BaseHTTPRequestHandler):
+    """Accept batches of updates on POST /updates and queue them for the application."""
+    
+    application = None
+    loop = None
+    secret = ""
+    
+    def do_POST(self):
+        """Handle a batch of updates from the router."""
+        if self.path.split('?')[0] != '/updates':
+            self.send_error(404)
+            return
+        
+        if self.secret and not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), self.secret):
+            self.send_error(403)
+            return
+        
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            updates = [Update.de_json(data, self.application.bot) for data in json.loads(self.rfile.read(length))]
+        except Exception as e:
+            logger.warning(f"Rejected malformed update batch: {e}")
+            self.send_error(400)
+            return
+        
+        try:
+            asyncio.run_coroutine_threadsafe(self._enqueue(updates), self.loop).result(QUEUE_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error(f"Error queueing routed updates: {e}")
+            self.send_error(503)
+            return
+        
+        self.send_response(204)
+        self.end_headers()
+    
+    async def _enqueue(self, updates):
+        """Put the updates on the application's queue, in order."""
+        for update in updates:
+            await self.application.update_queue.put(update)
+    
+    def log_message(self, format, *args):
+        """Keep requests out of the bot's log."""
+
+def start_update_receiver(application, host, port, secret=""):
+    """
+    Receive updates from the router instead of polling Telegram.
+    
+    Must be called from the event loop the application runs in. Updates
+    are answered once queued, so the router only moves on after the
+    worker took them.
+    
+    Parameters:
+    - application: The started Application
+    - host: Interface to listen on
+    - port: Port to listen on
+    - secret: Shared secret the router sends, empty to accept any request,
+      which is only allowed on a loopback interface
+    
+    Returns:
+    - The HTTP server, or None if it could not be started
+    """
+    if not secret and not _is_loopback(host):
+        # Anyone reaching the port could send updates in the name of any user
+        logger.error(f"Set ROUTER_SECRET to receive routed updates on {host or 'all interfaces'}")
+        return None
+    
+    handler = type('UpdateHandler', (_UpdateHandler,), {
+        'application': application,
+        'loop': asyncio.get_running_loop(),
+        'secret': secret
+    })
+    
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logger.error(f"Error starting update receiver on {host}:{port}: {e}")
+        return None
+    
+    thread = threading.Thread(target=server.serve_forever, name="update-receiver", daemon=True)
+    thread.start()
+    logger.info(f"Receiving routed updates on http://{host}:{port}/updates")
+    return server
+
+def _is_loopback(host):
+    """Check whether a host to listen on is only reachable from this machine."""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
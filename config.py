@@ -11,6 +11,7 @@ if not TELEGRAM_TOKEN:
 
 # Spoonacular API Key for recipe suggestions
 SPOONACULAR_API_KEY = os.getenv("SPOONACULAR_API_KEY")
+SPOONACULAR_BASE_URL = os.getenv("SPOONACULAR_BASE_URL", "https://api.spoonacular.com").rstrip("/")  # Point at a local stand-in for offline testing
 
 # Database settings
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
@@ -19,4 +20,104 @@ DB_NAME = os.getenv("DB_NAME", "ingredient_exchanger")
 # App settings
 MAX_DISTANCE_KM = 5  # Maximum distance to match users (in kilometers)
 MAX_INGREDIENTS_PER_USER = 30  # Maximum number of ingredients a user can have
-MIN_INGREDIENTS_FOR_RECIPE = 4  # Minimum number of ingredients needed for recipe suggestion
\ No newline at end of file
+MIN_INGREDIENTS_FOR_RECIPE = 4  # Minimum number of ingredients needed for recipe suggestion
+MAX_IMPORT_FILE_BYTES = 64 * 1024  # Largest pantry file accepted for bulk import
+
+# Recipe settings
+RECIPE_LOOKUP_DEADLINE_SECONDS = float(os.getenv("RECIPE_LOOKUP_DEADLINE_SECONDS", "20"))  # How long a background recipe lookup may run before it is given up
+RECIPE_API_TIMEOUT_SECONDS = float(os.getenv("RECIPE_API_TIMEOUT_SECONDS", "10"))  # Longest wait for one recipe API response
+RECIPE_BREAKER_FAILURE_RATE = float(os.getenv("RECIPE_BREAKER_FAILURE_RATE", "0.5"))  # Share of failed or slow recent calls that stops calls to an endpoint
+RECIPE_BREAKER_SLOW_SECONDS = float(os.getenv("RECIPE_BREAKER_SLOW_SECONDS", "3"))  # Calls taking longer count as failed
+RECIPE_BREAKER_WINDOW = int(os.getenv("RECIPE_BREAKER_WINDOW", "20"))  # Recent calls per endpoint the failure rate is computed over
+RECIPE_BREAKER_MIN_CALLS = int(os.getenv("RECIPE_BREAKER_MIN_CALLS", "5"))  # Calls needed before an endpoint can be stopped
+RECIPE_BREAKER_OPEN_SECONDS = float(os.getenv("RECIPE_BREAKER_OPEN_SECONDS", "30"))  # How long a stopped endpoint isn't called before it is tried again
+
+# Ranking settings
+RANK_WEIGHT_DISTANCE = float(os.getenv("RANK_WEIGHT_DISTANCE", "1"))  # Weight of closeness, 1 next door and 0 at MAX_DISTANCE_KM
+RANK_WEIGHT_FRESHNESS = float(os.getenv("RANK_WEIGHT_FRESHNESS", "0.5"))  # Weight of how recently the offer or request was listed
+RANK_WEIGHT_RECIPROCITY = float(os.getenv("RANK_WEIGHT_RECIPROCITY", "0.75"))  # Weight of neighbors who also match the user the other way
+RANK_WEIGHT_RECIPE = float(os.getenv("RANK_WEIGHT_RECIPE", "1"))  # Weight of the share of a recipe's ingredients two pantries cover
+FRESHNESS_HALF_LIFE_HOURS = float(os.getenv("FRESHNESS_HALF_LIFE_HOURS", "48"))  # Age at which a listing counts half as fresh
+MATCH_RANK_WINDOW = int(os.getenv("MATCH_RANK_WINDOW", "100"))  # Closest matches ranked together when paging, farther ones follow in later windows
+
+# Concurrency settings
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))  # Updates processed at the same time
+MAX_PENDING_UPDATES_PER_USER = int(os.getenv("MAX_PENDING_UPDATES_PER_USER", "5"))  # Queued updates kept per user
+UPDATE_BUDGET_SECONDS = float(os.getenv("UPDATE_BUDGET_SECONDS", "10"))  # Time an update may spend on MongoDB and the recipe API before they are cut short
+
+# Notification settings
+NOTIFY_MESSAGES_PER_SECOND = float(os.getenv("NOTIFY_MESSAGES_PER_SECOND", "25"))  # Telegram allows about 30 per second
+NOTIFY_PER_CHAT_INTERVAL_SECONDS = float(os.getenv("NOTIFY_PER_CHAT_INTERVAL_SECONDS", "1"))  # Minimum gap between messages to one chat
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))  # Retries for a message after flood-wait or network errors
+NOTIFY_MAX_PENDING_CHATS = int(os.getenv("NOTIFY_MAX_PENDING_CHATS", "10000"))  # Chats with queued messages before new ones are dropped
+NOTIFY_MAX_IN_FLIGHT = int(os.getenv("NOTIFY_MAX_IN_FLIGHT", "8"))  # Messages being sent at the same time
+
+# Expiry settings
+OFFER_SHELF_LIFE_DAYS = {  # Default lifetime of an offer, by ingredient category
+    'Proteins': 2,
+    'Dairy': 5,
+    'Fruits': 5,
+    'Vegetables': 7,
+    'Other': 14,
+    'Grains': 60,
+    'Oils & Condiments': 90,
+    'Spices & Herbs': 180,
+    'Sweeteners': 180
+}
+MAX_OFFER_DAYS = 365  # Longest lifetime a user can give an offer
+REQUEST_TTL_DAYS = int(os.getenv("REQUEST_TTL_DAYS", "7"))  # Lifetime of a request
+EXPIRY_WARNING_HOURS = float(os.getenv("EXPIRY_WARNING_HOURS", "12"))  # Users are warned this long before an offer or request expires
+EXPIRY_SWEEP_INTERVAL_SECONDS = int(os.getenv("EXPIRY_SWEEP_INTERVAL_SECONDS", "300"))  # How often expired offers and requests are removed
+
+# Availability settings
+AVAILABILITY_CELL_PRECISION = int(os.getenv("AVAILABILITY_CELL_PRECISION", "5"))  # Geohash characters of the cells counting who offers and requests what, 5 is about 5km x 5km
+
+# Community settings
+COMMUNITY_REFRESH_SECONDS = int(os.getenv("COMMUNITY_REFRESH_SECONDS", "21600"))  # How often neighborhoods and their recipes are recomputed, 0 to disable
+COMMUNITY_RADIUS_KM = float(os.getenv("COMMUNITY_RADIUS_KM", "0.5"))  # Distance within which users count as close neighbors when clustering
+COMMUNITY_MIN_USERS = int(os.getenv("COMMUNITY_MIN_USERS", "5"))  # Users needed within COMMUNITY_RADIUS_KM to start a neighborhood
+COMMUNITY_MAX_USERS = int(os.getenv("COMMUNITY_MAX_USERS", "500"))  # Larger neighborhoods are split into parts of this size
+COMMUNITY_MAX_INGREDIENTS = int(os.getenv("COMMUNITY_MAX_INGREDIENTS", "50"))  # Most widely held ingredients of a community pantry sent to the recipe API
+COMMUNITY_RECIPES = int(os.getenv("COMMUNITY_RECIPES", "10"))  # Recipes fetched per neighborhood
+
+# Exchange cycle settings
+CYCLE_INTERVAL_SECONDS = int(os.getenv("CYCLE_INTERVAL_SECONDS", "600"))  # How often new exchange cycles are searched, 0 to disable
+CYCLE_MAX_LENGTH = int(os.getenv("CYCLE_MAX_LENGTH", "4"))  # Most users in an exchange cycle
+CYCLE_CELL_PRECISION = int(os.getenv("CYCLE_CELL_PRECISION", "5"))  # Geohash characters of the cells searched on their own, 5 is about 5km x 5km
+CYCLE_TIME_BUDGET_SECONDS = float(os.getenv("CYCLE_TIME_BUDGET_SECONDS", "60"))  # Time one search run may spend, the remaining cells wait for the next run
+CYCLE_WORKERS = int(os.getenv("CYCLE_WORKERS", "2"))  # Processes searching cells, 0 to search in a thread of the bot
+CYCLE_PROPOSAL_TTL_DAYS = int(os.getenv("CYCLE_PROPOSAL_TTL_DAYS", "3"))  # How long a proposed cycle keeps its users out of new proposals
+
+# Cache settings
+MATCH_SESSION_TTL_SECONDS = int(os.getenv("MATCH_SESSION_TTL_SECONDS", "300"))  # How long a computed /matches result is reused
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory for a single process, redis to share the cache between replicas
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")  # Redis-protocol server of the redis cache backend
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))  # Entries kept in the in-process cache
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "300"))  # How long users and pantries are cached
+CACHE_NEAR_TTL_SECONDS = float(os.getenv("CACHE_NEAR_TTL_SECONDS", "5"))  # How long a replica keeps entries of the redis cache in memory
+RECIPE_CACHE_TTL_SECONDS = int(os.getenv("RECIPE_CACHE_TTL_SECONDS", "21600"))  # How long recipe API results are cached
+RECIPE_STALE_TTL_SECONDS = int(os.getenv("RECIPE_STALE_TTL_SECONDS", "604800"))  # How much longer they are kept, served while refreshed or while the API is down
+
+# Change feed settings
+CHANGE_FEED_ENABLED = os.getenv("CHANGE_FEED_ENABLED", "true").lower() in ("1", "true", "yes")  # Follow writes of other processes through change streams, needs a replica set
+CHANGE_FEED_RETRY_SECONDS = float(os.getenv("CHANGE_FEED_RETRY_SECONDS", "5"))  # Wait before reopening the change stream after an error
+
+# Persistence settings
+PERSISTENCE_INTERVAL_SECONDS = float(os.getenv("PERSISTENCE_INTERVAL_SECONDS", "30"))  # How often changed conversations and user_data are saved, 0 to disable persistence
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "false").lower() in ("1", "true", "yes")  # Skip updates sent while the bot was down
+
+# Partitioning settings
+REGIONS = os.getenv("REGIONS", "")  # Regions as geohash prefixes, like "north=u33f,u33g;south=u336;rest=*", empty to run a single process
+WORKER_NAME = os.getenv("WORKER_NAME", "")  # Region this process serves, empty to serve every user
+WORKER_HOST = os.getenv("WORKER_HOST", "127.0.0.1")  # Interface a worker receives routed updates on
+WORKER_PORT = int(os.getenv("WORKER_PORT", "0"))  # Port a worker receives routed updates on, 0 to poll Telegram itself
+WORKER_URLS = os.getenv("WORKER_URLS", "")  # Router only: worker of each region, like "north=http://10.0.0.2:8081;rest=http://10.0.0.3:8081"
+ROUTER_SECRET = os.getenv("ROUTER_SECRET", "")  # Shared secret the router sends with every update
+ROUTER_CACHE_SECONDS = float(os.getenv("ROUTER_CACHE_SECONDS", "30"))  # How long the router remembers the region of a user
+
+# Monitoring settings
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # Interface the metrics endpoint listens on
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))  # Port of the Prometheus /metrics endpoint, 0 to disable
+SLOW_UPDATE_THRESHOLD_MS = float(os.getenv("SLOW_UPDATE_THRESHOLD_MS", "1000"))  # Updates slower than this are logged with their timing tree
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))  # Fraction of updates written to TRACE_FILE, 0 to disable
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")  # JSON lines file for sampled traces
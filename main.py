@@ -14,8 +14,25 @@ from bot.handlers import (
     start_command, help_command, register_command, add_ingredient_command,
     remove_ingredient_command, list_ingredients_command, search_command,
     offer_command, request_command, matches_command, set_location_command,
-    button_handler, cancel_command, profile_command, text_handler
+    button_handler, cancel_command, profile_command, text_handler,
+    import_pantry_document, MATCH_SESSION_KEY, PENDING_VIEWS_KEY
 )
+from bot.update_processor import PerUserUpdateProcessor
+from bot.jobs import expiry_job, cycle_job, community_job
+from bot.update_receiver import start_update_receiver
+from bot.persistence import MongoPersistence
+from services.notifications import NotificationDispatcher
+from services.availability import ensure_built as ensure_availability_map
+from services.match_store import ensure_built as ensure_match_table
+from services.expiry import backfill_expiry
+from services.regions import backfill_geohash, get_regions
+from services.cycles import CycleSolver, ensure_indexes as ensure_cycle_indexes
+from services.communities import ensure_indexes as ensure_community_indexes
+from services.change_feed import ChangeFeed
+from models.user import User
+from models.ingredient import Ingredient
+from utils.metrics import start_metrics_server
+from utils.cache import get_cache
 
 # Set up logging
 logging.basicConfig(
@@ -24,17 +41,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def main():
-    """Start the bot."""
-    from config import TELEGRAM_TOKEN
-    
-    if not TELEGRAM_TOKEN:
-        logger.error("No TELEGRAM_TOKEN provided in environment variables!")
-        return
-
-    # Create the Application
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+def prepare_database():
+    """Create indexes and build the availability map and match table before serving updates."""
+    User.ensure_indexes()
+    Ingredient.ensure_indexes()
+    backfill_geohash()
+    backfill_expiry()
+    # Matching skips the areas the availability map says nobody lists an ingredient in
+    ensure_availability_map()
+    ensure_match_table()
+    ensure_cycle_indexes()
+    ensure_community_indexes()
 
+def build_application(token, update_processor=None, request=None, persistence=None):
+    """
+    Create the Application with all handlers registered.
+    
+    Parameters:
+    - token: Telegram bot token
+    - update_processor: Update processor to use, by default a PerUserUpdateProcessor
+      with MAX_CONCURRENT_UPDATES
+    - request: Optional telegram.request.BaseRequest used for Bot API calls,
+      e.g. a stub that doesn't talk to Telegram
+    - persistence: Optional BasePersistence keeping conversations and user_data across restarts
+    
+    Returns:
+    - The Application, with its NotificationDispatcher in bot_data['notifier'] and,
+      when exchange cycles are searched, its CycleSolver in bot_data['cycle_solver']
+    """
+    from config import (
+        MAX_CONCURRENT_UPDATES, EXPIRY_SWEEP_INTERVAL_SECONDS, CYCLE_INTERVAL_SECONDS, COMMUNITY_REFRESH_SECONDS
+    )
+    
+    # Updates run concurrently, but each user's updates are still handled in order
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(update_processor or PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = builder.build()
+    
     # Add handlers
     # Basic commands
     application.add_handler(CommandHandler("start", start_command))
@@ -48,17 +98,21 @@ async def main():
             "NAME": [MessageHandler(filters.TEXT & ~filters.COMMAND, register_command)],
             "LOCATION": [MessageHandler(filters.LOCATION, set_location_command)]
         },
-        fallbacks=[CommandHandler("cancel", cancel_command)]
+        fallbacks=[CommandHandler("cancel", cancel_command)],
+        name="register",
+        persistent=persistence is not None
     )
     application.add_handler(register_conv_handler)
     
-    # Set location command
+    # Set location command, and the location shared in reply to it
     application.add_handler(CommandHandler("setlocation", set_location_command))
+    application.add_handler(MessageHandler(filters.LOCATION, set_location_command))
     
     # Ingredient management
     application.add_handler(CommandHandler("add", add_ingredient_command))
     application.add_handler(CommandHandler("remove", remove_ingredient_command))
     application.add_handler(CommandHandler("list", list_ingredients_command))
+    application.add_handler(MessageHandler(filters.Document.ALL, import_pantry_document))
     
     # Exchange functionality
     application.add_handler(CommandHandler("offer", offer_command))
@@ -72,15 +126,72 @@ async def main():
     # Handle text messages
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
     
+    # Outgoing notifications are queued and sent in the background
+    application.bot_data['notifier'] = NotificationDispatcher(application.bot)
+    
+    # Expired offers and requests are removed, and their owners warned, in the background
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(expiry_job, interval=EXPIRY_SWEEP_INTERVAL_SECONDS, first=0, name="expiry")
+        # Exchange cycles among three or more neighbors are proposed in the background
+        if CYCLE_INTERVAL_SECONDS > 0:
+            application.bot_data['cycle_solver'] = CycleSolver()
+            application.job_queue.run_repeating(cycle_job, interval=CYCLE_INTERVAL_SECONDS, name="cycles")
+        # Recipes are suggested per neighborhood, from its members' combined pantries
+        if COMMUNITY_REFRESH_SECONDS > 0:
+            application.job_queue.run_repeating(community_job, interval=COMMUNITY_REFRESH_SECONDS, first=0, name="communities")
+    else:
+        logger.warning("No JobQueue available, expired offers and requests won't be removed")
+    
+    return application
+
+async def main():
+    """Start the bot."""
+    from config import (
+        TELEGRAM_TOKEN, METRICS_HOST, METRICS_PORT, WORKER_NAME, WORKER_HOST, WORKER_PORT, ROUTER_SECRET,
+        PERSISTENCE_INTERVAL_SECONDS, DROP_PENDING_UPDATES, CHANGE_FEED_ENABLED
+    )
+    
+    if not TELEGRAM_TOKEN:
+        logger.error("No TELEGRAM_TOKEN provided in environment variables!")
+        return
+    
+    if WORKER_NAME and WORKER_NAME not in get_regions():
+        logger.error(f"WORKER_NAME {WORKER_NAME} is not one of the REGIONS")
+        return
+    
+    # Create the Application. The match session is a cache of the match table and is rebuilt after a restart,
+    # and the views waiting for recipes are waited on by tasks that don't survive one
+    persistence = None
+    if PERSISTENCE_INTERVAL_SECONDS > 0:
+        persistence = MongoPersistence(PERSISTENCE_INTERVAL_SECONDS, transient_keys=(MATCH_SESSION_KEY, PENDING_VIEWS_KEY))
+    application = build_application(TELEGRAM_TOKEN, persistence=persistence)
+    notifier = application.bot_data['notifier']
+    
+    # Expose Prometheus metrics
+    metrics_server = start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    receiver = None
+    # Writes of other replicas and by hand reach this process's caches too
+    change_feed = ChangeFeed() if CHANGE_FEED_ENABLED else None
+    
     # Run the bot
     logger.info("Starting bot...")
     try:
+        await asyncio.to_thread(prepare_database)
+        if change_feed:
+            change_feed.start()
         await application.initialize()
         await application.start()
-        await application.updater.start_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
+        await notifier.start()
+        if WORKER_PORT:
+            # Partitioned deployment: the router polls Telegram and forwards this region's updates
+            receiver = start_update_receiver(application, WORKER_HOST, WORKER_PORT, ROUTER_SECRET)
+            if receiver is None:
+                return
+        else:
+            await application.updater.start_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=DROP_PENDING_UPDATES
+            )
         while True:
             await asyncio.sleep(1)
     except KeyboardInterrupt:
@@ -88,9 +199,20 @@ async def main():
     except Exception as e:
         logger.error(f"Error running bot: {e}", exc_info=True)
     finally:
-        await application.updater.stop()
+        if receiver:
+            receiver.shutdown()
+        if change_feed:
+            change_feed.stop()
+        await notifier.stop()
+        if application.updater.running:
+            await application.updater.stop()
         await application.stop()
         await application.shutdown()
+        if metrics_server:
+            metrics_server.shutdown()
+        if 'cycle_solver' in application.bot_data:
+            application.bot_data['cycle_solver'].close()
+        get_cache().close()
 
 if __name__ == '__main__':
     if sys.platform == 'win32':
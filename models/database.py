@@ -0,0 +1,64 @@
+import logging
+from pymongo import MongoClient, monitoring
+from config import MONGODB_URI, DB_NAME
+from utils.metrics import MONGO_OPERATIONS, MONGO_FAILURES, MONGO_LATENCY
+from utils.tracing import record_span
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+class CommandMetrics(monitoring.CommandListener):
+    """Count MongoDB commands and their latency per collection and operation."""
+    
+    def __init__(self):
+        """Initialize the listener."""
+        self._collections = {}  # request_id -> collection of commands still running
+    
+    def started(self, event):
+        """Remember the collection, which only the started event carries."""
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection')
+        else:
+            collection = event.command.get(event.command_name)
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ''
+    
+    def succeeded(self, event):
+        """Record a finished command."""
+        self._record(event)
+    
+    def failed(self, event):
+        """Record a failed command."""
+        MONGO_FAILURES.inc(**self._record(event))
+    
+    def _record(self, event):
+        """Count a command and its latency, returning its labels."""
+        labels = {
+            'collection': self._collections.pop(event.request_id, ''),
+            'operation': event.command_name
+        }
+        MONGO_OPERATIONS.inc(**labels)
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, **labels)
+        record_span(f"mongo {labels['collection']}.{labels['operation']}", event.duration_micros / 1e6)
+        return labels
+
+def get_database():
+    """
+    Get the application database.
+    
+    The MongoClient is created once and shared, since it keeps its own
+    connection pool and is safe to use from several threads.
+    
+    Returns:
+    - pymongo Database, or None if the client could not be created
+    """
+    global _client
+    
+    if _client is None:
+        try:
+            _client = MongoClient(MONGODB_URI, event_listeners=[CommandMetrics()])
+        except Exception as e:
+            logger.error(f"Error connecting to database: {e}")
+            return None
+    
+    return _client[DB_NAME]
@@ -0,0 +1,48 @@
+_MISSING = object()
+
+class Field:
+    """
+    A model attribute read from the model's MongoDB document when accessed.
+    
+    Nothing is copied when a model is created, so wrapping a document costs
+    the same however many fields it has. Fields left out by a projection
+    read as their default.
+    """
+    
+    __slots__ = ('key', 'default')
+    
+    def __init__(self, key, default=None):
+        """
+        Declare the field.
+        
+        Parameters:
+        - key: Key of the field in the document
+        - default: Value when the document lacks the key, called first if
+          it is a function, so that every model gets its own list
+        """
+        self.key = key
+        self.default = default
+    
+    def __get__(self, instance, owner=None):
+        """Read the field from the document of instance."""
+        if instance is None:
+            return self
+        value = instance._document.get(self.key, _MISSING)
+        if value is _MISSING:
+            return self.default() if callable(self.default) else self.default
+        return value
+
+class Document:
+    """
+    Base of the models, wrapping one document of their collection.
+    
+    Any mapping works as the document, including a RawBSONDocument, whose
+    fields are only decoded once read. Models have no __dict__, and read
+    only fields.
+    """
+    
+    __slots__ = ('_document',)
+    
+    def __init__(self, document):
+        """Wrap a document."""
+        self._document = document
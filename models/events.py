@@ -0,0 +1,42 @@
+import logging
+from collections import defaultdict
+from utils.deadline import detached
+
+logger = logging.getLogger(__name__)
+
+# Events published by the models after a successful write
+OFFER_ADDED = 'offer_added'  # user_id, ingredient_id
+OFFER_REMOVED = 'offer_removed'  # user_id, ingredient_id
+REQUEST_ADDED = 'request_added'  # user_id, ingredient
+REQUEST_REMOVED = 'request_removed'  # user_id, ingredient
+LOCATION_CHANGED = 'location_changed'  # user_id, location
+INGREDIENT_ADDED = 'ingredient_added'  # user_id, ingredient_id, name
+INGREDIENT_REMOVED = 'ingredient_removed'  # user_id, ingredient_id, name
+
+# Events published by the change feed for every write to MongoDB, by any process
+USER_CHANGED = 'user_changed'  # user_id, operation, document, fields
+INGREDIENT_CHANGED = 'ingredient_changed'  # ingredient_id, user_id, operation, document, fields
+CHAT_CHANGED = 'chat_changed'  # chat_id, operation, document, fields
+COLLECTION_RESET = 'collection_reset'  # collection
+
+_subscribers = defaultdict(list)
+
+def subscribe(event, callback):
+    """Call callback with the event's fields every time the event is published."""
+    _subscribers[event].append(callback)
+
+def publish(event, **fields):
+    """
+    Notify the subscribers of an event.
+    
+    Subscribers run synchronously in the caller's thread. A failing subscriber
+    is logged and does not affect the others or the write that published it.
+    They run outside of the time budget of the update that made the write:
+    cutting the upkeep of derived data short would leave it half done
+    until something else changes it.
+    """
+    for callback in list(_subscribers[event]):
+        try:
+            detached(callback, **fields)
+        except Exception as e:
+            logger.error(f"Error handling {event} event in {callback.__qualname__}: {e}", exc_info=True)
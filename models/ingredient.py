@@ -1,40 +1,60 @@
 import logging
-from pymongo import MongoClient
-from config import MONGODB_URI, DB_NAME
-from datetime import datetime
+from pymongo import ASCENDING, UpdateOne
+from models.database import get_database
+from models.document import Document, Field
+from utils.tracing import traced
+from utils.cache import get_cache
+from utils.metrics import CACHE_REQUESTS
+from models.events import publish, INGREDIENT_ADDED, INGREDIENT_REMOVED
+from config import OFFER_SHELF_LIFE_DAYS
+from datetime import datetime, timedelta
 import uuid
 
 logger = logging.getLogger(__name__)
 
-class Ingredient:
+class Ingredient(Document):
     """Ingredient model for managing ingredient data."""
     
-    def __init__(self, ingredient_data):
-        """Initialize the ingredient object."""
-        self.id = ingredient_data.get('_id')
-        self.user_id = ingredient_data.get('user_id')
-        self.name = ingredient_data.get('name')
-        self.amount = ingredient_data.get('amount')
-        self.unit = ingredient_data.get('unit')
-        self.category = ingredient_data.get('category')
-        self.created_at = ingredient_data.get('created_at')
+    __slots__ = ()
+    
+    id = Field('_id')
+    user_id = Field('user_id')
+    name = Field('name')
+    amount = Field('amount')
+    unit = Field('unit')
+    category = Field('category')
+    created_at = Field('created_at')
     
     @classmethod
     def get_collection(cls):
         """Get the ingredients collection from MongoDB."""
+        db = get_database()
+        return db.ingredients if db is not None else None
+    
+    @classmethod
+    def invalidate(cls, user_id):
+        """Drop the cached pantry of a user, on every replica."""
+        get_cache().bump(f"pantry:{user_id}")
+    
+    @classmethod
+    def ensure_indexes(cls):
+        """Create the indexes used to look up ingredients."""
+        collection = cls.get_collection()
+        if collection is None:
+            return
+        
         try:
-            client = MongoClient(MONGODB_URI)
-            db = client[DB_NAME]
-            return db.ingredients
+            collection.create_index([('user_id', ASCENDING), ('name', ASCENDING)])
+            collection.create_index('name')
         except Exception as e:
-            logger.error(f"Error connecting to database: {e}")
-            return None
+            logger.error(f"Error creating ingredient indexes: {e}")
     
     @classmethod
+    @traced
     def add(cls, user_id, name, amount, unit="", category=None):
         """Add a new ingredient to a user's pantry."""
         collection = cls.get_collection()
-        if not collection:
+        if collection is None:
             return None
         
         try:
@@ -54,6 +74,8 @@ class Ingredient:
             
             result = collection.insert_one(ingredient_data)
             if result.acknowledged:
+                cls.invalidate(user_id)
+                publish(INGREDIENT_ADDED, user_id=user_id, ingredient_id=ingredient_data['_id'], name=ingredient_data['name'])
                 return cls(ingredient_data)
             return None
         except Exception as e:
@@ -61,6 +83,68 @@ class Ingredient:
             return None
     
     @classmethod
+    @traced
+    def add_many(cls, user_id, items):
+        """
+        Add or update several ingredients of a user's pantry in one write.
+        
+        Items whose name is already in the pantry get their amount and unit
+        updated, the others are inserted.
+        
+        Parameters:
+        - user_id: Internal user ID
+        - items: List of (name, amount, unit) tuples with unique names
+        
+        Returns:
+        - Tuple of (number of ingredients added, number updated), or None on error
+        """
+        collection = cls.get_collection()
+        if collection is None:
+            return None
+        
+        if not items:
+            return 0, 0
+        
+        categories = cls.categorize_many(name for name, _, _ in items)
+        now = datetime.now()
+        operations = []
+        for name, amount, unit in items:
+            name = name.lower()
+            operations.append(UpdateOne(
+                {'user_id': user_id, 'name': name},
+                {
+                    '$set': {'amount': amount, 'unit': unit, 'category': categories[name]},
+                    '$setOnInsert': {'_id': str(uuid.uuid4()), 'user_id': user_id, 'name': name, 'created_at': now}
+                },
+                upsert=True
+            ))
+        
+        try:
+            result = collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Error adding ingredients: {e}")
+            return None
+        
+        cls.invalidate(user_id)
+        
+        for index, ingredient_id in result.upserted_ids.items():
+            publish(INGREDIENT_ADDED, user_id=user_id, ingredient_id=ingredient_id, name=items[index][0].lower())
+        
+        return result.upserted_count, result.matched_count
+    
+    @classmethod
+    @traced
+    def find_names_by_user_id(cls, user_id):
+        """Get the names of all ingredients in a user's pantry."""
+        return {ingredient.name for ingredient in cls.find_by_user_id(user_id)}
+    
+    @classmethod
+    def categorize_many(cls, names):
+        """Categorize several ingredients, each distinct name once."""
+        return {name: cls.categorize(name) for name in {name.lower() for name in names}}
+    
+    @classmethod
+    @traced
     def categorize(cls, name):
         """Categorize an ingredient based on its name."""
         name = name.lower()
@@ -86,27 +170,38 @@ class Ingredient:
             return 'Other'
     
     @classmethod
+    def shelf_life(cls, category):
+        """Get how long an offer of an ingredient in a category stays up by default."""
+        return timedelta(days=OFFER_SHELF_LIFE_DAYS.get(category, OFFER_SHELF_LIFE_DAYS['Other']))
+    
+    @classmethod
+    @traced
     def remove(cls, user_id, name):
         """Remove an ingredient from a user's pantry."""
         collection = cls.get_collection()
-        if not collection:
+        if collection is None:
             return False
         
         try:
-            result = collection.delete_one({
+            removed = collection.find_one_and_delete({
                 'user_id': user_id,
                 'name': name.lower()
             })
-            return result.deleted_count > 0
+            if removed:
+                cls.invalidate(user_id)
+                publish(INGREDIENT_REMOVED, user_id=user_id, ingredient_id=removed['_id'], name=removed['name'])
+                return True
+            return False
         except Exception as e:
             logger.error(f"Error removing ingredient: {e}")
             return False
     
     @classmethod
+    @traced
     def find_by_id(cls, ingredient_id):
         """Find an ingredient by its ID."""
         collection = cls.get_collection()
-        if not collection:
+        if collection is None:
             return None
         
         try:
@@ -119,10 +214,11 @@ class Ingredient:
             return None
     
     @classmethod
+    @traced
     def find_by_name_and_user(cls, user_id, name):
         """Find an ingredient by name and user ID."""
         collection = cls.get_collection()
-        if not collection:
+        if collection is None:
             return None
         
         try:
@@ -138,32 +234,55 @@ class Ingredient:
             return None
     
     @classmethod
+    @traced
     def find_by_user_id(cls, user_id):
-        """Find all ingredients belonging to a user."""
+        """
+        Find all ingredients belonging to a user.
+        
+        Pantries are cached until they change. The key carries the version
+        of the user's pantry, so a read racing a write can't cache the old
+        pantry under the current key.
+        """
         collection = cls.get_collection()
-        if not collection:
+        if collection is None:
             return []
         
-        try:
-            ingredient_data = collection.find({'user_id': user_id})
+        cache = get_cache()
+        key = cache.versioned_key(f"pantry:{user_id}", 'items')
+        ingredient_data = cache.get(key)
+        if ingredient_data is not None:
+            CACHE_REQUESTS.inc(cache='pantry', result='hit')
             return [cls(data) for data in ingredient_data]
+        CACHE_REQUESTS.inc(cache='pantry', result='miss')
+        
+        try:
+            ingredient_data = list(collection.find({'user_id': user_id}))
         except Exception as e:
             logger.error(f"Error finding ingredients: {e}")
             return []
+        
+        cache.set(key, ingredient_data)
+        return [cls(data) for data in ingredient_data]
     
     @classmethod
+    @traced
     def update(cls, ingredient_id, amount, unit):
         """Update an ingredient's amount and unit."""
         collection = cls.get_collection()
-        if not collection:
+        if collection is None:
             return False
         
         try:
-            result = collection.update_one(
+            # The document from before the update tells whose pantry changed
+            previous = collection.find_one_and_update(
                 {'_id': ingredient_id},
-                {'$set': {'amount': amount, 'unit': unit}}
+                {'$set': {'amount': amount, 'unit': unit}},
+                projection={'user_id': 1, 'amount': 1, 'unit': 1}
             )
-            return result.modified_count > 0
+            if not previous or (previous.get('amount'), previous.get('unit')) == (amount, unit):
+                return False
+            cls.invalidate(previous['user_id'])
+            return True
         except Exception as e:
             logger.error(f"Error updating ingredient: {e}")
             return False
\ No newline at end of file
@@ -1,36 +1,102 @@
 import logging
-from pymongo import MongoClient
-from config import MONGODB_URI, DB_NAME
-from datetime import datetime
+from pymongo import ASCENDING, UpdateOne
+from models.database import get_database
+from models.document import Document, Field
+from models.ingredient import Ingredient
+from utils.tracing import traced
+from utils.cache import get_cache
+from utils.metrics import CACHE_REQUESTS
+from utils.geohash import encode as geohash_encode
+from models.events import (
+    publish, OFFER_ADDED, OFFER_REMOVED, REQUEST_ADDED, REQUEST_REMOVED, LOCATION_CHANGED
+)
+from config import REQUEST_TTL_DAYS
+from datetime import datetime, timedelta, timezone
 import uuid
 
 logger = logging.getLogger(__name__)
 
-class User:
+def utcnow():
+    """Get the current UTC time as a naive datetime, the way pymongo returns stored dates."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def is_expired(entry, now=None):
+    """Check whether an offer or request has expired. Entries without an expiry never do."""
+    expires_at = entry.get('expires_at')
+    return expires_at is not None and expires_at <= (now or utcnow())
+
+def geohash_of(location):
+    """Get the geohash stored with a location, None without a location."""
+    if not location:
+        return None
+    return geohash_encode(location['latitude'], location['longitude'])
+
+def _restrict(condition, query):
+    """Combine a condition with an optional extra users query."""
+    return {'$and': [query, condition]} if query else condition
+
+def not_expired(now):
+    """Query condition on expires_at matching entries still live at now, including ones without an expiry."""
+    return {'$not': {'$lte': now}}
+
+# Fields of a user shown to their neighbors, the projection of scans that only need to find users
+PROFILE_FIELDS = {'name': 1, 'telegram_id': 1, 'location': 1}
+
+class User(Document):
     """User model for managing user data."""
     
-    def __init__(self, user_data):
-        """Initialize the user object."""
-        self.id = user_data.get('_id')
-        self.telegram_id = user_data.get('telegram_id')
-        self.name = user_data.get('name')
-        self.location = user_data.get('location')
-        self.created_at = user_data.get('created_at')
-        self.offers = user_data.get('offers', [])
-        self.requests = user_data.get('requests', [])
+    __slots__ = ()
+    
+    id = Field('_id')
+    telegram_id = Field('telegram_id')
+    name = Field('name')
+    location = Field('location')
+    geohash = Field('geohash')
+    created_at = Field('created_at')
+    offers = Field('offers', list)
+    requests = Field('requests', list)
+    
+    def active_offers(self, now=None):
+        """Get the offers that haven't expired yet."""
+        now = now or utcnow()
+        return [offer for offer in self.offers if not is_expired(offer, now)]
+    
+    def active_requests(self, now=None):
+        """Get the requests that haven't expired yet."""
+        now = now or utcnow()
+        return [request for request in self.requests if not is_expired(request, now)]
     
     @classmethod
     def get_collection(cls):
         """Get the users collection from MongoDB."""
+        db = get_database()
+        return db.users if db is not None else None
+    
+    @classmethod
+    def invalidate(cls, user_id):
+        """Drop the cached document of a user, on every replica. Call after every write to the user."""
+        get_cache().bump(f"user:{user_id}")
+    
+    @classmethod
+    def ensure_indexes(cls):
+        """Create the indexes used to look up and match users."""
+        collection = cls.get_collection()
+        if collection is None:
+            return
+        
         try:
-            client = MongoClient(MONGODB_URI)
-            db = client[DB_NAME]
-            return db.users
+            collection.create_index('telegram_id')
+            collection.create_index('geohash')
+            collection.create_index([('location.latitude', ASCENDING), ('location.longitude', ASCENDING)])
+            collection.create_index('requests.ingredient')
+            collection.create_index('offers.ingredient_id')
+            collection.create_index('offers.expires_at')
+            collection.create_index('requests.expires_at')
         except Exception as e:
-            logger.error(f"Error connecting to database: {e}")
-            return None
+            logger.error(f"Error creating user indexes: {e}")
     
     @classmethod
+    @traced
     def create(cls, telegram_id, name, location=None):
         """Create a new user."""
         collection = cls.get_collection()
@@ -43,6 +109,7 @@ class User:
                 'telegram_id': telegram_id,
                 'name': name,
                 'location': location,
+                'geohash': geohash_of(location),
                 'created_at': datetime.now(),
                 'offers': [],
                 'requests': []
@@ -57,15 +124,27 @@ class User:
             return None
     
     @classmethod
+    @traced
     def find_by_telegram_id(cls, telegram_id):
         """Find a user by their Telegram ID."""
         collection = cls.get_collection()
         if collection is None:
             return None
         
+        # The internal ID of a Telegram user never changes, the document is cached under it
+        cache = get_cache()
+        user_id = cache.get(f"user-tg:{telegram_id}")
+        if user_id is not None:
+            user = cls.find_by_id(user_id)
+            if user:
+                return user
+        else:
+            CACHE_REQUESTS.inc(cache='user', result='miss')
+        
         try:
             user_data = collection.find_one({'telegram_id': telegram_id})
             if user_data:
+                cache.set(f"user-tg:{telegram_id}", user_data['_id'])
                 return cls(user_data)
             return None
         except Exception as e:
@@ -73,15 +152,46 @@ class User:
             return None
     
     @classmethod
+    @traced
+    def find_geohash(cls, telegram_id):
+        """Get the geohash of a user's location, None if the user or location is unknown."""
+        collection = cls.get_collection()
+        if collection is None:
+            return None
+        
+        try:
+            user_data = collection.find_one({'telegram_id': telegram_id}, {'geohash': 1})
+            return user_data.get('geohash') if user_data else None
+        except Exception as e:
+            logger.error(f"Error finding user geohash: {e}")
+            return None
+    
+    @classmethod
+    @traced
     def find_by_id(cls, user_id):
-        """Find a user by their internal ID."""
+        """
+        Find a user by their internal ID.
+        
+        Documents are cached until the user changes. The key carries the
+        version of the user, so a read racing a write can't cache the old
+        document under the current key.
+        """
         collection = cls.get_collection()
         if collection is None:
             return None
         
+        cache = get_cache()
+        key = cache.versioned_key(f"user:{user_id}", 'doc')
+        user_data = cache.get(key)
+        if user_data is not None:
+            CACHE_REQUESTS.inc(cache='user', result='hit')
+            return cls(user_data)
+        CACHE_REQUESTS.inc(cache='user', result='miss')
+        
         try:
             user_data = collection.find_one({'_id': user_id})
             if user_data:
+                cache.set(key, user_data)
                 return cls(user_data)
             return None
         except Exception as e:
@@ -89,6 +199,7 @@ class User:
             return None
     
     @classmethod
+    @traced
     def update_location(cls, user_id, location):
         """Update a user's location."""
         collection = cls.get_collection()
@@ -98,60 +209,122 @@ class User:
         try:
             result = collection.update_one(
                 {'_id': user_id},
-                {'$set': {'location': location}}
+                {'$set': {'location': location, 'geohash': geohash_of(location)}}
             )
-            return result.modified_count > 0
+            if result.modified_count > 0:
+                cls.invalidate(user_id)
+                publish(LOCATION_CHANGED, user_id=user_id, location=location)
+                return True
+            return False
         except Exception as e:
             logger.error(f"Error updating location: {e}")
             return False
     
     @classmethod
-    def add_offer(cls, user_id, ingredient_id):
-        """Add an ingredient offer."""
+    @traced
+    def add_offer(cls, user_id, ingredient_id, shelf_life=None):
+        """
+        Add an ingredient offer, or renew it if the ingredient is already offered.
+        
+        Parameters:
+        - user_id: Internal user ID
+        - ingredient_id: ID of the offered pantry ingredient
+        - shelf_life: How long the offer stays up, by default the shelf life
+          of the ingredient's category
+        
+        Returns:
+        - When the offer expires, or None if it couldn't be added
+        """
         collection = cls.get_collection()
         if collection is None:
-            return False
+            return None
         
         try:
-            offer = {
-                'ingredient_id': ingredient_id,
-                'created_at': datetime.now()
-            }
+            if shelf_life is None:
+                ingredient = Ingredient.find_by_id(ingredient_id)
+                shelf_life = Ingredient.shelf_life(ingredient.category if ingredient else None)
+            expires_at = utcnow() + shelf_life
             
             result = collection.update_one(
-                {'_id': user_id},
-                {'$push': {'offers': offer}}
+                {'_id': user_id, 'offers.ingredient_id': ingredient_id},
+                {'$set': {'offers.$.expires_at': expires_at, 'offers.$.expiry_warned': False}}
             )
-            return result.modified_count > 0
+            if result.matched_count == 0:
+                offer = {
+                    'ingredient_id': ingredient_id,
+                    'created_at': datetime.now(),
+                    'expires_at': expires_at
+                }
+                
+                result = collection.update_one(
+                    {'_id': user_id},
+                    {'$push': {'offers': offer}}
+                )
+            if result.modified_count > 0:
+                cls.invalidate(user_id)
+                publish(OFFER_ADDED, user_id=user_id, ingredient_id=ingredient_id)
+                return expires_at
+            return None
         except Exception as e:
             logger.error(f"Error adding offer: {e}")
-            return False
+            return None
     
     @classmethod
-    def add_request(cls, user_id, ingredient_name, amount="", unit=""):
-        """Add an ingredient request."""
+    @traced
+    def add_request(cls, user_id, ingredient_name, amount="", unit="", shelf_life=None):
+        """
+        Add an ingredient request, or renew it if the ingredient is already requested.
+        
+        Parameters:
+        - user_id: Internal user ID
+        - ingredient_name: Name of the requested ingredient
+        - amount: Amount needed
+        - unit: Unit of the amount
+        - shelf_life: How long the request stays up, REQUEST_TTL_DAYS by default
+        
+        Returns:
+        - When the request expires, or None if it couldn't be added
+        """
         collection = cls.get_collection()
         if collection is None:
-            return False
+            return None
         
         try:
-            request = {
-                'ingredient': ingredient_name,
-                'amount': amount,
-                'unit': unit,
-                'created_at': datetime.now()
-            }
+            expires_at = utcnow() + (shelf_life or timedelta(days=REQUEST_TTL_DAYS))
             
             result = collection.update_one(
-                {'_id': user_id},
-                {'$push': {'requests': request}}
+                {'_id': user_id, 'requests.ingredient': ingredient_name},
+                {'$set': {
+                    'requests.$.amount': amount,
+                    'requests.$.unit': unit,
+                    'requests.$.expires_at': expires_at,
+                    'requests.$.expiry_warned': False
+                }}
             )
-            return result.modified_count > 0
+            if result.matched_count == 0:
+                request = {
+                    'ingredient': ingredient_name,
+                    'amount': amount,
+                    'unit': unit,
+                    'created_at': datetime.now(),
+                    'expires_at': expires_at
+                }
+                
+                result = collection.update_one(
+                    {'_id': user_id},
+                    {'$push': {'requests': request}}
+                )
+            if result.modified_count > 0:
+                cls.invalidate(user_id)
+                publish(REQUEST_ADDED, user_id=user_id, ingredient=ingredient_name)
+                return expires_at
+            return None
         except Exception as e:
             logger.error(f"Error adding request: {e}")
-            return False
+            return None
     
     @classmethod
+    @traced
     def remove_offer(cls, user_id, offer_index):
         """Remove an ingredient offer."""
         collection = cls.get_collection()
@@ -159,23 +332,29 @@ class User:
             return False
         
         try:
-            user = cls.find_by_id(user_id)
-            if not user or offer_index >= len(user.offers):
+            # Read past the cache, the whole list is written back
+            user_data = collection.find_one({'_id': user_id}, {'offers': 1})
+            offers = user_data.get('offers', []) if user_data else []
+            if offer_index >= len(offers):
                 return False
             
-            offers = user.offers
-            offers.pop(offer_index)
+            removed = offers.pop(offer_index)
             
             result = collection.update_one(
                 {'_id': user_id},
                 {'$set': {'offers': offers}}
             )
-            return result.modified_count > 0
+            if result.modified_count > 0:
+                cls.invalidate(user_id)
+                publish(OFFER_REMOVED, user_id=user_id, ingredient_id=removed['ingredient_id'])
+                return True
+            return False
         except Exception as e:
             logger.error(f"Error removing offer: {e}")
             return False
     
     @classmethod
+    @traced
     def remove_request(cls, user_id, request_index):
         """Remove an ingredient request."""
         collection = cls.get_collection()
@@ -183,25 +362,147 @@ class User:
             return False
         
         try:
-            user = cls.find_by_id(user_id)
-            if not user or request_index >= len(user.requests):
+            # Read past the cache, the whole list is written back
+            user_data = collection.find_one({'_id': user_id}, {'requests': 1})
+            requests = user_data.get('requests', []) if user_data else []
+            if request_index >= len(requests):
                 return False
             
-            requests = user.requests
-            requests.pop(request_index)
+            removed = requests.pop(request_index)
             
             result = collection.update_one(
                 {'_id': user_id},
                 {'$set': {'requests': requests}}
             )
-            return result.modified_count > 0
+            if result.modified_count > 0:
+                cls.invalidate(user_id)
+                publish(REQUEST_REMOVED, user_id=user_id, ingredient=removed['ingredient'])
+                return True
+            return False
         except Exception as e:
             logger.error(f"Error removing request: {e}")
             return False
     
     @classmethod
-    def find_nearby_users(cls, location, max_distance_km=5):
-        """Find users within a specified distance."""
+    @traced
+    def find_with_expired(cls, now, query=None):
+        """Get the IDs of users, among the ones matching query, with offers or requests that expired by now."""
+        collection = cls.get_collection()
+        if collection is None:
+            return []
+        
+        try:
+            return collection.distinct('_id', _restrict({
+                '$or': [{'offers.expires_at': {'$lte': now}}, {'requests.expires_at': {'$lte': now}}]
+            }, query))
+        except Exception as e:
+            logger.error(f"Error finding expired offers and requests: {e}")
+            return []
+    
+    @classmethod
+    @traced
+    def remove_expired(cls, user_id, now):
+        """
+        Remove a user's offers and requests that expired by now.
+        
+        Parameters:
+        - user_id: Internal user ID
+        - now: Current UTC time
+        
+        Returns:
+        - Tuple of (removed offers, removed requests)
+        """
+        collection = cls.get_collection()
+        if collection is None:
+            return [], []
+        
+        try:
+            # The document from before the update tells which entries were pulled
+            user_data = collection.find_one_and_update(
+                {'_id': user_id},
+                {'$pull': {
+                    'offers': {'expires_at': {'$lte': now}},
+                    'requests': {'expires_at': {'$lte': now}}
+                }}
+            )
+        except Exception as e:
+            logger.error(f"Error removing expired offers and requests: {e}")
+            return [], []
+        
+        if not user_data:
+            return [], []
+        
+        offers = [offer for offer in user_data.get('offers', []) if is_expired(offer, now)]
+        requests = [request for request in user_data.get('requests', []) if is_expired(request, now)]
+        if offers or requests:
+            cls.invalidate(user_id)
+        for offer in offers:
+            publish(OFFER_REMOVED, user_id=user_id, ingredient_id=offer['ingredient_id'])
+        for request in requests:
+            publish(REQUEST_REMOVED, user_id=user_id, ingredient=request['ingredient'])
+        return offers, requests
+    
+    @classmethod
+    @traced
+    def find_expiring(cls, now, until, query=None):
+        """
+        Find users, among the ones matching query, with offers or requests expiring by until they weren't warned about.
+        
+        Only their Telegram ID, offers and requests are read.
+        """
+        collection = cls.get_collection()
+        if collection is None:
+            return []
+        
+        expiring = {'$elemMatch': {'expires_at': {'$gt': now, '$lte': until}, 'expiry_warned': {'$ne': True}}}
+        try:
+            return [cls(user_data) for user_data in collection.find(_restrict({
+                '$or': [{'offers': expiring}, {'requests': expiring}]
+            }, query), {'telegram_id': 1, 'offers': 1, 'requests': 1})]
+        except Exception as e:
+            logger.error(f"Error finding expiring offers and requests: {e}")
+            return []
+    
+    @classmethod
+    @traced
+    def mark_expiry_warned(cls, user_id, offers, requests):
+        """
+        Remember that a user was warned about expiring offers and requests.
+        
+        Entries renewed in the meantime have a new expiry and are left alone.
+        
+        Parameters:
+        - user_id: Internal user ID
+        - offers: Offers the user was warned about
+        - requests: Requests the user was warned about
+        """
+        collection = cls.get_collection()
+        if collection is None or not (offers or requests):
+            return
+        
+        operations = [UpdateOne(
+            {'_id': user_id, 'offers': {'$elemMatch': {
+                'ingredient_id': offer['ingredient_id'], 'expires_at': offer['expires_at']
+            }}},
+            {'$set': {'offers.$.expiry_warned': True}}
+        ) for offer in offers]
+        operations += [UpdateOne(
+            {'_id': user_id, 'requests': {'$elemMatch': {
+                'ingredient': request['ingredient'], 'expires_at': request['expires_at']
+            }}},
+            {'$set': {'requests.$.expiry_warned': True}}
+        ) for request in requests]
+        
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Error marking expiry warnings: {e}")
+        cls.invalidate(user_id)
+    
+    @classmethod
+    @traced
+    def find_nearby_users(cls, location, max_distance_km=5, limit=None):
+        """Find users within a specified distance, the limit best ranked ones if given."""
         collection = cls.get_collection()
         if collection is None:
             return []
@@ -209,7 +510,8 @@ class User:
         # MongoDB doesn't support geospatial queries in this version
         # So we'll do a simplified version by getting all users and filtering in Python
         try:
-            all_users = collection.find({'location': {'$exists': True}})
+            # Only what neighbors are shown is read, not the offers and requests
+            all_users = collection.find({'location': {'$exists': True}}, PROFILE_FIELDS)
             nearby_users = []
             
             for user_data in all_users:
@@ -227,20 +529,18 @@ class User:
                         'distance': distance
                     })
             
-            # Sort by distance
-            nearby_users.sort(key=lambda x: x['distance'])
-            return nearby_users
+            from services.ranking import top_k
+            return top_k(nearby_users, limit)
         except Exception as e:
             logger.error(f"Error finding nearby users: {e}")
             return []
     
     @classmethod
+    @traced
     def create_chat(cls, user1_id, user2_id):
         """Create a chat between two users."""
         try:
-            client = MongoClient(MONGODB_URI)
-            db = client[DB_NAME]
-            chats_collection = db.chats
+            chats_collection = get_database().chats
             
             # Check if chat already exists
             existing_chat = chats_collection.find_one({
@@ -271,12 +571,11 @@ class User:
             return None
     
     @classmethod
+    @traced
     def get_chat(cls, chat_id):
         """Get a chat by ID."""
         try:
-            client = MongoClient(MONGODB_URI)
-            db = client[DB_NAME]
-            chats_collection = db.chats
+            chats_collection = get_database().chats
             
             chat = chats_collection.find_one({'_id': chat_id})
             return chat
@@ -285,12 +584,11 @@ class User:
             return None
     
     @classmethod
+    @traced
     def add_message_to_chat(cls, chat_id, user_id, message):
         """Add a message to a chat."""
         try:
-            client = MongoClient(MONGODB_URI)
-            db = client[DB_NAME]
-            chats_collection = db.chats
+            chats_collection = get_database().chats
             
             message_data = {
                 'user_id': user_id,
@@ -0,0 +1,261 @@
+import logging
+from collections import defaultdict
+from models.database import get_database
+from models.user import User, geohash_of
+from models.ingredient import Ingredient
+from models.events import (
+    subscribe, OFFER_ADDED, OFFER_REMOVED, REQUEST_ADDED, REQUEST_REMOVED, LOCATION_CHANGED, INGREDIENT_REMOVED
+)
+from utils.cache import get_cache
+from utils.distance import get_nearby_coordinates
+from utils.geohash import covering
+from utils.metrics import CACHE_REQUESTS
+from config import AVAILABILITY_CELL_PRECISION, MAX_DISTANCE_KM
+
+logger = logging.getLogger(__name__)
+
+# What users in a cell do with an ingredient
+OFFERED = 'offered'
+REQUESTED = 'requested'
+
+def get_collection():
+    """Get the availability collection from MongoDB."""
+    db = get_database()
+    return db.availability if db is not None else None
+
+def ensure_indexes():
+    """Create the index used to find the entries a user is in."""
+    collection = get_collection()
+    if collection is None:
+        return
+    
+    try:
+        collection.create_index('users')
+    except Exception as e:
+        logger.error(f"Error creating availability indexes: {e}")
+
+def ensure_built():
+    """Create the indexes and fill the availability map if it has never been built."""
+    ensure_indexes()
+    
+    collection = get_collection()
+    if collection is None:
+        return
+    
+    try:
+        if collection.estimated_document_count() == 0:
+            logger.info("Availability map is empty, building it from current offers and requests")
+            rebuild()
+    except Exception as e:
+        logger.error(f"Error checking availability map: {e}")
+
+def rebuild():
+    """Recompute the availability map from every located user's offers and requests."""
+    users = User.get_collection()
+    collection = get_collection()
+    if users is None or collection is None:
+        return
+    
+    try:
+        query = {
+            'location': {'$ne': None},
+            '$or': [{'offers.0': {'$exists': True}}, {'requests.0': {'$exists': True}}]
+        }
+        located = [User(user_data) for user_data in users.find(query, {'location': 1, 'offers': 1, 'requests': 1})]
+        names = _ingredient_names({offer.get('ingredient_id') for user in located for offer in user.active_offers()})
+        members = defaultdict(list)
+        for user in located:
+            for key in _keys_of(user, names):
+                members[key].append(user.id)
+        
+        # Written in one go, instead of an update per user and ingredient
+        collection.delete_many({})
+        documents = [_document(key, user_ids) for key, user_ids in members.items()]
+        if documents:
+            collection.insert_many(documents, ordered=False)
+    except Exception as e:
+        logger.error(f"Error rebuilding availability map: {e}")
+
+def available_near(location, name, kind):
+    """
+    Check whether anyone around a location offers or requested an ingredient.
+    
+    Answers from per-cell lists of who offers and requests what, without
+    looking at any user. Cells cover more than MAX_DISTANCE_KM, so True only
+    means someone might be in range, but False means nobody is and exact
+    matching can be skipped.
+    
+    Parameters:
+    - location: Dictionary with latitude and longitude
+    - name: Ingredient name
+    - kind: OFFERED or REQUESTED
+    
+    Returns:
+    - False if nobody nearby does, True otherwise, including when it can't be told
+    """
+    collection = get_collection()
+    if collection is None or not location:
+        return True
+    
+    name = name.lower()
+    cache = get_cache()
+    box = get_nearby_coordinates(location['latitude'], location['longitude'], MAX_DISTANCE_KM)
+    keys = {}
+    
+    for cell in covering(box, AVAILABILITY_CELL_PRECISION):
+        # Versioned before reading, so an answer read during a change isn't cached as current
+        cache_key = cache.versioned_key(f"availability:{cell}", f"{kind}:{name}")
+        cached = cache.get(cache_key)
+        CACHE_REQUESTS.inc(cache='availability', result='hit' if cached is not None else 'miss')
+        if cached:
+            return True
+        if cached is None:
+            keys[_key(cell, kind, name)] = cache_key
+    
+    if not keys:
+        return False
+    
+    try:
+        found = {
+            document['_id'] for document in collection.find(
+                {'_id': {'$in': list(keys)}, 'users.0': {'$exists': True}},
+                {'_id': 1}
+            )
+        }
+    except Exception as e:
+        logger.error(f"Error checking availability of {name}: {e}")
+        return True
+    
+    for key, cache_key in keys.items():
+        cache.set(cache_key, key in found)
+    return bool(found)
+
+def refresh(user, kind, name):
+    """
+    Record whether a user currently offers or requests one ingredient.
+    
+    Parameters:
+    - user: User object
+    - kind: OFFERED or REQUESTED
+    - name: Ingredient name
+    """
+    name = name.lower()
+    cell = _cell_of(user)
+    if kind == OFFERED:
+        listed = name in _offered_names(user)
+    else:
+        listed = any(request['ingredient'].lower() == name for request in user.active_requests())
+    
+    _move(user.id, {'kind': kind, 'ingredient': name}, [_key(cell, kind, name)] if cell and listed else [])
+
+def refresh_user(user):
+    """Record everything a user offers and requests, in the cell they are in now."""
+    _move(user.id, {}, _keys_of(user))
+
+def _move(user_id, scope, keys):
+    """
+    Make a user a member of exactly the given entries among the ones in scope.
+    
+    Membership is a set, so replaying a change leaves the map as it was.
+    """
+    collection = get_collection()
+    if collection is None:
+        return
+    
+    keys = set(keys)
+    changed = set()
+    for document in collection.find({**scope, 'users': user_id, '_id': {'$nin': list(keys)}}, {'cell': 1}):
+        collection.update_one({'_id': document['_id']}, {'$pull': {'users': user_id}})
+        # Only deleted while still empty, a user added meanwhile recreates it anyway
+        collection.delete_one({'_id': document['_id'], 'users': {'$size': 0}})
+        changed.add(document['cell'])
+    
+    for key in keys:
+        fields = _fields(key)
+        result = collection.update_one(
+            {'_id': key},
+            {'$addToSet': {'users': user_id}, '$setOnInsert': fields},
+            upsert=True
+        )
+        if result.modified_count or result.upserted_id is not None:
+            changed.add(fields['cell'])
+    
+    if changed:
+        get_cache().bump(*(f"availability:{cell}" for cell in changed))
+
+def _key(cell, kind, name):
+    """Build the ID of the entry of one ingredient in one cell."""
+    return f"{cell}:{kind}:{name}"
+
+def _fields(key):
+    """Get the cell, kind and ingredient an entry ID stands for."""
+    cell, kind, name = key.split(':', 2)
+    return {'cell': cell, 'kind': kind, 'ingredient': name}
+
+def _document(key, user_ids):
+    """Build the entry of one ingredient in one cell."""
+    return {'_id': key, **_fields(key), 'users': user_ids}
+
+def _keys_of(user, names=None):
+    """Get the IDs of the entries a user belongs in, with offered ingredient names already read if given."""
+    cell = _cell_of(user)
+    if not cell:
+        return set()
+    keys = {_key(cell, OFFERED, name) for name in _offered_names(user, names)}
+    keys.update(_key(cell, REQUESTED, request['ingredient'].lower()) for request in user.active_requests())
+    return keys
+
+def _cell_of(user):
+    """Get the cell a user is in, None without a location."""
+    geohash = geohash_of(user.location)
+    return geohash[:AVAILABILITY_CELL_PRECISION] if geohash else None
+
+def _offered_names(user, names=None):
+    """Get the lower-cased names of the ingredients a user currently offers."""
+    ingredient_ids = {offer.get('ingredient_id') for offer in user.active_offers()}
+    if names is None:
+        names = _ingredient_names(ingredient_ids, user.id)
+    return {names[ingredient_id] for ingredient_id in ingredient_ids if ingredient_id in names}
+
+def _ingredient_names(ingredient_ids, user_id=None):
+    """Read the lower-cased names of ingredients by ID, only of one user's pantry if given."""
+    collection = Ingredient.get_collection()
+    if collection is None or not ingredient_ids:
+        return {}
+    
+    query = {'_id': {'$in': list(ingredient_ids)}}
+    if user_id is not None:
+        query['user_id'] = user_id
+    return {data['_id']: data['name'].lower() for data in collection.find(query, {'name': 1})}
+
+def _on_offer_changed(user_id, ingredient_id):
+    """Record an offer that was added or removed."""
+    user = User.find_by_id(user_id)
+    ingredient = Ingredient.find_by_id(ingredient_id)
+    if user and ingredient:
+        refresh(user, OFFERED, ingredient.name)
+
+def _on_request_changed(user_id, ingredient):
+    """Record a request that was added or removed."""
+    user = User.find_by_id(user_id)
+    if user:
+        refresh(user, REQUESTED, ingredient)
+
+def _on_location_changed(user_id, location):
+    """Move everything a user offers and requests to their new cell."""
+    user = User.find_by_id(user_id)
+    if user:
+        refresh_user(user)
+
+def _on_ingredient_removed(user_id, ingredient_id, name):
+    """An ingredient that left the pantry is no longer offered."""
+    user = User.find_by_id(user_id)
+    if user:
+        refresh(user, OFFERED, name)
+
+subscribe(OFFER_ADDED, _on_offer_changed)
+subscribe(OFFER_REMOVED, _on_offer_changed)
+subscribe(REQUEST_ADDED, _on_request_changed)
+subscribe(REQUEST_REMOVED, _on_request_changed)
+subscribe(LOCATION_CHANGED, _on_location_changed)
+subscribe(INGREDIENT_REMOVED, _on_ingredient_removed)
@@ -0,0 +1,235 @@
+import logging
+import threading
+from pymongo.database import Database
+from pymongo.errors import OperationFailure, PyMongoError
+from models.database import get_database
+from models.user import User
+from models.ingredient import Ingredient
+from models.events import (
+    subscribe, publish, USER_CHANGED, INGREDIENT_CHANGED, CHAT_CHANGED, COLLECTION_RESET
+)
+from services.match_store import bump_data_versions
+from utils.cache import get_cache
+from utils.metrics import CHANGE_FEED_EVENTS
+from config import CHANGE_FEED_RETRY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Collections followed by default
+COLLECTIONS = ('users', 'ingredients', 'chats')
+
+# Kinds of cache namespaces holding data read from each collection
+CACHED_KINDS = {
+    'users': ('user', 'matches'),
+    'ingredients': ('pantry', 'matches'),
+    'chats': ()
+}
+
+# Operations that change one document
+DOCUMENT_OPERATIONS = ('insert', 'update', 'replace', 'delete')
+
+# Collections whose changes carry the document as it was before, to know whose a deleted document was
+PRE_IMAGE_COLLECTIONS = ('ingredients',)
+
+# Server error codes: change streams need a replica set, and the oplog no longer reaches back to the resume token
+NOT_A_REPLICA_SET = 40573
+HISTORY_LOST = (280, 286)
+
+# How long a wait for the next change may block, so that stop() doesn't wait long
+MAX_AWAIT_MS = 1000
+
+class ChangeFeed:
+    """
+    Follows every write to the users, ingredients and chats collections.
+    
+    The models publish their own events after writing, but only in the
+    process that wrote. The feed tails a MongoDB change stream instead,
+    so writes of other replicas, of scripts and of admins editing the
+    database by hand reach the subscribers of every process too. Each
+    change is published as a USER_CHANGED, INGREDIENT_CHANGED or
+    CHAT_CHANGED event, from the feed's thread.
+    
+    The resume token of the last change read is kept, so a stream that
+    broke is reopened right after it and no change is skipped. Tokens
+    aren't stored: whatever subscribers derive lives in memory and is
+    built anew when a process starts. If the server no longer has the
+    changes since the token, or a collection was dropped or renamed,
+    COLLECTION_RESET tells subscribers to rebuild from the collection.
+    
+    Change streams need a replica set, a single-node one will do. On a
+    standalone server the feed logs a warning and stops. Deletes of
+    ingredients only say whose pantry they left through pre-images,
+    which the feed turns on for the collection (MongoDB 6.0 and later).
+    """
+    
+    def __init__(self, collections=COLLECTIONS, retry_seconds=CHANGE_FEED_RETRY_SECONDS):
+        """
+        Initialize the feed, stopped.
+        
+        Parameters:
+        - collections: Names of the collections to follow
+        - retry_seconds: Wait before reopening the stream after an error
+        """
+        self.collections = list(collections)
+        self.retry_seconds = retry_seconds
+        self._resume_token = None
+        # Whether pre-images could be enabled, None until tried
+        self._pre_images = None
+        self._stopping = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start following changes in a background thread."""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop following changes and wait for the thread to finish."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=MAX_AWAIT_MS / 1000 + 5)
+        self._thread = None
+    
+    def _run(self):
+        """Tail the change stream until stopped, reopening it after errors."""
+        while not self._stopping.is_set():
+            db = get_database()
+            if db is not None and not isinstance(db, Database):
+                logger.warning("The database doesn't support change streams, writes of other processes won't be followed")
+                return
+            
+            try:
+                if db is not None:
+                    self._tail(db)
+                    continue
+                logger.error(f"No database to follow changes of, retrying in {self.retry_seconds}s")
+            except OperationFailure as e:
+                if e.code == NOT_A_REPLICA_SET:
+                    logger.warning(f"Change streams need MongoDB to run as a replica set, writes of other processes won't be followed: {e}")
+                    return
+                if e.code not in HISTORY_LOST:
+                    logger.error(f"Change stream failed, reopening in {self.retry_seconds}s: {e}")
+                else:
+                    logger.warning(f"Changes since the last one read are no longer available, starting over: {e}")
+                    self._reset(self.collections)
+                    continue
+            except PyMongoError as e:
+                logger.error(f"Change stream failed, reopening in {self.retry_seconds}s: {e}")
+            self._stopping.wait(self.retry_seconds)
+    
+    def _tail(self, db):
+        """Read changes from one stream until it closes or the feed is stopped."""
+        if self._pre_images is None:
+            self._pre_images = self._enable_pre_images(db)
+        
+        pipeline = [{'$match': {'ns.coll': {'$in': self.collections}}}]
+        # Servers before 6.0 refuse the option, so it's only passed once pre-images are on
+        before_change = {'full_document_before_change': 'whenAvailable'} if self._pre_images else {}
+        with db.watch(
+            pipeline,
+            full_document='updateLookup',
+            resume_after=self._resume_token,
+            max_await_time_ms=MAX_AWAIT_MS,
+            **before_change
+        ) as stream:
+            if self._resume_token is None:
+                logger.info(f"Following changes to {', '.join(self.collections)}")
+            while stream.alive and not self._stopping.is_set():
+                change = stream.try_next()
+                # Moves on without changes too, so a reopened stream doesn't scan the oplog since the last one
+                self._resume_token = stream.resume_token
+                if change is not None and not self._dispatch(change):
+                    return
+    
+    def _enable_pre_images(self, db):
+        """
+        Have the server keep the documents changes replace, for the collections that need them.
+        
+        Returns:
+        - True if pre-images are on for all of them
+        """
+        enabled = False
+        for collection in PRE_IMAGE_COLLECTIONS:
+            if collection not in self.collections:
+                continue
+            try:
+                db.command('collMod', collection, changeStreamPreAndPostImages={'enabled': True})
+                enabled = True
+            except OperationFailure as e:
+                logger.warning(f"Could not enable pre-images of {collection}, deletes from it will drop every cached pantry and match: {e}")
+                return False
+        return enabled
+    
+    def _dispatch(self, change):
+        """
+        Publish the event of one change.
+        
+        Returns:
+        - False if the stream was invalidated and has to be opened anew
+        """
+        operation = change['operationType']
+        collection = change.get('ns', {}).get('coll')
+        CHANGE_FEED_EVENTS.inc(collection=collection or '', operation=operation)
+        
+        if operation == 'invalidate':
+            # Can't be resumed after, changes until the new stream opens are missed
+            self._reset(self.collections)
+            return False
+        if operation not in DOCUMENT_OPERATIONS:
+            # Dropped or renamed, every document read from the collection is gone
+            self._reset([collection] if collection in self.collections else self.collections)
+            return True
+        
+        document = change.get('fullDocument')
+        updates = change.get('updateDescription')
+        fields = {
+            'operation': operation,
+            'document': document,
+            # Only updates say what changed, inserts, replacements and deletes change everything
+            'fields': list(updates['updatedFields']) + list(updates['removedFields']) if updates else None
+        }
+        document_id = change['documentKey']['_id']
+        if collection == 'users':
+            publish(USER_CHANGED, user_id=document_id, **fields)
+        elif collection == 'ingredients':
+            # Deleted documents are gone by the time the change is read, only their pre-image says whose they were
+            owner = document or change.get('fullDocumentBeforeChange')
+            user_id = owner.get('user_id') if owner else None
+            publish(INGREDIENT_CHANGED, ingredient_id=document_id, user_id=user_id, **fields)
+        elif collection == 'chats':
+            publish(CHAT_CHANGED, chat_id=document_id, **fields)
+        return True
+    
+    def _reset(self, collections):
+        """Start over from the current changes and have subscribers rebuild from the collections."""
+        self._resume_token = None
+        for collection in collections:
+            publish(COLLECTION_RESET, collection=collection)
+
+def _on_user_changed(user_id, operation, document, fields):
+    """Drop the cached document and matches of a changed user, whoever changed it."""
+    User.invalidate(user_id)
+    bump_data_versions([user_id])
+
+def _on_ingredient_changed(ingredient_id, user_id, operation, document, fields):
+    """Drop the cached pantry and matches of the owner of a changed ingredient, or of everyone if unknown."""
+    if user_id is None:
+        get_cache().bump_kind('pantry', 'matches')
+        return
+    Ingredient.invalidate(user_id)
+    bump_data_versions([user_id])
+
+def _on_collection_reset(collection):
+    """Drop everything cached from a collection, changes to any of its documents may have been missed."""
+    kinds = CACHED_KINDS.get(collection, ())
+    if kinds:
+        logger.info(f"Dropping cached {', '.join(kinds)} data after a reset of {collection}")
+        get_cache().bump_kind(*kinds)
+
+subscribe(USER_CHANGED, _on_user_changed)
+subscribe(INGREDIENT_CHANGED, _on_ingredient_changed)
+subscribe(COLLECTION_RESET, _on_collection_reset)
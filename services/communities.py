@@ -0,0 +1,285 @@
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime
+from pymongo import ReplaceOne
+from models.database import get_database
+from models.user import User
+from models.ingredient import Ingredient
+from services.recipe_service import get_recipe_by_ingredients
+from services.regions import worker_filter
+from services.ranking import top_k
+from utils.distance import calculate_distance
+from utils.geohash import encode
+from utils.tracing import traced
+from config import (
+    COMMUNITY_RADIUS_KM, COMMUNITY_MIN_USERS, COMMUNITY_MAX_USERS, COMMUNITY_MAX_INGREDIENTS, COMMUNITY_RECIPES,
+    MAX_DISTANCE_KM, WORKER_NAME
+)
+
+logger = logging.getLogger(__name__)
+
+# Kilometers per degree of latitude, and of longitude at the equator
+KM_PER_DEGREE = 111.0
+
+def get_collection():
+    """Get the communities collection from MongoDB."""
+    db = get_database()
+    return db.communities if db is not None else None
+
+def ensure_indexes():
+    """Create the index used to find a user's community."""
+    collection = get_collection()
+    if collection is None:
+        return
+    
+    try:
+        collection.create_index('members')
+        collection.create_index([('worker', 1), ('updated_at', 1)])
+    except Exception as e:
+        logger.error(f"Error creating community indexes: {e}")
+
+def cluster_locations(points, radius_km=COMMUNITY_RADIUS_KM, min_users=COMMUNITY_MIN_USERS):
+    """
+    Group points into dense neighborhoods with DBSCAN.
+    
+    A point with at least min_users points (itself included) within
+    radius_km is a core point. Core points within reach of each other form a
+    cluster, together with the points they reach. Points no core point
+    reaches are left out. Neighbors are looked up in a grid of radius-sized
+    cells, so only nearby points are compared.
+    
+    Parameters:
+    - points: List of (id, latitude, longitude) tuples
+    - radius_km: Neighborhood radius
+    - min_users: Points needed within the radius to start a cluster
+    
+    Returns:
+    - List of clusters, each a list of point IDs
+    """
+    if not points:
+        return []
+    
+    # Degrees of longitude shrink towards the poles, sized for the point furthest from the equator
+    widest = min(max(abs(lat) for _, lat, _ in points), 89.0)
+    lat_step = radius_km / KM_PER_DEGREE
+    lon_step = radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest)))
+    
+    grid = defaultdict(list)
+    cells = []
+    for index, (_, lat, lon) in enumerate(points):
+        cell = (math.floor(lat / lat_step), math.floor(lon / lon_step))
+        grid[cell].append(index)
+        cells.append(cell)
+    
+    def neighbors(index):
+        _, lat, lon = points[index]
+        row, column = cells[index]
+        return [
+            other
+            for d_row in (-1, 0, 1) for d_column in (-1, 0, 1)
+            for other in grid.get((row + d_row, column + d_column), ())
+            if calculate_distance(lat, lon, points[other][1], points[other][2]) <= radius_km
+        ]
+    
+    labels = [None] * len(points)  # Cluster number, -1 for noise
+    clusters = []
+    for index in range(len(points)):
+        if labels[index] is not None:
+            continue
+        reachable = neighbors(index)
+        if len(reachable) < min_users:
+            labels[index] = -1
+            continue
+        
+        cluster = len(clusters)
+        members = [index]
+        labels[index] = cluster
+        queue = reachable
+        while queue:
+            other = queue.pop()
+            if labels[other] == -1:
+                # Noise within reach of a core point is a border point
+                labels[other] = cluster
+                members.append(other)
+            if labels[other] is not None:
+                continue
+            labels[other] = cluster
+            members.append(other)
+            other_reachable = neighbors(other)
+            if len(other_reachable) >= min_users:
+                queue.extend(other_reachable)
+        clusters.append([points[member][0] for member in members])
+    
+    return clusters
+
+def refresh_communities():
+    """
+    Recompute the communities of the users this process serves.
+    
+    Every community gets a shared pantry of what its members hold, and
+    one set of recipe suggestions for that pantry, so recipes are fetched
+    once per neighborhood instead of once per pair of neighbors.
+    
+    Returns:
+    - Number of communities stored
+    """
+    users = User.get_collection()
+    ingredients = Ingredient.get_collection()
+    collection = get_collection()
+    if users is None or ingredients is None or collection is None:
+        return 0
+    
+    try:
+        points = [
+            (user_data['_id'], user_data['location']['latitude'], user_data['location']['longitude'])
+            for user_data in users.find(
+                {'$and': [worker_filter(), {'location': {'$ne': None}}]},
+                {'location': 1}
+            )
+        ]
+    except Exception as e:
+        logger.error(f"Error reading user locations: {e}")
+        return 0
+    
+    locations = {user_id: (lat, lon) for user_id, lat, lon in points}
+    clusters = [
+        part for cluster in cluster_locations(points)
+        for part in _split(cluster, locations, COMMUNITY_MAX_USERS)
+    ]
+    now = datetime.now()
+    writes = []
+    
+    for members in clusters:
+        holders = defaultdict(set)
+        try:
+            for data in ingredients.find({'user_id': {'$in': members}}, {'name': 1, 'user_id': 1}):
+                holders[data['name'].lower()].add(data['user_id'])
+        except Exception as e:
+            logger.error(f"Error reading community pantry: {e}")
+            continue
+        
+        # The most widely held ingredients stand for the pantry, the API takes a limited list
+        pantry = sorted(holders, key=lambda name: (-len(holders[name]), name))[:COMMUNITY_MAX_INGREDIENTS]
+        recipes = get_recipe_by_ingredients(pantry, number=COMMUNITY_RECIPES) if pantry else []
+        
+        community_id = min(members)
+        writes.append(ReplaceOne({'_id': community_id}, {
+            '_id': community_id,
+            'members': members,
+            'pantry': [{'ingredient': name, 'holders': sorted(holders[name])} for name in sorted(holders)],
+            'recipes': recipes,
+            'worker': WORKER_NAME,
+            'updated_at': now
+        }, upsert=True))
+    
+    try:
+        if writes:
+            collection.bulk_write(writes, ordered=False)
+        # Communities that broke up or merged since the last refresh
+        collection.delete_many({'worker': WORKER_NAME, 'updated_at': {'$lt': now}})
+    except Exception as e:
+        logger.error(f"Error storing communities: {e}")
+        return 0
+    
+    logger.info(f"Grouped {sum(len(members) for members in clusters)} of {len(points)} users into {len(clusters)} communities")
+    return len(clusters)
+
+def _split(members, locations, max_users):
+    """
+    Split a cluster into parts of at most max_users.
+    
+    Clusters chain through dense areas and can span a whole city. Cutting
+    them in geohash order keeps every part a compact area.
+    """
+    if len(members) <= max_users:
+        return [members]
+    ordered = sorted(members, key=lambda user_id: encode(*locations[user_id]))
+    parts = math.ceil(len(ordered) / max_users)
+    size = math.ceil(len(ordered) / parts)
+    return [ordered[start:start + size] for start in range(0, len(ordered), size)]
+
+@traced
+def find_community_recipes(user, limit=None):
+    """
+    Suggest the recipes of a user's community that neighbors can help with.
+    
+    The recipes were fetched for the whole community's pantry, so only the
+    user's own pantry is read. Each recipe names the members within
+    MAX_DISTANCE_KM who hold what the user is missing, closest first.
+    
+    Parameters:
+    - user: User object
+    - limit: Number of best ranked recipes to return, None for all of them
+    
+    Returns:
+    - List of recipe matches in the format of find_matching_recipes(),
+      empty if the user isn't in a community
+    """
+    collection = get_collection()
+    if collection is None or not user.location:
+        return []
+    
+    try:
+        community = collection.find_one({'members': user.id}, {'pantry': 1, 'recipes': 1})
+    except Exception as e:
+        logger.error(f"Error reading community: {e}")
+        return []
+    if not community or not community.get('recipes'):
+        return []
+    
+    own = {name.lower() for name in Ingredient.find_names_by_user_id(user.id)}
+    holders = {entry['ingredient']: entry['holders'] for entry in community['pantry']}
+    neighbors = {}  # user ID -> (User, distance), None when out of range
+    
+    def neighbor(user_id):
+        if user_id not in neighbors:
+            other = User.find_by_id(user_id) if user_id != user.id else None
+            neighbors[user_id] = None
+            if other and other.location:
+                distance = calculate_distance(
+                    user.location['latitude'], user.location['longitude'],
+                    other.location['latitude'], other.location['longitude']
+                )
+                if distance <= MAX_DISTANCE_KM:
+                    neighbors[user_id] = (other, distance)
+        return neighbors[user_id]
+    
+    recipe_matches = []
+    for recipe in community['recipes']:
+        needed = {
+            ingredient.get('name', '').lower()
+            for ingredient in recipe.get('usedIngredients', []) + recipe.get('missedIngredients', [])
+        }
+        needed.discard('')
+        
+        helpers = {}  # user ID -> (User, distance, number of needed ingredients they hold)
+        missing = []
+        for name in sorted(needed - own):
+            reachable = [neighbor(holder) for holder in holders.get(name, [])]
+            reachable = [found for found in reachable if found]
+            if not reachable:
+                missing.append(name)
+                continue
+            other, distance = min(reachable, key=lambda found: found[1])
+            count = helpers[other.id][2] + 1 if other.id in helpers else 1
+            helpers[other.id] = (other, distance, count)
+        
+        if not helpers:
+            # Nothing the user needs comes from a neighbor
+            continue
+        
+        # The neighbor bringing the most is the main cook, the closest among equals
+        partners = sorted(helpers.values(), key=lambda helper: (-helper[2], helper[1]))
+        recipe_match = {
+            'user': partners[0][0],
+            'partners': [helper[0] for helper in partners],
+            'recipe': recipe,
+            'distance': max(helper[1] for helper in partners),
+            'completeness': 1 - len(missing) / len(needed)
+        }
+        if missing:
+            recipe_match['missing_ingredients'] = missing
+        recipe_matches.append(recipe_match)
+    
+    return top_k(recipe_matches, limit)
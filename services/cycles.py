@@ -0,0 +1,312 @@
+import asyncio
+import logging
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+from models.database import get_database
+from models.user import User, utcnow
+from services import match_store
+from services.match_store import OFFER
+from services.regions import worker_filter
+from config import (
+    CYCLE_MAX_LENGTH, CYCLE_CELL_PRECISION, CYCLE_TIME_BUDGET_SECONDS, CYCLE_WORKERS, CYCLE_PROPOSAL_TTL_DAYS
+)
+
+logger = logging.getLogger(__name__)
+
+# Paths a search of one cell may extend before it gives up, so a dense cell can't hold a worker forever
+MAX_EXPANSIONS = 200000
+
+def get_collection():
+    """Get the cycles collection from MongoDB."""
+    db = get_database()
+    return db.cycles if db is not None else None
+
+def ensure_indexes():
+    """Create the indexes used to find changed cells and open proposals."""
+    collection = get_collection()
+    matches = match_store.get_collection()
+    if collection is None or matches is None:
+        return
+    
+    try:
+        collection.create_index('members')
+        # Proposals nobody acted on go away, so their members can be proposed a new cycle
+        collection.create_index('expires_at', expireAfterSeconds=0)
+        matches.create_index([('created_at', ASCENDING)])
+    except Exception as e:
+        logger.error(f"Error creating cycle indexes: {e}")
+
+def find_cycles(edges, max_length=CYCLE_MAX_LENGTH, max_expansions=MAX_EXPANSIONS):
+    """
+    Find exchange cycles of 3 to max_length users, no user in two of them.
+    
+    Every cycle is searched from its smallest user and only visits larger
+    ones, so each is found once however it is rotated. Shorter cycles are
+    picked first, they need fewer people to follow through. Two-way swaps
+    are left out, /matches already shows them.
+    
+    Runs in a worker process, so it only takes and returns plain data.
+    
+    Parameters:
+    - edges: Dictionary of giver -> dictionary of receiver -> ingredients
+      the giver offers and the receiver requested
+    - max_length: Most users in a cycle
+    - max_expansions: Paths tried before the search stops with what it found
+    
+    Returns:
+    - List of cycles, each a list of (giver, receiver, ingredient) steps
+    """
+    found = []
+    expansions = 0
+    
+    for start in sorted(edges):
+        path = [start]
+        on_path = {start}
+        # Each frame iterates the receivers of the user at the same depth of the path
+        stack = [iter(sorted(edges[start]))]
+        
+        while stack and expansions < max_expansions:
+            receiver = next(stack[-1], None)
+            if receiver is None:
+                stack.pop()
+                on_path.discard(path.pop())
+                continue
+            
+            expansions += 1
+            if receiver == start:
+                if len(path) >= 3:
+                    found.append(list(path))
+            elif receiver > start and receiver not in on_path and len(path) < max_length and receiver in edges:
+                path.append(receiver)
+                on_path.add(receiver)
+                stack.append(iter(sorted(edges[receiver])))
+        
+        if expansions >= max_expansions:
+            break
+    
+    chosen = []
+    taken = set()
+    for path in sorted(found, key=len):
+        if taken.isdisjoint(path):
+            taken.update(path)
+            chosen.append([
+                (giver, receiver, edges[giver][receiver][0])
+                for giver, receiver in zip(path, path[1:] + path[:1])
+            ])
+    return chosen
+
+def cycle_key(cycle):
+    """Identify a cycle by its users and ingredients, starting from its smallest user."""
+    return '|'.join(f"{giver}>{receiver}:{ingredient}" for giver, receiver, ingredient in cycle)
+
+def cell_of(geohash, precision=CYCLE_CELL_PRECISION):
+    """Get the cell a geohash lies in."""
+    return geohash[:precision]
+
+class CycleSolver:
+    """
+    Finds exchange cycles among nearby users in the background.
+    
+    Users are grouped into cells by geohash prefix, and every cell's graph
+    of who can give what to whom is searched on its own. After the first
+    run only cells with new match rows are searched again. A run stops
+    handing out cells once its time budget is spent, and the cells it
+    didn't get to are searched first the next time.
+    
+    Searches run in a pool of worker processes, since they are CPU bound
+    and would otherwise hold up the bot's updates.
+    """
+    
+    def __init__(self, workers=CYCLE_WORKERS, max_length=CYCLE_MAX_LENGTH,
+                 precision=CYCLE_CELL_PRECISION, time_budget=CYCLE_TIME_BUDGET_SECONDS):
+        """
+        Initialize the solver.
+        
+        Parameters:
+        - workers: Worker processes searching cells, 0 to search in a thread
+        - max_length: Most users in a cycle
+        - precision: Geohash characters naming a cell
+        - time_budget: Seconds one run may spend
+        """
+        self.workers = workers
+        self.max_length = max_length
+        self.precision = precision
+        self.time_budget = time_budget
+        self._pool = None
+        self._watermark = None  # Match rows created after this haven't been looked at
+        self._dirty = set()  # Cells waiting to be searched
+    
+    async def run(self):
+        """
+        Search the changed cells and store the cycles found as proposals.
+        
+        Returns:
+        - List of (telegram_id, message text) tuples for the users in new proposals
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.time_budget
+        self._dirty |= await asyncio.to_thread(self._changed_cells)
+        cells = sorted(self._dirty)
+        
+        in_flight = {}
+        messages = []
+        searched = 0
+        
+        async def collect(timeout):
+            nonlocal searched
+            done, _ = await asyncio.wait(in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                cell, users = in_flight.pop(future)
+                try:
+                    cycles = future.result()
+                except Exception as e:
+                    logger.error(f"Error searching exchange cycles in cell {cell}: {e}")
+                    if isinstance(e, BrokenProcessPool):
+                        # A worker died, start a new pool next time
+                        self.close()
+                    continue
+                self._dirty.discard(cell)
+                searched += 1
+                messages.extend(await asyncio.to_thread(self._propose, cycles, users))
+        
+        for cell in cells:
+            if time.monotonic() >= deadline:
+                break
+            users, edges = await asyncio.to_thread(self._load_cell, cell)
+            if len(edges) < 3:
+                self._dirty.discard(cell)
+                continue
+            
+            try:
+                future = loop.run_in_executor(self._get_pool(), find_cycles, edges, self.max_length)
+            except BrokenProcessPool as e:
+                logger.error(f"Exchange cycle workers stopped: {e}")
+                self.close()
+                break
+            in_flight[future] = (cell, users)
+            while len(in_flight) >= max(1, self.workers) and time.monotonic() < deadline:
+                await collect(deadline - time.monotonic())
+        
+        while in_flight and time.monotonic() < deadline:
+            await collect(deadline - time.monotonic())
+        # Searches still running finish in the background, their cells stay dirty
+        
+        if self._dirty or searched:
+            logger.info(f"Searched {searched} cells for exchange cycles, {len(self._dirty)} cells left for the next run")
+        return messages
+    
+    def close(self):
+        """Stop the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+    
+    def _get_pool(self):
+        """Get the process pool, None to search in the event loop's thread pool."""
+        if self._pool is None and self.workers > 0:
+            # Forking a process that runs threads can copy held locks, spawn starts clean
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+    
+    def _changed_cells(self):
+        """Find the cells of the users served here with match rows created since the last run."""
+        users = User.get_collection()
+        matches = match_store.get_collection()
+        if users is None or matches is None:
+            return set()
+        
+        now = datetime.now()
+        try:
+            if self._watermark is None:
+                geohashes = users.distinct('geohash', {'$and': [worker_filter(), {'geohash': {'$ne': None}}]})
+            else:
+                user_ids = matches.distinct('user_id', {'created_at': {'$gt': self._watermark}})
+                if not user_ids:
+                    self._watermark = now
+                    return set()
+                geohashes = users.distinct('geohash', {'$and': [worker_filter(), {'_id': {'$in': user_ids}}]})
+        except Exception as e:
+            logger.error(f"Error finding changed cells: {e}")
+            return set()
+        
+        self._watermark = now
+        return {cell_of(geohash, self.precision) for geohash in geohashes if geohash}
+    
+    def _load_cell(self, cell):
+        """Read the users of a cell and the ingredients they can give each other."""
+        users_collection = User.get_collection()
+        matches = match_store.get_collection()
+        if users_collection is None or matches is None:
+            return {}, {}
+        
+        try:
+            users = {
+                user_data['_id']: user_data for user_data in users_collection.find(
+                    {'$and': [worker_filter(), {'geohash': {'$regex': '^' + re.escape(cell)}}]},
+                    {'name': 1, 'telegram_id': 1}
+                )
+            }
+            rows = matches.find(
+                {'user_id': {'$in': list(users)}, 'direction': OFFER},
+                {'user_id': 1, 'neighbor_id': 1, 'ingredient': 1}
+            )
+            edges = {}
+            for row in rows:
+                if row['neighbor_id'] in users:
+                    edges.setdefault(row['user_id'], {}).setdefault(row['neighbor_id'], []).append(row['ingredient'])
+        except Exception as e:
+            logger.error(f"Error reading cell {cell}: {e}")
+            return {}, {}
+        
+        for receivers in edges.values():
+            for ingredients in receivers.values():
+                ingredients.sort()
+        return users, edges
+    
+    def _propose(self, cycles, users):
+        """Store new cycles whose users aren't in an open proposal, and build their messages."""
+        collection = get_collection()
+        if collection is None:
+            return []
+        
+        now = utcnow()
+        messages = []
+        for cycle in cycles:
+            members = [giver for giver, _, _ in cycle]
+            try:
+                if collection.count_documents({'members': {'$in': members}}, limit=1):
+                    continue
+                collection.insert_one({
+                    '_id': cycle_key(cycle),
+                    'members': members,
+                    'steps': [
+                        {'giver': giver, 'receiver': receiver, 'ingredient': ingredient}
+                        for giver, receiver, ingredient in cycle
+                    ],
+                    'created_at': now,
+                    'expires_at': now + timedelta(days=CYCLE_PROPOSAL_TTL_DAYS)
+                })
+            except Exception as e:
+                logger.error(f"Error storing exchange cycle: {e}")
+                continue
+            
+            messages.extend(_cycle_messages(cycle, users))
+        return messages
+
+def _cycle_messages(cycle, users):
+    """Tell every user in a cycle what they give and what they get."""
+    messages = []
+    for index, (giver, receiver, ingredient) in enumerate(cycle):
+        previous, _, received = cycle[index - 1]
+        messages.append((users[giver]['telegram_id'], (
+            f"🔄 Exchange circle with {len(cycle) - 1} neighbors, everyone gets something they asked for:\n"
+            f"• You give {ingredient} to {users[receiver]['name']}\n"
+            f"• {users[previous]['name']} gives you {received}\n\n"
+            "Use /matches to get in touch with them."
+        )))
+    return messages
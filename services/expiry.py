@@ -0,0 +1,166 @@
+import logging
+from datetime import timedelta, timezone
+from models.user import User, utcnow, is_expired
+from models.ingredient import Ingredient
+from services.regions import worker_filter
+from config import EXPIRY_WARNING_HOURS, REQUEST_TTL_DAYS
+
+logger = logging.getLogger(__name__)
+
+def sweep(now=None):
+    """
+    Remove every offer and request of the users this process serves that has expired.
+    
+    Removing them publishes the usual events, so their match rows are
+    refreshed like for offers and requests users remove themselves.
+    
+    Parameters:
+    - now: Current UTC time, utcnow() by default
+    
+    Returns:
+    - Number of offers and requests removed
+    """
+    now = now or utcnow()
+    removed = 0
+    
+    for user_id in User.find_with_expired(now, worker_filter()):
+        offers, requests = User.remove_expired(user_id, now)
+        removed += len(offers) + len(requests)
+    
+    if removed:
+        logger.info(f"Removed {removed} expired offers and requests")
+    return removed
+
+def collect_warnings(now=None, window=None):
+    """
+    Find the offers and requests of the users this process serves that are
+    about to expire, and build a warning for their owners.
+    
+    Every offer or request is warned about once. Renewing it resets that.
+    
+    Parameters:
+    - now: Current UTC time, utcnow() by default
+    - window: How long before expiry users are warned, EXPIRY_WARNING_HOURS by default
+    
+    Returns:
+    - List of (telegram_id, message text) tuples
+    """
+    now = now or utcnow()
+    until = now + (window or timedelta(hours=EXPIRY_WARNING_HOURS))
+    warnings = []
+    
+    for user in User.find_expiring(now, until, worker_filter()):
+        offers = [offer for offer in user.offers if _needs_warning(offer, now, until)]
+        requests = [request for request in user.requests if _needs_warning(request, now, until)]
+        
+        names = _ingredient_names([offer['ingredient_id'] for offer in offers])
+        lines = [
+            f"• Your offer of {names[offer['ingredient_id']]} expires in {format_time_left(offer['expires_at'], now)}"
+            for offer in offers if offer['ingredient_id'] in names
+        ]
+        lines += [
+            f"• Your request for {request['ingredient']} expires in {format_time_left(request['expires_at'], now)}"
+            for request in requests
+        ]
+        
+        User.mark_expiry_warned(user.id, offers, requests)
+        if lines:
+            warnings.append((user.telegram_id, (
+                "⏰ Some of your exchanges are about to expire:\n" + "\n".join(lines) + "\n\n"
+                "Send /offer <ingredient> or /request <ingredient> again to keep them up."
+            )))
+    
+    return warnings
+
+def backfill_expiry():
+    """
+    Give offers and requests of the users this process serves that were
+    created before expiry existed their default expiry.
+    
+    Offers expire the shelf life of their ingredient's category after they
+    were created, requests REQUEST_TTL_DAYS after.
+    
+    Returns:
+    - Number of users updated
+    """
+    collection = User.get_collection()
+    if collection is None:
+        return 0
+    
+    missing = {'$elemMatch': {'expires_at': {'$exists': False}}}
+    updated = 0
+    
+    try:
+        users = collection.find(
+            {'$and': [worker_filter(), {'$or': [{'offers': missing}, {'requests': missing}]}]},
+            {'offers': 1, 'requests': 1}
+        )
+        for user_data in users:
+            offers = user_data.get('offers', [])
+            requests = user_data.get('requests', [])
+            categories = _ingredient_categories([offer['ingredient_id'] for offer in offers if 'expires_at' not in offer])
+            
+            for offer in offers:
+                if 'expires_at' not in offer:
+                    offer['expires_at'] = _created_at(offer) + Ingredient.shelf_life(categories.get(offer['ingredient_id']))
+            for request in requests:
+                if 'expires_at' not in request:
+                    request['expires_at'] = _created_at(request) + timedelta(days=REQUEST_TTL_DAYS)
+            
+            collection.update_one({'_id': user_data['_id']}, {'$set': {'offers': offers, 'requests': requests}})
+            User.invalidate(user_data['_id'])
+            updated += 1
+    except Exception as e:
+        logger.error(f"Error setting default expiry: {e}")
+    
+    if updated:
+        logger.info(f"Set the default expiry of offers and requests of {updated} users")
+    return updated
+
+def format_time_left(expires_at, now=None):
+    """Describe how long until an expiry, like "3 days" or "5 hours"."""
+    seconds = (expires_at - (now or utcnow())).total_seconds()
+    if seconds >= 2 * 86400:
+        return f"{round(seconds / 86400)} days"
+    if seconds >= 2 * 3600:
+        return f"{round(seconds / 3600)} hours"
+    if seconds >= 3600:
+        return "about an hour"
+    return "less than an hour"
+
+def _needs_warning(entry, now, until):
+    """Check whether an offer or request expires soon and wasn't warned about yet."""
+    return not is_expired(entry, now) and is_expired(entry, until) and not entry.get('expiry_warned')
+
+def _created_at(entry):
+    """
+    Get when an offer or request was created, in UTC like expiries, now if it doesn't say.
+    
+    created_at is written in the server's local time, converted so that
+    expiries computed from it aren't shifted by the UTC offset.
+    """
+    created_at = entry.get('created_at')
+    if created_at is None:
+        return utcnow()
+    return created_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+def _ingredient_names(ingredient_ids):
+    """Get the names of ingredients by ID."""
+    return {ingredient_id: data['name'] for ingredient_id, data in _find_ingredients(ingredient_ids).items()}
+
+def _ingredient_categories(ingredient_ids):
+    """Get the categories of ingredients by ID."""
+    return {ingredient_id: data.get('category') for ingredient_id, data in _find_ingredients(ingredient_ids).items()}
+
+def _find_ingredients(ingredient_ids):
+    """Read the name and category of ingredients by ID."""
+    collection = Ingredient.get_collection()
+    if collection is None or not ingredient_ids:
+        return {}
+    
+    return {
+        data['_id']: data for data in collection.find(
+            {'_id': {'$in': ingredient_ids}},
+            {'name': 1, 'category': 1}
+        )
+    }
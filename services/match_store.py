@@ -0,0 +1,568 @@
+import heapq
+import logging
+from collections import defaultdict
+from datetime import datetime
+from pymongo import ASCENDING, ReplaceOne
+from models.database import get_database
+from models.user import User, PROFILE_FIELDS
+from models.ingredient import Ingredient
+from models.events import (
+    subscribe, OFFER_ADDED, OFFER_REMOVED, REQUEST_ADDED, REQUEST_REMOVED,
+    LOCATION_CHANGED, INGREDIENT_ADDED, INGREDIENT_REMOVED
+)
+from services.matching import find_nearby_offerers, find_nearby_requesters
+from services.ranking import rank_key, top_k
+from utils.tracing import traced
+from utils.cache import get_cache, kind_namespace
+from config import MATCH_RANK_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# Match directions, seen from the user the row belongs to
+OFFER = 'offer'  # The user offers the ingredient and the neighbor requested it
+REQUEST = 'request'  # The user requested the ingredient and the neighbor offers it
+
+def get_collection():
+    """Get the matches collection from MongoDB."""
+    db = get_database()
+    return db.matches if db is not None else None
+
+def ensure_indexes():
+    """Create the indexes used to read and maintain match rows."""
+    collection = get_collection()
+    if collection is None:
+        return
+    
+    try:
+        collection.create_index([
+            ('user_id', ASCENDING), ('direction', ASCENDING),
+            ('distance', ASCENDING), ('_id', ASCENDING)
+        ])
+        collection.create_index([('user_id', ASCENDING), ('ingredient', ASCENDING)])
+        collection.create_index([('user_id', ASCENDING), ('neighbor_id', ASCENDING), ('direction', ASCENDING)])
+        collection.create_index([('neighbor_id', ASCENDING), ('ingredient', ASCENDING)])
+        # Rows of expired offers and requests go away even before the sweeper refreshes them
+        collection.create_index('expires_at', expireAfterSeconds=0)
+    except Exception as e:
+        logger.error(f"Error creating match indexes: {e}")
+
+def ensure_built():
+    """Create the indexes and fill the match table if it has never been built."""
+    ensure_indexes()
+    
+    collection = get_collection()
+    if collection is None:
+        return
+    
+    try:
+        if collection.estimated_document_count() == 0:
+            logger.info("Match table is empty, building it from current offers and requests")
+            rebuild()
+    except Exception as e:
+        logger.error(f"Error checking match table: {e}")
+
+def rebuild():
+    """
+    Recompute every match row from scratch.
+    
+    Every match pairs an offer with a request, so refreshing all offers
+    also creates the rows of the requesting side.
+    """
+    users = User.get_collection()
+    collection = get_collection()
+    if users is None or collection is None:
+        return
+    
+    try:
+        collection.delete_many({})
+        for user_data in users.find({'location': {'$ne': None}, 'offers.0': {'$exists': True}}, {**PROFILE_FIELDS, 'offers': 1}):
+            user = User(user_data)
+            for name in _offered_names(user):
+                refresh_offer(user, name)
+    except Exception as e:
+        logger.error(f"Error rebuilding match table: {e}")
+
+def data_version(user_id):
+    """
+    Get the current data version of a user.
+    
+    The version changes whenever the user's match rows or pantry change,
+    so results computed from an older version are out of date. Versions
+    live in the cache, so every replica sees the same ones.
+    """
+    cache = get_cache()
+    return (cache.version(kind_namespace('matches')), cache.version(f"matches:{user_id}"))
+
+def bump_data_versions(user_ids):
+    """Mark the matches of the given users as changed."""
+    get_cache().bump(*(f"matches:{user_id}" for user_id in user_ids))
+
+@traced
+def get_matches(user_id):
+    """
+    Read all stored matches of a user.
+    
+    Parameters:
+    - user_id: Internal user ID
+    
+    Returns:
+    - Tuple of (offer matches, request matches), each ranked best first
+    """
+    rows = _read_rows(user_id)
+    reciprocal = _reciprocal_neighbors(rows)
+    return tuple(
+        top_k(_to_match(row, reciprocal) for row in rows if row['direction'] == direction)
+        for direction in (OFFER, REQUEST)
+    )
+
+@traced
+def get_matches_page(user_id, direction, after=None, limit=5):
+    """
+    Read one page of a user's matches in one direction, best ranked first.
+    
+    Matches are read closest first in windows of MATCH_RANK_WINDOW rows,
+    each a bounded range scan on the (user_id, direction, distance, _id)
+    index, and ranked within their window. Score falls with distance, so
+    the best matches are almost always among the closest; a page only
+    reads the next window once the current one runs out. Reciprocity is
+    looked up for the neighbors of the window only.
+    
+    Cursors carry the time the first page was ranked at, so later pages
+    are ranked the same way even though freshness keeps decaying, and
+    where in which window the previous page ended.
+    
+    Parameters:
+    - user_id: Internal user ID
+    - direction: OFFER or REQUEST
+    - after: Cursor returned for the previous page, or None for the first page
+    - limit: Page size
+    
+    Returns:
+    - Tuple of (matches, cursor of the next page or None)
+    """
+    ranked_at = datetime.fromtimestamp(after[0]) if after else datetime.now()
+    # Where the current window starts, and the key of the last match shown from it
+    window_after = tuple(after[1:3]) if after and after[1] is not None else None
+    shown_after = tuple(after[3:]) if after and after[3] is not None else None
+    
+    page = []
+    while True:
+        rows = _read_window(user_id, direction, window_after, MATCH_RANK_WINDOW + 1)
+        more_windows = len(rows) > MATCH_RANK_WINDOW
+        rows = rows[:MATCH_RANK_WINDOW]
+        reciprocal = _reciprocal_neighbors_of(user_id, direction, rows)
+        
+        candidates = []
+        for row in rows:
+            match = _to_match(row, reciprocal)
+            key = (*rank_key(match, ranked_at), row['_id'])
+            if shown_after is None or key > shown_after:
+                candidates.append((key, match, window_after))
+        page.extend(heapq.nsmallest(limit + 1 - len(page), candidates, key=lambda candidate: candidate[0]))
+        
+        if len(page) > limit or not more_windows:
+            break
+        window_after = (rows[-1]['distance'], rows[-1]['_id'])
+        shown_after = None
+    
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        key, _, window = page[-1]
+        next_cursor = (ranked_at.timestamp(), *(window or (None, None)), *key)
+    
+    return [match for _, match, _ in page], next_cursor
+
+@traced
+def get_swaps(user_id, limit=None):
+    """
+    Find the neighbors a user can swap with: the user offers something the
+    neighbor requested, and the neighbor offers something the user requested.
+    
+    Built on the match rows, so it's one aggregation over the user's rows
+    on the user_id index, however many users there are.
+    
+    Parameters:
+    - user_id: Internal user ID
+    - limit: Number of best ranked swaps to return, None for all of them
+    
+    Returns:
+    - List of swaps, best ranked first
+    """
+    return top_k((swap for _, swap in _aggregate_swaps({'user_id': user_id})), limit)
+
+def iter_swaps(query=None):
+    """
+    Find the swaps of every user in one pass over the match table.
+    
+    Parameters:
+    - query: Optional filter on the match rows, e.g. on user_id
+    
+    Returns:
+    - Iterator of (user ID, swap), every pair appearing once for each side
+    """
+    return _aggregate_swaps(query or {})
+
+def _aggregate_swaps(query):
+    """Group match rows by user and neighbor, keeping the pairs that match both ways."""
+    collection = get_collection()
+    if collection is None:
+        return
+    
+    pipeline = [
+        {'$match': query},
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'neighbor_id': '$neighbor_id', 'direction': '$direction'},
+            'ingredients': {'$addToSet': '$ingredient'},
+            'neighbor_name': {'$first': '$neighbor_name'},
+            'neighbor_telegram_id': {'$first': '$neighbor_telegram_id'},
+            'distance': {'$min': '$distance'},
+            'listed_at': {'$max': '$listed_at'}
+        }},
+        {'$group': {
+            '_id': {'user_id': '$_id.user_id', 'neighbor_id': '$_id.neighbor_id'},
+            'sides': {'$push': {'direction': '$_id.direction', 'ingredients': '$ingredients'}},
+            'neighbor_name': {'$first': '$neighbor_name'},
+            'neighbor_telegram_id': {'$first': '$neighbor_telegram_id'},
+            'distance': {'$min': '$distance'},
+            'listed_at': {'$max': '$listed_at'}
+        }},
+        # A pair has rows in both directions exactly when it's a swap
+        {'$match': {'sides.1': {'$exists': True}}}
+    ]
+    
+    try:
+        for group in collection.aggregate(pipeline, allowDiskUse=True):
+            sides = {side['direction']: sorted(side['ingredients']) for side in group['sides']}
+            yield group['_id']['user_id'], {
+                'user': User({
+                    '_id': group['_id']['neighbor_id'],
+                    'name': group['neighbor_name'],
+                    'telegram_id': group['neighbor_telegram_id']
+                }),
+                'distance': group['distance'],
+                'gives': sides[OFFER],
+                'gets': sides[REQUEST],
+                'match_type': 'swap',
+                'listed_at': group['listed_at'],
+                'reciprocal': True
+            }
+    except Exception as e:
+        logger.error(f"Error finding swaps: {e}")
+
+@traced
+def count_matches(user_id, direction):
+    """Count a user's matches in one direction."""
+    collection = get_collection()
+    if collection is None:
+        return 0
+    
+    try:
+        return collection.count_documents({'user_id': user_id, 'direction': direction})
+    except Exception as e:
+        logger.error(f"Error counting matches: {e}")
+        return 0
+
+@traced
+def get_ingredient_matches(user_id, ingredient, direction):
+    """
+    Read the stored matches of a user for one ingredient.
+    
+    Parameters:
+    - user_id: Internal user ID
+    - ingredient: Ingredient name
+    - direction: OFFER or REQUEST
+    
+    Returns:
+    - List of matches sorted by distance
+    """
+    collection = get_collection()
+    if collection is None:
+        return []
+    
+    try:
+        rows = collection.find({
+            'user_id': user_id,
+            'ingredient': ingredient.lower(),
+            'direction': direction
+        }).sort([('distance', ASCENDING), ('_id', ASCENDING)])
+        return [_to_match(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Error reading ingredient matches: {e}")
+        return []
+
+@traced
+def refresh_offer(user, name):
+    """
+    Recompute the match rows of one ingredient a user offers.
+    
+    Parameters:
+    - user: User object
+    - name: Ingredient name
+    """
+    name = name.lower()
+    neighbors = []
+    offers = _offers_by_name(user).get(name, [])
+    
+    if user.location and offers:
+        neighbors = find_nearby_requesters(user, name)
+    
+    rows = []
+    for neighbor, distance in neighbors:
+        expires_at = _earliest(_latest(offers), _latest(neighbor.requests))
+        listed_at = _newest(offers + neighbor.requests)
+        rows.append(_row(user, neighbor, name, OFFER, distance, expires_at, listed_at))
+        rows.append(_row(neighbor, user, name, REQUEST, distance, expires_at, listed_at))
+    
+    _replace_rows([
+        {'user_id': user.id, 'ingredient': name, 'direction': OFFER},
+        {'neighbor_id': user.id, 'ingredient': name, 'direction': REQUEST}
+    ], rows)
+
+@traced
+def refresh_request(user, name):
+    """
+    Recompute the match rows of one ingredient a user requested.
+    
+    Parameters:
+    - user: User object
+    - name: Ingredient name
+    """
+    name = name.lower()
+    neighbors = []
+    requests = [request for request in user.active_requests() if request['ingredient'].lower() == name]
+    
+    if user.location and requests:
+        neighbors = find_nearby_offerers(user, name)
+    
+    rows = []
+    for neighbor, distance in neighbors:
+        expires_at = _earliest(_latest(requests), _latest(neighbor.offers))
+        listed_at = _newest(requests + neighbor.offers)
+        rows.append(_row(user, neighbor, name, REQUEST, distance, expires_at, listed_at))
+        rows.append(_row(neighbor, user, name, OFFER, distance, expires_at, listed_at))
+    
+    _replace_rows([
+        {'user_id': user.id, 'ingredient': name, 'direction': REQUEST},
+        {'neighbor_id': user.id, 'ingredient': name, 'direction': OFFER}
+    ], rows)
+
+@traced
+def refresh_user(user):
+    """Recompute all match rows a user takes part in."""
+    collection = get_collection()
+    if collection is None:
+        return
+    
+    touched = {user.id} | set(collection.distinct('user_id', {'neighbor_id': user.id}))
+    offered = list(_offered_names(user))
+    requested = list({request['ingredient'].lower() for request in user.active_requests()})
+    
+    for name in offered:
+        refresh_offer(user, name)
+    for name in requested:
+        refresh_request(user, name)
+    # Rows of ingredients the user no longer lists go last, a refresh cut short leaves old rows rather than none
+    collection.delete_many({'user_id': user.id, '$or': [
+        {'direction': OFFER, 'ingredient': {'$nin': offered}},
+        {'direction': REQUEST, 'ingredient': {'$nin': requested}}
+    ]})
+    collection.delete_many({'neighbor_id': user.id, '$or': [
+        {'direction': REQUEST, 'ingredient': {'$nin': offered}},
+        {'direction': OFFER, 'ingredient': {'$nin': requested}}
+    ]})
+    # Only once the rows are written, a session computed before then would be cached as current
+    bump_data_versions(touched)
+
+def _replace_rows(delete_filters, rows):
+    """Write the new rows and delete the other rows matching the filters."""
+    collection = get_collection()
+    if collection is None:
+        return
+    
+    # Both sides of every removed or added row see different matches now
+    touched = {row['user_id'] for row in rows}
+    for row_filter in delete_filters:
+        touched.update(collection.distinct('user_id', row_filter))
+    
+    if rows:
+        collection.bulk_write(
+            [ReplaceOne({'_id': row['_id']}, row, upsert=True) for row in rows],
+            ordered=False
+        )
+    # Old rows go once the new ones are written, a refresh cut short leaves old rows rather than none
+    row_ids = [row['_id'] for row in rows]
+    for row_filter in delete_filters:
+        collection.delete_many({**row_filter, '_id': {'$nin': row_ids}})
+    # Only once the rows are written, a session computed before then would be cached as current
+    bump_data_versions(touched)
+
+def _read_rows(user_id):
+    """Read all match rows of a user."""
+    collection = get_collection()
+    if collection is None:
+        return []
+    
+    try:
+        return list(collection.find({'user_id': user_id}))
+    except Exception as e:
+        logger.error(f"Error reading matches: {e}")
+        return []
+
+def _read_window(user_id, direction, after, limit):
+    """Read a user's match rows in one direction closest first, after a (distance, row id) position."""
+    collection = get_collection()
+    if collection is None:
+        return []
+    
+    query = {'user_id': user_id, 'direction': direction}
+    if after:
+        distance, row_id = after
+        query['$or'] = [
+            {'distance': {'$gt': distance}},
+            {'distance': distance, '_id': {'$gt': row_id}}
+        ]
+    
+    try:
+        return list(
+            collection.find(query)
+            .sort([('distance', ASCENDING), ('_id', ASCENDING)])
+            .limit(limit)
+        )
+    except Exception as e:
+        logger.error(f"Error reading matches page: {e}")
+        return []
+
+def _reciprocal_neighbors(rows):
+    """Get the neighbors a user matches in both directions."""
+    neighbors = {OFFER: set(), REQUEST: set()}
+    for row in rows:
+        neighbors[row['direction']].add(row['neighbor_id'])
+    return neighbors[OFFER] & neighbors[REQUEST]
+
+def _reciprocal_neighbors_of(user_id, direction, rows):
+    """Get which neighbors of some of a user's rows in one direction also match the user the other way."""
+    collection = get_collection()
+    neighbor_ids = list({row['neighbor_id'] for row in rows})
+    if collection is None or not neighbor_ids:
+        return set()
+    
+    try:
+        return set(collection.distinct('neighbor_id', {
+            'user_id': user_id,
+            'neighbor_id': {'$in': neighbor_ids},
+            'direction': REQUEST if direction == OFFER else OFFER
+        }))
+    except Exception as e:
+        logger.error(f"Error reading reciprocal matches: {e}")
+        return set()
+
+def _row(user, neighbor, ingredient, direction, distance, expires_at=None, listed_at=None):
+    """Build the match row of user for a neighbor, expiring with its offer or request."""
+    return {
+        '_id': f"{user.id}:{neighbor.id}:{direction}:{ingredient}",
+        'user_id': user.id,
+        'neighbor_id': neighbor.id,
+        'neighbor_name': neighbor.name,
+        'neighbor_telegram_id': neighbor.telegram_id,
+        'ingredient': ingredient,
+        'direction': direction,
+        'distance': distance,
+        'created_at': datetime.now(),
+        'listed_at': listed_at,
+        'expires_at': expires_at
+    }
+
+def _to_match(row, reciprocal=()):
+    """Turn a match row into the match format used by the handlers."""
+    neighbor = User({
+        '_id': row['neighbor_id'],
+        'name': row['neighbor_name'],
+        'telegram_id': row['neighbor_telegram_id']
+    })
+    return {
+        'user': neighbor,
+        'distance': row['distance'],
+        'ingredient': row['ingredient'],
+        'match_type': row['direction'],
+        'listed_at': row.get('listed_at'),
+        'reciprocal': row['neighbor_id'] in reciprocal
+    }
+
+def _offered_names(user):
+    """Get the names of the ingredients a user currently offers."""
+    return set(_offers_by_name(user))
+
+def _offers_by_name(user):
+    """Get the active offers of a user, by ingredient name."""
+    offers = defaultdict(list)
+    for offer in user.active_offers():
+        offers[offer.get('ingredient_id')].append(offer)
+    if not offers:
+        return {}
+    
+    collection = Ingredient.get_collection()
+    if collection is None:
+        return {}
+    
+    return {
+        data['name']: offers[data['_id']] for data in collection.find(
+            {'_id': {'$in': list(offers)}, 'user_id': user.id},
+            {'name': 1}
+        )
+    }
+
+def _latest(entries):
+    """Get when the last of several offers or requests expires, None if one never does."""
+    expiries = [entry.get('expires_at') for entry in entries]
+    if not expiries or None in expiries:
+        return None
+    return max(expiries)
+
+def _newest(entries):
+    """Get when the most recent of several offers or requests was listed, None if none says."""
+    listed = [entry['created_at'] for entry in entries if entry.get('created_at')]
+    return max(listed) if listed else None
+
+def _earliest(*expiries):
+    """Get the earliest of several expiries, where None means never."""
+    expiries = [expires_at for expires_at in expiries if expires_at is not None]
+    return min(expiries) if expiries else None
+
+def _on_offer_changed(user_id, ingredient_id):
+    """Refresh the rows of an offer that was added or removed."""
+    user = User.find_by_id(user_id)
+    ingredient = Ingredient.find_by_id(ingredient_id)
+    if user and ingredient:
+        refresh_offer(user, ingredient.name)
+
+def _on_request_changed(user_id, ingredient):
+    """Refresh the rows of a request that was added or removed."""
+    user = User.find_by_id(user_id)
+    if user:
+        refresh_request(user, ingredient)
+
+def _on_location_changed(user_id, location):
+    """Recompute every row of a user who moved."""
+    user = User.find_by_id(user_id)
+    if user:
+        refresh_user(user)
+
+def _on_ingredient_added(user_id, ingredient_id, name):
+    """A new pantry item can change the user's recipe suggestions."""
+    bump_data_versions([user_id])
+
+def _on_ingredient_removed(user_id, ingredient_id, name):
+    """Drop the offer rows of an ingredient that left the pantry."""
+    bump_data_versions([user_id])
+    user = User.find_by_id(user_id)
+    if user:
+        refresh_offer(user, name)
+
+subscribe(OFFER_ADDED, _on_offer_changed)
+subscribe(OFFER_REMOVED, _on_offer_changed)
+subscribe(REQUEST_ADDED, _on_request_changed)
+subscribe(REQUEST_REMOVED, _on_request_changed)
+subscribe(LOCATION_CHANGED, _on_location_changed)
+subscribe(INGREDIENT_ADDED, _on_ingredient_added)
+subscribe(INGREDIENT_REMOVED, _on_ingredient_removed)
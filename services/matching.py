@@ -1,13 +1,20 @@
+import heapq
 import logging
-from models.user import User
+from datetime import datetime
+from models.user import User, utcnow, not_expired, PROFILE_FIELDS
 from models.ingredient import Ingredient
 from services.recipe_service import get_recipe_by_ingredients
-from utils.distance import calculate_distance
+from services.ranking import rank_key, top_k
+from services.availability import available_near, OFFERED, REQUESTED
+from utils.distance import calculate_distance, get_nearby_coordinates
+from utils.tracing import traced
+from utils.deadline import expired
 from config import MAX_DISTANCE_KM
 
 logger = logging.getLogger(__name__)
 
-def find_nearby_users(user, ingredient=None, name=None):
+@traced
+def find_nearby_users(user, ingredient=None, name=None, limit=None):
     """
     Find nearby users who either:
     1. Have requested an ingredient that the user is offering
@@ -17,22 +24,30 @@ def find_nearby_users(user, ingredient=None, name=None):
     - user: User object
     - ingredient: Ingredient object (optional)
     - name: String, ingredient name (optional)
+    - limit: Number of best ranked users to return, None for all of them
     
     Returns:
-    - List of dictionaries with user and distance
+    - List of dictionaries with user and distance, best ranked first
     """
     if not user.location:
         return []
     
     # Get all users with location
     collection = User.get_collection()
-    if not collection:
+    if collection is None:
         return []
     
+    # Only the list a match is looked for in is read, searches for recipe partners need neither
+    fields = dict(PROFILE_FIELDS)
+    if ingredient:
+        fields['requests'] = 1
+    elif name:
+        fields['offers'] = 1
+    
     all_users = collection.find({
         '_id': {'$ne': user.id},
         'location': {'$exists': True}
-    })
+    }, fields)
     
     matches = []
     
@@ -51,13 +66,14 @@ def find_nearby_users(user, ingredient=None, name=None):
         
         # Case 1: User is offering an ingredient, check if other user has requested it
         if ingredient:
-            for request in other_user.requests:
+            for request in other_user.active_requests():
                 if request['ingredient'].lower() == ingredient.name.lower():
                     matches.append({
                         'user': other_user,
                         'distance': distance,
                         'ingredient': ingredient.name,
-                        'match_type': 'offer'
+                        'match_type': 'offer',
+                        'listed_at': request.get('created_at')
                     })
                     break
         
@@ -68,13 +84,14 @@ def find_nearby_users(user, ingredient=None, name=None):
             for ing in other_user_ingredients:
                 if ing.name.lower() == name.lower():
                     # Check if it's being offered
-                    for offer in other_user.offers:
+                    for offer in other_user.active_offers():
                         if offer.get('ingredient_id') == ing.id:
                             matches.append({
                                 'user': other_user,
                                 'distance': distance,
                                 'ingredient': name,
-                                'match_type': 'request'
+                                'match_type': 'request',
+                                'listed_at': offer.get('created_at')
                             })
                             break
         
@@ -85,21 +102,26 @@ def find_nearby_users(user, ingredient=None, name=None):
                 'distance': distance
             })
     
-    # Sort by distance
-    matches.sort(key=lambda x: x['distance'])
-    return matches
+    return top_k(matches, limit)
 
-def find_matching_recipes(user, nearby_users):
+@traced
+def find_matching_recipes(user, nearby_users, limit=None):
     """
     Find recipes that can be made by combining the user's ingredients
     with those of nearby users.
     
+    Recipes are ranked by how much of them the two pantries cover, and by
+    the distance, freshness and reciprocity of the neighbor's match. Once
+    the current time budget runs out no more neighbors are tried, and the
+    recipes found so far are returned.
+    
     Parameters:
     - user: User object
     - nearby_users: List of nearby user matches
+    - limit: Number of best ranked recipes to return, None for all of them
     
     Returns:
-    - List of recipe matches
+    - List of recipe matches, best ranked first
     """
     if not nearby_users:
         return []
@@ -111,7 +133,10 @@ def find_matching_recipes(user, nearby_users):
     user_ingredient_names = [ing.name for ing in user_ingredients]
     
     # For each nearby user, check if their ingredients + user's ingredients make complete recipes
-    for nearby in nearby_users:
+    for checked, nearby in enumerate(nearby_users):
+        if expired():
+            logger.info(f"Recipe lookup ran out of time after {checked} of {len(nearby_users)} neighbors")
+            break
         other_user = nearby['user']
         
         # Get other user's ingredients
@@ -129,7 +154,9 @@ def find_matching_recipes(user, nearby_users):
                 recipe_match = {
                     'user': other_user,
                     'recipe': recipe,
-                    'distance': nearby['distance']
+                    'distance': nearby['distance'],
+                    'listed_at': nearby.get('listed_at'),
+                    'reciprocal': nearby.get('reciprocal', False)
                 }
                 
                 # Determine which ingredients are missing
@@ -144,18 +171,141 @@ def find_matching_recipes(user, nearby_users):
                 if missing:
                     recipe_match['missing_ingredients'] = missing
                 
+                required_count = len(recipe.get('usedIngredients', [])) + len(required_ingredients)
+                if required_count:
+                    recipe_match['completeness'] = 1 - len(missing) / required_count
+                
                 recipe_matches.append(recipe_match)
     
-    # Remove duplicates and sort by least missing ingredients
+    # Keep the best ranked neighbor of every recipe
+    now = datetime.now()
     unique_recipes = {}
     for match in recipe_matches:
         recipe_id = match['recipe'].get('id')
-        missing_count = len(match.get('missing_ingredients', []))
-        
-        if recipe_id not in unique_recipes or missing_count < len(unique_recipes[recipe_id].get('missing_ingredients', [])):
+        if recipe_id not in unique_recipes or rank_key(match, now) < rank_key(unique_recipes[recipe_id], now):
             unique_recipes[recipe_id] = match
     
-    result = list(unique_recipes.values())
-    result.sort(key=lambda x: len(x.get('missing_ingredients', [])))
+    return top_k(unique_recipes.values(), limit, now)
+
+def _nearby_query(user):
+    """Build a query for other users inside the bounding box around a user."""
+    box = get_nearby_coordinates(user.location['latitude'], user.location['longitude'], MAX_DISTANCE_KM)
+    return {
+        '_id': {'$ne': user.id},
+        'location.latitude': {'$gte': box['min_lat'], '$lte': box['max_lat']},
+        'location.longitude': {'$gte': box['min_lon'], '$lte': box['max_lon']}
+    }
+
+def _within_distance(user, candidates):
+    """Keep the candidates within MAX_DISTANCE_KM of a user, with their distance."""
+    result = []
+    for user_data in candidates:
+        other_user = User(user_data)
+        distance = calculate_distance(
+            user.location['latitude'], user.location['longitude'],
+            other_user.location['latitude'], other_user.location['longitude']
+        )
+        if distance <= MAX_DISTANCE_KM:
+            result.append((other_user, distance))
+    return result
+
+@traced
+def find_nearby_requesters(user, name):
+    """
+    Find nearby users who requested an ingredient, using the user indexes.
+    
+    Parameters:
+    - user: User object with a location
+    - name: Ingredient name
+    
+    Returns:
+    - List of (User, distance) tuples, in no particular order. Each user's
+      requests hold only the matching request.
+    """
+    collection = User.get_collection()
+    if collection is None or not available_near(user.location, name, REQUESTED):
+        return []
+    
+    # Only live requests match, and only the matching one is read back
+    wanted = {'$elemMatch': {'ingredient': name.lower(), 'expires_at': not_expired(utcnow())}}
+    query = _nearby_query(user)
+    query['requests'] = wanted
+    return _within_distance(user, collection.find(query, {**PROFILE_FIELDS, 'requests': wanted}))
+
+@traced
+def find_nearby_offerers(user, name):
+    """
+    Find nearby users who offer an ingredient, using the user and ingredient indexes.
+    
+    Parameters:
+    - user: User object with a location
+    - name: Ingredient name
+    
+    Returns:
+    - List of (User, distance) tuples, in no particular order. Each user's
+      offers hold only the matching offer.
+    """
+    ingredients = Ingredient.get_collection()
+    collection = User.get_collection()
+    if ingredients is None or collection is None or not available_near(user.location, name, OFFERED):
+        return []
+    
+    ingredient_ids = [
+        data['_id'] for data in ingredients.find(
+            {'name': name.lower(), 'user_id': {'$ne': user.id}},
+            {'_id': 1}
+        )
+    ]
+    if not ingredient_ids:
+        return []
+    
+    # Only live offers match, and only the matching one is read back
+    offered = {'$elemMatch': {'ingredient_id': {'$in': ingredient_ids}, 'expires_at': not_expired(utcnow())}}
+    query = _nearby_query(user)
+    query['offers'] = offered
+    return _within_distance(user, collection.find(query, {**PROFILE_FIELDS, 'offers': offered}))
+
+@traced
+def find_offerers_page(user, name, after=None, limit=8):
+    """
+    Find one page of nearby users offering an ingredient, best ranked first.
+    
+    Only the requested page is selected, with a bounded heap instead of
+    sorting every nearby offer. Cursors carry the time the first page was
+    ranked at, so later pages are ranked the same way.
+    
+    Parameters:
+    - user: User object with a location
+    - name: Ingredient name
+    - after: Cursor returned for the previous page, or None for the first page
+    - limit: Page size
+    
+    Returns:
+    - Tuple of (matches, cursor of the next page or None, total number of offers)
+    """
+    offerers = find_nearby_offerers(user, name)
+    total = len(offerers)
+    ranked_at = datetime.fromtimestamp(after[0]) if after else datetime.now()
+    
+    candidates = []
+    for other_user, distance in offerers:
+        match = {
+            'user': other_user,
+            'distance': distance,
+            'ingredient': name,
+            'match_type': 'request',
+            'listed_at': max((offer['created_at'] for offer in other_user.offers if offer.get('created_at')), default=None)
+        }
+        key = (*rank_key(match, ranked_at), other_user.id)
+        if after and key <= tuple(after[1:]):
+            continue
+        candidates.append((key, match))
+    
+    page = heapq.nsmallest(limit + 1, candidates, key=lambda candidate: candidate[0])
+    
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = (ranked_at.timestamp(), *page[-1][0])
     
-    return result
\ No newline at end of file
+    return [match for _, match in page], next_cursor, total
\ No newline at end of file
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter, BadRequest, Forbidden, NetworkError, TelegramError
+from config import (
+    NOTIFY_MESSAGES_PER_SECOND, NOTIFY_PER_CHAT_INTERVAL_SECONDS,
+    NOTIFY_MAX_RETRIES, NOTIFY_MAX_PENDING_CHATS, NOTIFY_MAX_IN_FLIGHT
+)
+from utils.metrics import NOTIFICATIONS_SENT, NOTIFICATIONS_FAILED
+
+logger = logging.getLogger(__name__)
+
+class NotificationDispatcher:
+    """
+    Queue-backed sender for messages the bot pushes to users.
+    
+    Handlers call notify(), which only records the message and returns at once.
+    A background worker sends the queued messages while respecting Telegram's
+    global and per-chat rate limits. Messages waiting for the same chat are
+    combined into as few messages as possible, and flood-wait responses pause
+    the dispatcher before the messages are retried.
+    """
+    
+    def __init__(self, bot, messages_per_second=NOTIFY_MESSAGES_PER_SECOND,
+                 per_chat_interval=NOTIFY_PER_CHAT_INTERVAL_SECONDS,
+                 max_retries=NOTIFY_MAX_RETRIES, max_pending_chats=NOTIFY_MAX_PENDING_CHATS,
+                 max_in_flight=NOTIFY_MAX_IN_FLIGHT):
+        """Initialize the dispatcher."""
+        self.bot = bot
+        self.send_interval = 1.0 / messages_per_second
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.max_pending_chats = max_pending_chats
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._queue = asyncio.Queue()
+        self._pending = {}  # chat_id -> list of message texts waiting to be sent
+        self._attempts = {}  # chat_id -> failed attempts for the current batch
+        self._last_sent = {}  # chat_id -> time of the last message sent to the chat
+        self._next_send_at = 0.0
+        self._paused_until = 0.0
+        self._worker = None
+        self._tasks = set()
+    
+    def notify(self, chat_id, text):
+        """Queue a message for a chat without waiting for it to be sent."""
+        if chat_id in self._pending:
+            # Coalesce with messages already waiting for this chat
+            self._pending[chat_id].append(text)
+            return True
+        
+        if len(self._pending) >= self.max_pending_chats:
+            logger.warning(f"Notification queue full, dropping message for chat {chat_id}")
+            NOTIFICATIONS_FAILED.inc(reason='queue_full')
+            return False
+        
+        self._pending[chat_id] = [text]
+        self._schedule(chat_id)
+        return True
+    
+    async def start(self):
+        """Start the background worker."""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background worker, dropping unsent messages."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        
+        for task in list(self._tasks):
+            task.cancel()
+        
+        if self._pending:
+            logger.info(f"Dropped notifications for {len(self._pending)} chats on shutdown")
+            self._pending.clear()
+    
+    def _schedule(self, chat_id, delay=0.0):
+        """Put a chat on the send queue, optionally after a delay."""
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, chat_id)
+        else:
+            self._queue.put_nowait(chat_id)
+    
+    async def _run(self):
+        """Take chats off the queue and send their messages within the rate limits."""
+        while True:
+            chat_id = await self._queue.get()
+            if chat_id not in self._pending:
+                continue
+            
+            now = time.monotonic()
+            
+            # Keep a minimum interval between messages to the same chat
+            wait = self._last_sent.get(chat_id, 0.0) + self.per_chat_interval - now
+            if wait > 0:
+                self._schedule(chat_id, wait)
+                continue
+            
+            # Spread messages evenly to stay below the global limit
+            wait = max(self._next_send_at, self._paused_until) - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+            
+            await self._in_flight.acquire()
+            
+            texts = self._pending.pop(chat_id, None)
+            if not texts:
+                self._in_flight.release()
+                continue
+            
+            batch, rest = self._take_batch(texts)
+            if rest:
+                self._requeue(chat_id, rest, self.per_chat_interval)
+            
+            now = time.monotonic()
+            self._next_send_at = now + self.send_interval
+            self._last_sent[chat_id] = now
+            if len(self._last_sent) > self.max_pending_chats:
+                self._forget_idle_chats(now)
+            
+            task = asyncio.create_task(self._send(chat_id, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    def _forget_idle_chats(self, now):
+        """Drop send times that no longer limit anything."""
+        cutoff = now - self.per_chat_interval
+        self._last_sent = {
+            chat_id: sent_at for chat_id, sent_at in self._last_sent.items() if sent_at > cutoff
+        }
+    
+    @staticmethod
+    def _take_batch(texts):
+        """Combine as many queued texts as fit into one message."""
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        batch = texts[0][:limit]
+        count = 1
+        
+        for text in texts[1:]:
+            if len(batch) + 2 + len(text) > limit:
+                break
+            batch += "\n\n" + text
+            count += 1
+        
+        return batch, texts[count:]
+    
+    def _requeue(self, chat_id, texts, delay):
+        """Put texts back in front of any newer messages for the chat."""
+        if chat_id in self._pending:
+            self._pending[chat_id] = texts + self._pending[chat_id]
+        else:
+            self._pending[chat_id] = texts
+            self._schedule(chat_id, delay)
+    
+    async def _send(self, chat_id, text):
+        """Send one combined message, retrying on flood-wait and network errors."""
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text)
+            self._attempts.pop(chat_id, None)
+            NOTIFICATIONS_SENT.inc()
+        except RetryAfter as e:
+            NOTIFICATIONS_FAILED.inc(reason='flood_control')
+            delay = e.retry_after
+            if hasattr(delay, 'total_seconds'):
+                delay = delay.total_seconds()
+            
+            # Flood control applies to the whole bot, so pause all sending
+            logger.warning(f"Flood control hit, pausing notifications for {delay} seconds")
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._retry(chat_id, text, delay)
+        except BadRequest as e:
+            NOTIFICATIONS_FAILED.inc(reason='bad_request')
+            logger.error(f"Notification for chat {chat_id} rejected: {e}")
+            self._attempts.pop(chat_id, None)
+        except NetworkError as e:
+            NOTIFICATIONS_FAILED.inc(reason='network')
+            logger.warning(f"Network error sending notification to chat {chat_id}: {e}")
+            self._retry(chat_id, text, 2 ** self._attempts.get(chat_id, 0))
+        except TelegramError as e:
+            # The user blocked the bot, the chat is gone, etc. Retrying won't help
+            NOTIFICATIONS_FAILED.inc(reason='forbidden' if isinstance(e, Forbidden) else 'other')
+            logger.error(f"Error sending notification to chat {chat_id}: {e}")
+            self._attempts.pop(chat_id, None)
+        finally:
+            self._in_flight.release()
+    
+    def _retry(self, chat_id, text, delay):
+        """Queue a failed message again unless it has run out of attempts."""
+        attempts = self._attempts.get(chat_id, 0) + 1
+        if attempts > self.max_retries:
+            logger.error(f"Giving up on notification for chat {chat_id} after {self.max_retries} retries")
+            self._attempts.pop(chat_id, None)
+            return
+        
+        self._attempts[chat_id] = attempts
+        self._requeue(chat_id, [text], delay)
@@ -0,0 +1,165 @@
+import csv
+import logging
+import re
+from models.ingredient import Ingredient
+from config import MAX_INGREDIENTS_PER_USER
+
+logger = logging.getLogger(__name__)
+
+# Invalid lines quoted back to the user at most
+MAX_REPORTED_ERRORS = 5
+
+# Amounts like 500, 1.5, 1,5 or 1/2
+AMOUNT_PATTERN = re.compile(r'^\d+([.,/]\d+)?$')
+
+# Header row of a CSV export, skipped if present
+HEADER_NAMES = {'name', 'ingredient', 'ingredients', 'item'}
+
+def parse_pantry_line(line):
+    """
+    Parse one pantry line into an ingredient.
+    
+    Accepts "name amount [unit]" with a name of one or more words, like
+    "olive oil 1 l", and CSV rows "name,amount[,unit]" or "name;amount[;unit]".
+    A comma inside an amount, as in "flour 1,5 kg", is a decimal comma.
+    Rows with decimal commas in CSV need semicolons between the fields.
+    
+    >>> parse_pantry_line("flour 1,5 kg")
+    ('flour', '1,5', 'kg')
+    >>> parse_pantry_line("olive oil,1,l")
+    ('olive oil', '1', 'l')
+    >>> parse_pantry_line("flour;1,5;kg")
+    ('flour', '1,5', 'kg')
+    
+    Parameters:
+    - line: Text of the line
+    
+    Returns:
+    - Tuple of (name, amount, unit), or None if the line can't be read
+    """
+    words = line.split()
+    parsed = _parse_words(words)
+    
+    if (',' in line or ';' in line) and not (parsed and ',' in parsed[1]):
+        # Spreadsheets that write decimal commas separate fields with semicolons
+        fields = next(csv.reader([line], delimiter=';' if ';' in line else ','))
+        fields = [field.strip() for field in fields]
+        if len(fields) < 2 or not fields[0] or not fields[1]:
+            return None
+        return fields[0].lower(), fields[1], fields[2] if len(fields) > 2 else ""
+    
+    if parsed:
+        return parsed
+    if len(words) < 2:
+        return None
+    # No numeric amount, read it like a single-word /add
+    return words[0].lower(), words[1], " ".join(words[2:])
+
+def _parse_words(words):
+    """Read words as a name of one or more words followed by an amount and a unit, None without an amount."""
+    # The name is everything before the first amount
+    for index, word in enumerate(words[1:], start=1):
+        if AMOUNT_PATTERN.match(word):
+            return " ".join(words[:index]).lower(), word, " ".join(words[index + 1:])
+    return None
+
+def iter_pantry_lines(lines):
+    """
+    Parse pantry lines one at a time.
+    
+    Blank lines, comments starting with # and a CSV header row are skipped.
+    
+    Parameters:
+    - lines: Iterable of text lines, e.g. a file object
+    
+    Yields:
+    - Tuples of (line number, parsed ingredient or None, stripped line)
+    """
+    first = True
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if first:
+            first = False
+            if re.split(r'[,;\s]', line, maxsplit=1)[0].lower() in HEADER_NAMES:
+                continue
+        yield number, parse_pantry_line(line), line
+
+def import_pantry(user_id, lines):
+    """
+    Add the ingredients listed in lines to a user's pantry.
+    
+    Lines are read as a stream. New ingredients beyond MAX_INGREDIENTS_PER_USER
+    are skipped, ingredients already in the pantry or listed twice are
+    updated with the last amount given. Everything is written at once.
+    
+    Parameters:
+    - user_id: Internal user ID
+    - lines: Iterable of text lines
+    
+    Returns:
+    - Dictionary with 'added', 'updated', 'over_limit' counts, 'invalid' as a
+      list of (line number, line) and 'failed' if the write failed
+    """
+    pantry = Ingredient.find_names_by_user_id(user_id)
+    capacity = MAX_INGREDIENTS_PER_USER - len(pantry)
+    
+    items = {}  # name -> (name, amount, unit), in the order first listed
+    invalid = []
+    over_limit = 0
+    new_count = 0
+    
+    for number, parsed, line in iter_pantry_lines(lines):
+        if parsed is None:
+            invalid.append((number, line))
+            continue
+        
+        name = parsed[0]
+        if name not in items and name not in pantry:
+            if new_count >= capacity:
+                over_limit += 1
+                continue
+            new_count += 1
+        items[name] = parsed
+    
+    result = {'added': 0, 'updated': 0, 'over_limit': over_limit, 'invalid': invalid, 'failed': False}
+    written = Ingredient.add_many(user_id, list(items.values()))
+    if written is None:
+        result['failed'] = True
+    else:
+        result['added'], result['updated'] = written
+    return result
+
+def format_import_summary(result):
+    """Build the reply summarizing a pantry import."""
+    if result['failed']:
+        return "Failed to add ingredients. Please try again."
+    
+    if not result['added'] and not result['updated'] and not result['over_limit'] and not result['invalid']:
+        return "I couldn't find any ingredients in that."
+    
+    parts = []
+    if result['added'] or result['updated']:
+        message = f"✅ Added {result['added']} ingredient{'s' if result['added'] != 1 else ''} to your pantry"
+        if result['updated']:
+            message += f" and updated {result['updated']}"
+        parts.append(message + "!")
+    
+    if result['over_limit']:
+        parts.append(
+            f"⚠️ Skipped {result['over_limit']} new ingredient{'s' if result['over_limit'] != 1 else ''}: "
+            f"your pantry can hold at most {MAX_INGREDIENTS_PER_USER}. Use /remove to make room."
+        )
+    
+    if result['invalid']:
+        lines = "\n".join(f"Line {number}: {line[:50]}" for number, line in result['invalid'][:MAX_REPORTED_ERRORS])
+        more = len(result['invalid']) - MAX_REPORTED_ERRORS
+        if more > 0:
+            lines += f"\n...and {more} more"
+        parts.append(
+            f"⚠️ Couldn't read {len(result['invalid'])} line{'s' if len(result['invalid']) != 1 else ''} "
+            f"(expected: name amount unit):\n{lines}"
+        )
+    
+    return "\n\n".join(parts)
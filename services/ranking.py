@@ -0,0 +1,72 @@
+import heapq
+from datetime import datetime
+from config import (
+    MAX_DISTANCE_KM, RANK_WEIGHT_DISTANCE, RANK_WEIGHT_FRESHNESS, RANK_WEIGHT_RECIPROCITY,
+    RANK_WEIGHT_RECIPE, FRESHNESS_HALF_LIFE_HOURS
+)
+
+# Weight of each score component, all components are between 0 and 1
+DEFAULT_WEIGHTS = {
+    'distance': RANK_WEIGHT_DISTANCE,
+    'freshness': RANK_WEIGHT_FRESHNESS,
+    'reciprocity': RANK_WEIGHT_RECIPROCITY,
+    'recipe': RANK_WEIGHT_RECIPE
+}
+
+def score(match, now=None, weights=None):
+    """
+    Score a match, higher is better.
+    
+    Components a match doesn't carry count as 0, so neighbor matches and
+    recipe matches can be scored with the same weights.
+    
+    Parameters:
+    - match: Match dictionary with a 'distance', and optionally 'listed_at'
+      (when its offer or request was listed), 'reciprocal' (the neighbor
+      also matches the user the other way) and 'completeness' (share of a
+      recipe's ingredients the two pantries cover)
+    - now: Time freshness is measured at, the current time by default
+    - weights: Weight of each component, DEFAULT_WEIGHTS by default
+    
+    Returns:
+    - The weighted sum of the components
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    total = weights['distance'] * max(0.0, 1 - match.get('distance', MAX_DISTANCE_KM) / MAX_DISTANCE_KM)
+    
+    listed_at = match.get('listed_at')
+    if listed_at:
+        age_hours = max(0.0, ((now or datetime.now()) - listed_at).total_seconds() / 3600)
+        total += weights['freshness'] * 0.5 ** (age_hours / FRESHNESS_HALF_LIFE_HOURS)
+    
+    if match.get('reciprocal'):
+        total += weights['reciprocity']
+    
+    total += weights['recipe'] * match.get('completeness', 0)
+    return total
+
+def rank_key(match, now=None, weights=None):
+    """Sort key putting the best match first, closest first among equal scores."""
+    return (-round(score(match, now, weights), 9), match.get('distance', MAX_DISTANCE_KM))
+
+def top_k(matches, k=None, now=None, weights=None):
+    """
+    Select the best matches, best first.
+    
+    Uses a bounded heap, so selecting k of n matches costs O(n log k)
+    instead of sorting all of them.
+    
+    Parameters:
+    - matches: Iterable of match dictionaries
+    - k: Number of matches to keep, None for all of them
+    - now: Time freshness is measured at
+    - weights: Weight of each component
+    
+    Returns:
+    - List of at most k matches
+    """
+    now = now or datetime.now()
+    key = lambda match: rank_key(match, now, weights)
+    if k is None:
+        return sorted(matches, key=key)
+    return heapq.nsmallest(k, matches, key=key)
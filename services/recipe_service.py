@@ -1,9 +1,197 @@
+import hashlib
+import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from config import SPOONACULAR_API_KEY
+from config import (
+    SPOONACULAR_API_KEY, SPOONACULAR_BASE_URL, RECIPE_CACHE_TTL_SECONDS, RECIPE_STALE_TTL_SECONDS,
+    RECIPE_API_TIMEOUT_SECONDS, RECIPE_BREAKER_FAILURE_RATE, RECIPE_BREAKER_SLOW_SECONDS, RECIPE_BREAKER_WINDOW,
+    RECIPE_BREAKER_MIN_CALLS, RECIPE_BREAKER_OPEN_SECONDS
+)
+from utils.tracing import traced
+from utils.cache import get_cache
+from utils.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from utils.deadline import timeout_for, expired
+from utils.metrics import (
+    RECIPE_API_REQUESTS, RECIPE_API_LATENCY, RECIPE_API_QUOTA_USED, RECIPE_API_QUOTA_LEFT, RECIPE_API_CIRCUIT_STATE,
+    CACHE_REQUESTS
+)
 
 logger = logging.getLogger(__name__)
 
+# Value of the circuit state gauge for each breaker state
+CIRCUIT_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Threads fetching stale results again in the background
+REVALIDATION_WORKERS = 2
+
+_breakers = {}  # endpoint -> CircuitBreaker
+_breakers_lock = threading.Lock()
+_revalidation_pool = None
+_revalidating = set()  # Cache keys being fetched again
+_revalidation_lock = threading.Lock()
+
+def get_breaker(endpoint):
+    """Get the circuit breaker of an endpoint, each endpoint fails on its own."""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(
+                f"Spoonacular {endpoint}", RECIPE_BREAKER_FAILURE_RATE, RECIPE_BREAKER_SLOW_SECONDS,
+                RECIPE_BREAKER_WINDOW, RECIPE_BREAKER_MIN_CALLS, RECIPE_BREAKER_OPEN_SECONDS,
+                on_change=lambda state: RECIPE_API_CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[state], endpoint=endpoint)
+            )
+        return breaker
+
+def _is_failure(status_code):
+    """Check whether a response means the API is in trouble: out of quota, rate limited or failing."""
+    return status_code in (402, 429) or status_code >= 500
+
+def _api_get(endpoint, url, params):
+    """
+    Send a GET request to the Spoonacular API and record its metrics.
+    
+    Goes through the endpoint's circuit breaker, so while the endpoint keeps
+    failing or answering slowly it isn't called at all. A timeout shortened
+    to what is left of the update's budget isn't held against the endpoint.
+    
+    Parameters:
+    - endpoint: Short endpoint name used as metric label
+    - url: Request URL
+    - params: Query parameters
+    
+    Returns:
+    - requests Response, None if the breaker is open
+    
+    Raises requests.Timeout without calling the API if the current update's
+    time budget already ran out.
+    """
+    timeout = timeout_for(RECIPE_API_TIMEOUT_SECONDS)
+    if timeout <= 0:
+        raise requests.Timeout(f"No time left to call {endpoint}")
+    
+    breaker = get_breaker(endpoint)
+    if not breaker.allow():
+        RECIPE_API_REQUESTS.inc(endpoint=endpoint, status='rejected')
+        return None
+    
+    start = time.perf_counter()
+    healthy = None  # Whether the call shows the API works, None if it doesn't tell
+    try:
+        response = requests.get(url, params=params, timeout=timeout)
+        healthy = not _is_failure(response.status_code)
+    except requests.Timeout:
+        RECIPE_API_REQUESTS.inc(endpoint=endpoint, status='error')
+        # Only the API's fault if it got the full timeout, not just what was left of the budget
+        if timeout >= RECIPE_API_TIMEOUT_SECONDS:
+            healthy = False
+        raise
+    except Exception:
+        RECIPE_API_REQUESTS.inc(endpoint=endpoint, status='error')
+        healthy = False
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        RECIPE_API_LATENCY.observe(duration, endpoint=endpoint)
+        if healthy is None:
+            breaker.release()
+        else:
+            breaker.record(healthy, duration)
+    
+    RECIPE_API_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    
+    # Spoonacular reports the daily point quota on every response
+    for header, gauge in (('X-API-Quota-Used', RECIPE_API_QUOTA_USED), ('X-API-Quota-Left', RECIPE_API_QUOTA_LEFT)):
+        value = response.headers.get(header)
+        if value is not None:
+            try:
+                gauge.set(float(value))
+            except ValueError:
+                pass
+    
+    return response
+
+def _cache_key(kind, *params):
+    """Build the cache key of an API call from its parameters."""
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return f"recipes:{kind}:{digest}"
+
+def _cache_get(key):
+    """Get a cached API result and whether it is still fresh, (None, False) if it isn't cached."""
+    entry = get_cache().get(key)
+    if entry is None:
+        CACHE_REQUESTS.inc(cache='recipes', result='miss')
+        return None, False
+    if not isinstance(entry, tuple):
+        # Cached before results were kept past their freshness
+        CACHE_REQUESTS.inc(cache='recipes', result='hit')
+        return entry, True
+    
+    fresh_until, value = entry
+    fresh = time.time() < fresh_until
+    CACHE_REQUESTS.inc(cache='recipes', result='hit' if fresh else 'stale')
+    return value, fresh
+
+def _cache_set(key, value):
+    """
+    Cache an API result.
+    
+    Recipes hardly ever change and every call costs quota points, so results
+    are kept for RECIPE_CACHE_TTL_SECONDS and shared by all replicas. They
+    stay around RECIPE_STALE_TTL_SECONDS longer, to be used while they are
+    refreshed or the API is down. Only successful responses are cached.
+    """
+    # Wall clock time, replicas read each other's entries
+    get_cache().set(key, (time.time() + RECIPE_CACHE_TTL_SECONDS, value), RECIPE_CACHE_TTL_SECONDS + RECIPE_STALE_TTL_SECONDS)
+
+def _cached(cache_key, fetch, *args):
+    """
+    Get an API result from the cache, fetching it if it isn't cached.
+    
+    A result that is no longer fresh is returned right away and fetched
+    again in the background, so callers never wait for a refresh and keep
+    getting results while the API is down.
+    
+    Parameters:
+    - cache_key: Cache key of the result
+    - fetch: Function called with cache_key and args that calls the API,
+      caches the result and returns it, or returns None if the call failed
+    
+    Returns:
+    - The result, None if it wasn't cached and couldn't be fetched
+    """
+    value, fresh = _cache_get(cache_key)
+    if value is None:
+        return fetch(cache_key, *args)
+    if not fresh:
+        _revalidate(cache_key, fetch, *args)
+    return value
+
+def _revalidate(cache_key, fetch, *args):
+    """Fetch a stale result again in a background thread, unless that is already happening."""
+    global _revalidation_pool
+    with _revalidation_lock:
+        if cache_key in _revalidating:
+            return
+        _revalidating.add(cache_key)
+        if _revalidation_pool is None:
+            _revalidation_pool = ThreadPoolExecutor(REVALIDATION_WORKERS, thread_name_prefix='recipe-revalidation')
+    
+    def run():
+        try:
+            fetch(cache_key, *args)
+        except Exception as e:
+            logger.error(f"Error refreshing cached recipe result: {e}")
+        finally:
+            with _revalidation_lock:
+                _revalidating.discard(cache_key)
+    
+    # Not the caller's time budget, the pool's threads don't inherit it
+    _revalidation_pool.submit(run)
+
+@traced
 def get_recipe_by_ingredients(ingredients, number=5):
     """
     Get recipes that can be made with the given ingredients.
@@ -22,8 +210,15 @@ def get_recipe_by_ingredients(ingredients, number=5):
     if not ingredients:
         return []
     
+    # The order and case of the ingredients don't change the result
+    cache_key = _cache_key('findByIngredients', sorted({name.lower() for name in ingredients}), number)
+    recipes = _cached(cache_key, _fetch_recipes_by_ingredients, ingredients, number)
+    return recipes if recipes is not None else []
+
+def _fetch_recipes_by_ingredients(cache_key, ingredients, number):
+    """Call the API for get_recipe_by_ingredients(), None if the call failed."""
     # Build the API URL
-    base_url = "https://api.spoonacular.com/recipes/findByIngredients"
+    base_url = f"{SPOONACULAR_BASE_URL}/recipes/findByIngredients"
     
     params = {
         'apiKey': SPOONACULAR_API_KEY,
@@ -34,27 +229,34 @@ def get_recipe_by_ingredients(ingredients, number=5):
     }
     
     try:
-        response = requests.get(base_url, params=params)
+        response = _api_get('findByIngredients', base_url, params)
+        if response is None:
+            return None
         if response.status_code == 200:
             recipes = response.json()
             
-            # Fetch additional recipe information
+            # Fetch additional recipe information, the recipes detailed so far once out of time
             detailed_recipes = []
             for recipe in recipes:
+                if expired():
+                    break
                 details = get_recipe_details(recipe['id'])
                 if details:
                     # Merge the details with the original recipe
                     merged_recipe = {**recipe, **details}
                     detailed_recipes.append(merged_recipe)
             
+            if len(detailed_recipes) == len(recipes):
+                _cache_set(cache_key, detailed_recipes)
             return detailed_recipes
         else:
             logger.error(f"Error fetching recipes: {response.status_code} - {response.text}")
-            return []
+            return None
     except Exception as e:
         logger.error(f"Error in recipe API request: {e}")
-        return []
+        return None
 
+@traced
 def get_recipe_details(recipe_id):
     """
     Get detailed information about a specific recipe.
@@ -68,8 +270,13 @@ def get_recipe_details(recipe_id):
     if not SPOONACULAR_API_KEY:
         return {}
     
+    details = _cached(f"recipes:information:{recipe_id}", _fetch_recipe_details, recipe_id)
+    return details if details is not None else {}
+
+def _fetch_recipe_details(cache_key, recipe_id):
+    """Call the API for get_recipe_details(), None if the call failed."""
     # Build the API URL
-    base_url = f"https://api.spoonacular.com/recipes/{recipe_id}/information"
+    base_url = f"{SPOONACULAR_BASE_URL}/recipes/{recipe_id}/information"
     
     params = {
         'apiKey': SPOONACULAR_API_KEY,
@@ -77,16 +284,21 @@ def get_recipe_details(recipe_id):
     }
     
     try:
-        response = requests.get(base_url, params=params)
+        response = _api_get('information', base_url, params)
+        if response is None:
+            return None
         if response.status_code == 200:
-            return response.json()
+            details = response.json()
+            _cache_set(cache_key, details)
+            return details
         else:
             logger.error(f"Error fetching recipe details: {response.status_code} - {response.text}")
-            return {}
+            return None
     except Exception as e:
         logger.error(f"Error in recipe details API request: {e}")
-        return {}
+        return None
 
+@traced
 def search_recipes(query, number=5):
     """
     Search for recipes by query.
@@ -101,8 +313,14 @@ def search_recipes(query, number=5):
     if not SPOONACULAR_API_KEY:
         return []
     
+    cache_key = _cache_key('complexSearch', query.strip().lower(), number)
+    results = _cached(cache_key, _fetch_search_results, query, number)
+    return results if results is not None else []
+
+def _fetch_search_results(cache_key, query, number):
+    """Call the API for search_recipes(), None if the call failed."""
     # Build the API URL
-    base_url = "https://api.spoonacular.com/recipes/complexSearch"
+    base_url = f"{SPOONACULAR_BASE_URL}/recipes/complexSearch"
     
     params = {
         'apiKey': SPOONACULAR_API_KEY,
@@ -112,17 +330,21 @@ def search_recipes(query, number=5):
     }
     
     try:
-        response = requests.get(base_url, params=params)
+        response = _api_get('complexSearch', base_url, params)
+        if response is None:
+            return None
         if response.status_code == 200:
-            data = response.json()
-            return data.get('results', [])
+            results = response.json().get('results', [])
+            _cache_set(cache_key, results)
+            return results
         else:
             logger.error(f"Error searching recipes: {response.status_code} - {response.text}")
-            return []
+            return None
     except Exception as e:
         logger.error(f"Error in recipe search API request: {e}")
-        return []
+        return None
 
+@traced
 def get_recipe_swap_suggestions(ingredients):
     """
     Get ingredient swap suggestions for recipes.
@@ -139,23 +361,34 @@ def get_recipe_swap_suggestions(ingredients):
     result = {}
     
     for ingredient in ingredients:
-        # Build the API URL
-        base_url = f"https://api.spoonacular.com/food/ingredients/substitutes"
-        
-        params = {
-            'apiKey': SPOONACULAR_API_KEY,
-            'ingredientName': ingredient
-        }
-        
-        try:
-            response = requests.get(base_url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('status') == 'success':
-                    result[ingredient] = data.get('substitutes', [])
-            else:
-                logger.error(f"Error getting substitutes: {response.status_code} - {response.text}")
-        except Exception as e:
-            logger.error(f"Error in substitute API request: {e}")
+        substitutes = _cached(_cache_key('substitutes', ingredient.lower()), _fetch_substitutes, ingredient)
+        if substitutes is not None:
+            result[ingredient] = substitutes
+    
+    return result
+
+def _fetch_substitutes(cache_key, ingredient):
+    """Call the API for the substitutes of one ingredient, None if the call failed or found none."""
+    # Build the API URL
+    base_url = f"{SPOONACULAR_BASE_URL}/food/ingredients/substitutes"
     
-    return result
\ No newline at end of file
+    params = {
+        'apiKey': SPOONACULAR_API_KEY,
+        'ingredientName': ingredient
+    }
+    
+    try:
+        response = _api_get('substitutes', base_url, params)
+        if response is None:
+            return None
+        if response.status_code == 200:
+            data = response.json()
+            if data.get('status') == 'success':
+                substitutes = data.get('substitutes', [])
+                _cache_set(cache_key, substitutes)
+                return substitutes
+        else:
+            logger.error(f"Error getting substitutes: {response.status_code} - {response.text}")
+    except Exception as e:
+        logger.error(f"Error in substitute API request: {e}")
+    return None
@@ -0,0 +1,137 @@
+import logging
+import re
+from models.user import User
+from utils.geohash import encode
+from config import REGIONS, WORKER_NAME
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the region that gets every user no other region claims, including users without a location
+CATCH_ALL = '*'
+
+def parse_regions(spec):
+    """
+    Parse a region map like "north=u33f,u33g;south=u336;rest=*".
+    
+    Parameters:
+    - spec: Region names with the geohash prefixes they cover
+    
+    Returns:
+    - Dictionary of region name to list of prefixes
+    """
+    regions = {}
+    for part in spec.replace(' ', '').split(';'):
+        if not part:
+            continue
+        name, _, prefixes = part.partition('=')
+        if not name or not prefixes:
+            raise ValueError(f"Invalid region {part!r}, expected name=prefix,prefix")
+        regions[name] = [prefix.lower() for prefix in prefixes.split(',') if prefix]
+    return regions
+
+_regions = parse_regions(REGIONS)
+
+def get_regions():
+    """Get the configured region map, empty when the bot isn't partitioned."""
+    return _regions
+
+def region_of(geohash, regions=None):
+    """
+    Find the region a geohash belongs to.
+    
+    The longest matching prefix wins, so a small region can be carved out
+    of a larger one. Geohashes no region covers, and missing ones, belong to
+    the catch-all region.
+    
+    Parameters:
+    - geohash: Geohash of a user's location, or None
+    - regions: Region map, the configured one by default
+    
+    Returns:
+    - Region name, or None if nothing covers the geohash
+    """
+    regions = _regions if regions is None else regions
+    best = None
+    best_length = -1
+    
+    for name, prefixes in regions.items():
+        for prefix in prefixes:
+            if prefix == CATCH_ALL:
+                if best_length < 0:
+                    best = name
+            elif geohash and geohash.startswith(prefix) and len(prefix) > best_length:
+                best = name
+                best_length = len(prefix)
+    
+    return best
+
+def region_filter(name, regions=None):
+    """
+    Build a users query matching the users region_of() puts in a region.
+    
+    Parameters:
+    - name: Region name
+    - regions: Region map, the configured one by default
+    
+    Returns:
+    - MongoDB filter on the geohash field
+    """
+    regions = _regions if regions is None else regions
+    own = [prefix for prefix in regions.get(name, []) if prefix != CATCH_ALL]
+    others = [prefix for other, prefixes in regions.items() if other != name for prefix in prefixes if prefix != CATCH_ALL]
+    conditions = []
+    
+    if own:
+        # Longer prefixes of other regions take users out of this one
+        carved_out = [prefix for prefix in others if any(prefix.startswith(mine) and prefix != mine for mine in own)]
+        condition = {'geohash': {'$regex': _prefix_pattern(own)}}
+        if carved_out:
+            condition = {'$and': [condition, {'geohash': {'$not': re.compile(_prefix_pattern(carved_out))}}]}
+        conditions.append(condition)
+    
+    if CATCH_ALL in regions.get(name, []):
+        # Users no region covers, including the ones without a geohash
+        conditions.append({'geohash': {'$not': re.compile(_prefix_pattern(own + others))}} if own or others else {})
+    
+    if not conditions:
+        return {'_id': {'$in': []}}
+    return conditions[0] if len(conditions) == 1 else {'$or': conditions}
+
+def worker_filter():
+    """Build a users query matching the users this process serves, empty when it serves everyone."""
+    if not WORKER_NAME:
+        return {}
+    return region_filter(WORKER_NAME)
+
+def backfill_geohash():
+    """
+    Store the geohash of users whose location was set before geohashes existed.
+    
+    Returns:
+    - Number of users updated
+    """
+    collection = User.get_collection()
+    if collection is None:
+        return 0
+    
+    updated = 0
+    try:
+        users = collection.find({'location': {'$ne': None}, 'geohash': {'$exists': False}}, {'location': 1})
+        for user_data in users:
+            location = user_data['location']
+            collection.update_one(
+                {'_id': user_data['_id']},
+                {'$set': {'geohash': encode(location['latitude'], location['longitude'])}}
+            )
+            User.invalidate(user_data['_id'])
+            updated += 1
+    except Exception as e:
+        logger.error(f"Error setting user geohashes: {e}")
+    
+    if updated:
+        logger.info(f"Set the geohash of {updated} users")
+    return updated
+
+def _prefix_pattern(prefixes):
+    """Build an anchored regular expression matching any of the prefixes, which can use an index."""
+    return '^(?:' + '|'.join(re.escape(prefix) for prefix in prefixes) + ')'
@@ -0,0 +1,301 @@
+import json
+import logging
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from config import (
+    CACHE_BACKEND, CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, REDIS_URL, CACHE_NEAR_TTL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# Redis channel replicas announce invalidated keys and namespaces on
+INVALIDATION_CHANNEL = 'cache-invalidation'
+
+class Cache:
+    """
+    Interface of the cache backends.
+    
+    Values are pickled, so callers always get their own copy. Versions are
+    counters per namespace: a key that embeds the version of its namespace
+    (see versioned_key) goes stale as soon as the namespace is bumped,
+    without having to find and delete it. Namespaces are named kind:id,
+    and bump_kind() makes the keys of every namespace of a kind stale.
+    """
+    
+    def __init__(self):
+        """Initialize the invalidation callbacks."""
+        self._callbacks = []
+    
+    def get(self, key):
+        """Get a value, None if it isn't cached."""
+        raise NotImplementedError
+    
+    def set(self, key, value, ttl=None):
+        """Cache a value for ttl seconds, CACHE_TTL_SECONDS by default."""
+        raise NotImplementedError
+    
+    def delete(self, *keys):
+        """Remove keys from the cache of every replica."""
+        raise NotImplementedError
+    
+    def version(self, namespace):
+        """Get the current version of a namespace."""
+        raise NotImplementedError
+    
+    def bump(self, *namespaces):
+        """Move namespaces to a new version on every replica."""
+        raise NotImplementedError
+    
+    def close(self):
+        """Release the backend's resources."""
+    
+    def bump_kind(self, *kinds):
+        """Move every namespace of the given kinds, like 'user', to a new version on every replica."""
+        self.bump(*(kind_namespace(kind) for kind in kinds))
+    
+    def versioned_key(self, namespace, key):
+        """Build a key that changes whenever the namespace, or its whole kind, is bumped."""
+        kind_version = self.version(kind_namespace(namespace.split(':', 1)[0]))
+        return f"{namespace}@{kind_version}.{self.version(namespace)}:{key}"
+    
+    def on_invalidate(self, callback):
+        """Call callback(keys, namespaces) whenever any replica deletes keys or bumps namespaces."""
+        self._callbacks.append(callback)
+    
+    def _notify(self, keys, namespaces):
+        """Run the invalidation callbacks."""
+        for callback in list(self._callbacks):
+            try:
+                callback(keys, namespaces)
+            except Exception as e:
+                logger.error(f"Error in cache invalidation callback {callback.__qualname__}: {e}", exc_info=True)
+
+class LRUCache(Cache):
+    """In-process cache holding the most recently used entries, for a single process."""
+    
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, default_ttl=CACHE_TTL_SECONDS):
+        """Initialize the cache."""
+        super().__init__()
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (time the entry expires, pickled value)
+        self._versions = {}  # Never evicted, a reset version could make stale keys current again
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Get a value, None if it isn't cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            data = entry[1]
+        return pickle.loads(data)
+    
+    def set(self, key, value, ttl=None):
+        """Cache a value for ttl seconds, CACHE_TTL_SECONDS by default."""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def delete(self, *keys):
+        """Remove keys from the cache."""
+        self.evict(keys)
+        self._notify(list(keys), [])
+    
+    def evict(self, keys):
+        """Remove keys without notifying anyone."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+    
+    def version(self, namespace):
+        """Get the current version of a namespace."""
+        return self._versions.get(namespace, 0)
+    
+    def bump(self, *namespaces):
+        """Move namespaces to a new version."""
+        with self._lock:
+            for namespace in namespaces:
+                self._versions[namespace] = self._versions.get(namespace, 0) + 1
+        self._notify([], list(namespaces))
+
+class RedisCache(Cache):
+    """
+    Cache shared by all replicas through a Redis-protocol server.
+    
+    Reads go through a small in-process near cache. Every delete and bump is
+    published, and each replica drops the affected entries from its near
+    cache when it hears about it. Near cache entries also expire after
+    CACHE_NEAR_TTL_SECONDS in case a message is missed. Values are pickled,
+    so the server must only be reachable by the bot.
+    
+    Errors talking to the server are logged and treated as cache misses.
+    """
+    
+    def __init__(self, url=REDIS_URL, default_ttl=CACHE_TTL_SECONDS, near_entries=CACHE_MAX_ENTRIES,
+                 near_ttl=CACHE_NEAR_TTL_SECONDS, prefix='ingredient-exchanger:'):
+        """Connect to the server and start listening for invalidations."""
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis needs the redis package: pip install redis")
+        
+        self.default_ttl = default_ttl
+        self.near_ttl = near_ttl
+        self.prefix = prefix
+        self._id = uuid.uuid4().hex  # Tells this replica's own messages apart
+        self._near = LRUCache(near_entries, near_ttl)
+        self._versions = {}  # namespace -> (version, time it must be read again)
+        self._versions_lock = threading.Lock()
+        self._client = redis.Redis.from_url(url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.prefix + INVALIDATION_CHANNEL: self._on_message})
+        self._listener = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+    
+    def get(self, key):
+        """Get a value, None if it isn't cached."""
+        value = self._near.get(key)
+        if value is not None:
+            return value
+        
+        try:
+            data = self._client.get(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Error reading cache key {key}: {e}")
+            return None
+        
+        if data is None:
+            return None
+        value = pickle.loads(data)
+        self._near.set(key, value)
+        return value
+    
+    def set(self, key, value, ttl=None):
+        """Cache a value for ttl seconds, CACHE_TTL_SECONDS by default."""
+        ttl = self.default_ttl if ttl is None else ttl
+        try:
+            self._client.set(self.prefix + key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), px=int(ttl * 1000))
+        except Exception as e:
+            logger.warning(f"Error writing cache key {key}: {e}")
+            return
+        self._near.set(key, value, min(ttl, self.near_ttl))
+    
+    def delete(self, *keys):
+        """Remove keys from the cache of every replica."""
+        if not keys:
+            return
+        self._near.evict(keys)
+        try:
+            self._client.delete(*(self.prefix + key for key in keys))
+        except Exception as e:
+            logger.warning(f"Error deleting cache keys: {e}")
+        self._publish(keys=list(keys))
+        self._notify(list(keys), [])
+    
+    def version(self, namespace):
+        """Get the current version of a namespace."""
+        known = self._versions.get(namespace)
+        if known and known[1] > time.monotonic():
+            return known[0]
+        
+        try:
+            version = int(self._client.get(self.prefix + 'version:' + namespace) or 0)
+        except Exception as e:
+            logger.warning(f"Error reading cache version {namespace}: {e}")
+            return known[0] if known else 0
+        self._remember_versions({namespace: version})
+        return version
+    
+    def bump(self, *namespaces):
+        """Move namespaces to a new version on every replica."""
+        if not namespaces:
+            return
+        try:
+            pipeline = self._client.pipeline(transaction=False)
+            for namespace in namespaces:
+                pipeline.incr(self.prefix + 'version:' + namespace)
+            versions = pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Error bumping cache versions: {e}")
+            self._forget_versions(namespaces)
+            return
+        
+        self._remember_versions(dict(zip(namespaces, versions)))
+        self._publish(namespaces=list(namespaces))
+        self._notify([], list(namespaces))
+    
+    def close(self):
+        """Stop listening and disconnect."""
+        self._listener.stop()
+        self._pubsub.close()
+        self._client.close()
+    
+    def _publish(self, keys=(), namespaces=()):
+        """Tell the other replicas what was invalidated."""
+        message = json.dumps({'from': self._id, 'keys': keys, 'namespaces': namespaces})
+        try:
+            self._client.publish(self.prefix + INVALIDATION_CHANNEL, message)
+        except Exception as e:
+            logger.warning(f"Error publishing cache invalidation: {e}")
+    
+    def _on_message(self, message):
+        """Drop what another replica invalidated from the near cache."""
+        try:
+            data = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if data.get('from') == self._id:
+            return
+        
+        keys = data.get('keys', [])
+        namespaces = data.get('namespaces', [])
+        self._near.evict(keys)
+        self._forget_versions(namespaces)
+        self._notify(keys, namespaces)
+    
+    def _remember_versions(self, versions):
+        """Keep versions read from the server for the near cache lifetime."""
+        expires_at = time.monotonic() + self.near_ttl
+        with self._versions_lock:
+            if len(self._versions) >= self._near.max_entries:
+                self._versions.clear()
+            for namespace, version in versions.items():
+                self._versions[namespace] = (version, expires_at)
+    
+    def _forget_versions(self, namespaces):
+        """Drop remembered versions so they are read from the server again."""
+        with self._versions_lock:
+            for namespace in namespaces:
+                self._versions.pop(namespace, None)
+
+def kind_namespace(kind):
+    """Get the namespace bumped to make all namespaces of a kind stale."""
+    return f"{kind}:*"
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Get the cache configured by CACHE_BACKEND."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if CACHE_BACKEND == 'redis':
+                    _cache = RedisCache()
+                    logger.info("Using the Redis cache")
+                else:
+                    _cache = LRUCache()
+    return _cache
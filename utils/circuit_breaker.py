@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while, instead of waiting on it every time.
+    
+    Closed, calls go through and the outcomes of the last window calls
+    are kept. Once at least min_calls are kept and the share of failed or
+    slow ones reaches failure_rate, the breaker opens and rejects calls
+    for open_seconds. Then it lets a single probe call through: if that
+    one succeeds the breaker closes, otherwise it opens again.
+    
+    Thread safe, calls are made from worker threads.
+    """
+    
+    def __init__(self, name, failure_rate, slow_seconds, window, min_calls, open_seconds, on_change=None):
+        """
+        Initialize the breaker, closed.
+        
+        Parameters:
+        - name: Name of the dependency, used in logs
+        - failure_rate: Share of failed or slow calls that opens the breaker
+        - slow_seconds: Calls taking longer than this count as failed
+        - window: Number of recent calls the rate is computed over
+        - min_calls: Calls needed in the window before the breaker can open
+        - open_seconds: How long calls are rejected before the next probe
+        - on_change: Function called with the new state whenever it changes
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.on_change = on_change
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # True for every failed or slow call
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    def allow(self):
+        """
+        Check whether a call may be made now.
+        
+        Every allowed call must be followed by record() or release(), an
+        allowed probe holds off all other calls until then.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self._set_state(HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+    
+    def record(self, success, duration):
+        """
+        Record the outcome of an allowed call.
+        
+        Parameters:
+        - success: Whether the dependency answered properly
+        - duration: Seconds the call took
+        """
+        failed = not success or duration > self.slow_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open()
+                else:
+                    self._outcomes.clear()
+                    self._set_state(CLOSED)
+                return
+            
+            self._outcomes.append(failed)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls:
+                if sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                    self._open()
+    
+    def release(self):
+        """
+        Give back an allowed call whose outcome says nothing about the dependency.
+        
+        Like a call the caller gave up on early, for reasons of its own. It
+        isn't counted, and if it was the probe the next call probes again.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+    
+    def _open(self):
+        """Start rejecting calls."""
+        self._opened_at = time.monotonic()
+        self._set_state(OPEN)
+    
+    def _set_state(self, state):
+        """Change state, logging and reporting it."""
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker for {self.name} is now {state.replace('_', '-')}")
+        self.state = state
+        if self.on_change:
+            self.on_change(state)
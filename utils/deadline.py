@@ -0,0 +1,85 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+import pymongo
+from utils.metrics import UPDATE_BUDGET_EXHAUSTED
+
+logger = logging.getLogger(__name__)
+
+# The budget of the update code is currently running for. Copied into
+# asyncio tasks and asyncio.to_thread calls like the current trace span.
+_current_budget = ContextVar('current_budget', default=None)
+
+class Budget:
+    """The time one update, or one background lookup, may take."""
+    
+    __slots__ = ('name', 'deadline')
+    
+    def __init__(self, name, seconds):
+        """Start the budget."""
+        self.name = name
+        self.deadline = time.monotonic() + seconds
+    
+    def remaining(self):
+        """Seconds left, negative once the deadline passed."""
+        return self.deadline - time.monotonic()
+    
+    def exhausted(self):
+        """Check whether the deadline passed."""
+        return time.monotonic() >= self.deadline
+
+@contextmanager
+def budget(name, seconds):
+    """
+    Give everything done inside the block a shared deadline.
+    
+    MongoDB commands get the time left as their timeout, through the
+    driver's own timeout context, and recipe API calls ask timeout_for()
+    for theirs. Code that loops over slow calls checks expired() and
+    returns what it has. Budgets ending past their deadline are counted
+    per name.
+    
+    Parameters:
+    - name: Label of the budget in metrics, e.g. the command name
+    - seconds: Time the block may take
+    """
+    current = Budget(name, seconds)
+    token = _current_budget.set(current)
+    try:
+        with pymongo.timeout(seconds):
+            yield current
+    finally:
+        _current_budget.reset(token)
+        if current.exhausted():
+            UPDATE_BUDGET_EXHAUSTED.inc(command=name)
+
+def remaining():
+    """Seconds left in the current budget, None outside of one."""
+    current = _current_budget.get()
+    return current.remaining() if current is not None else None
+
+def expired():
+    """Check whether the current budget ran out, never outside of one."""
+    current = _current_budget.get()
+    return current is not None and current.exhausted()
+
+def timeout_for(limit):
+    """
+    Get the timeout of one call, at most limit and at most the time left.
+    
+    Returns:
+    - Seconds, zero or less if the budget already ran out
+    """
+    left = remaining()
+    return limit if left is None else min(limit, left)
+
+def detached(func, *args, **kwargs):
+    """
+    Call a function outside of the current budget and trace.
+    
+    Used to start tasks that outlive the update, which would otherwise
+    inherit its deadline. Such tasks open a budget of their own.
+    """
+    return contextvars.Context().run(func, *args, **kwargs)
@@ -0,0 +1,89 @@
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Characters stored per user, about 5m x 5m. Prefixes of it name larger areas:
+# 4 characters are about 39km x 20km, 5 about 5km x 5km
+PRECISION = 9
+
+def encode(lat, lon, precision=PRECISION):
+    """
+    Encode a point as a geohash.
+    
+    Points sharing a geohash prefix lie in the same cell, so prefixes can be
+    used to split a map into regions.
+    
+    Parameters:
+    - lat, lon: Latitude and longitude of the point (in degrees)
+    - precision: Number of characters
+    
+    Returns:
+    - The geohash string
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    
+    return ''.join(chars)
+
+def cell_size(precision):
+    """
+    Get the size of the cells of a precision.
+    
+    Returns:
+    - (height, width) of a cell in degrees of latitude and longitude
+    """
+    bits = 5 * precision
+    # Longitude gets the extra bit of an odd number of bits
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+def covering(box, precision):
+    """
+    Find the cells that together cover a bounding box.
+    
+    Parameters:
+    - box: Dictionary with min and max latitude and longitude, like
+      get_nearby_coordinates() returns
+    - precision: Number of characters of the cells
+    
+    Returns:
+    - Set of geohashes
+    """
+    height, width = cell_size(precision)
+    south, north = max(box['min_lat'], -90.0), min(box['max_lat'], 90.0)
+    west, east = max(box['min_lon'], -180.0), min(box['max_lon'], 180.0)
+    cells = set()
+    
+    # Points one cell apart, plus the far edges, hit every cell the box overlaps
+    lat = south
+    while True:
+        lon = west
+        while True:
+            cells.add(encode(lat, lon, precision))
+            if lon >= east:
+                break
+            lon = min(lon + width, east)
+        if lat >= north:
+            break
+        lat = min(lat + height, north)
+    
+    return cells
@@ -0,0 +1,267 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets in seconds, from 5ms to 30s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = []
+
+def _escape(value):
+    """Escape a label value."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    """Format label pairs the way Prometheus expects them."""
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    """Format a sample value."""
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """Base class for metrics with optional labels."""
+    
+    type_name = None
+    
+    def __init__(self, name, documentation, labels=()):
+        """Create the metric and add it to the registry."""
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+    
+    def _key(self, labels):
+        """Turn label keyword arguments into a values tuple."""
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+    
+    def render(self):
+        """Render the metric in Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}"
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return "\n".join(lines)
+    
+    def _render_sample(self, key, value):
+        """Render the lines of one labelled sample."""
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """A value that only goes up, like the number of requests made."""
+    
+    type_name = "counter"
+    
+    def inc(self, amount=1, **labels):
+        """Increase the counter."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def get(self, **labels):
+        """Get the current value."""
+        return self._values.get(self._key(labels), 0)
+    
+    def total(self):
+        """Get the sum over all label values."""
+        with self._lock:
+            return sum(self._values.values())
+
+class Gauge(_Metric):
+    """A value that can go up and down, like the remaining API quota."""
+    
+    type_name = "gauge"
+    
+    def set(self, value, **labels):
+        """Set the gauge."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def get(self, **labels):
+        """Get the current value."""
+        return self._values.get(self._key(labels), 0)
+
+class Histogram(_Metric):
+    """Distribution of observed values, like request latencies."""
+    
+    type_name = "histogram"
+    
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """Create the histogram."""
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+    
+    def observe(self, value, **labels):
+        """Record one observation."""
+        key = self._key(labels)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample['counts'][i] += 1
+                    break
+            sample['sum'] += value
+            sample['count'] += 1
+    
+    def get(self, **labels):
+        """Get a copy of the bucket counts, sum and count for one set of labels."""
+        sample = self._values.get(self._key(labels))
+        if sample is None:
+            return {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        with self._lock:
+            return {'counts': list(sample['counts']), 'sum': sample['sum'], 'count': sample['count']}
+    
+    def labelled_values(self):
+        """Get the label values of every recorded sample."""
+        with self._lock:
+            return [dict(zip(self.label_names, key)) for key in self._values]
+    
+    def _render_sample(self, key, sample):
+        """Render the cumulative buckets, sum and count of one sample."""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, sample['counts']):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, ('le', _format_value(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(sample['sum'])}")
+        lines.append(f"{self.name}_count{labels} {sample['count']}")
+        return lines
+
+def quantile(histogram_sample, buckets, q):
+    """
+    Estimate a quantile from histogram buckets.
+    
+    Parameters:
+    - histogram_sample: Value returned by Histogram.get()
+    - buckets: The histogram's bucket bounds
+    - q: Quantile between 0 and 1
+    
+    Returns:
+    - Upper bound of the bucket holding the quantile, or None without data
+    """
+    total = histogram_sample['count']
+    if not total:
+        return None
+    
+    target = q * total
+    cumulative = 0
+    for bound, count in zip(buckets, histogram_sample['counts']):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return buckets[-1]
+
+def render_metrics():
+    """Render every registered metric in Prometheus text format."""
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the metrics on GET /metrics."""
+    
+    def do_GET(self):
+        """Handle a scrape."""
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        """Keep scrapes out of the bot's log."""
+
+def start_metrics_server(host, port):
+    """
+    Serve /metrics from a background thread.
+    
+    Parameters:
+    - host: Interface to listen on
+    - port: Port to listen on
+    
+    Returns:
+    - The HTTP server, or None if it could not be started
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Error starting metrics server on {host}:{port}: {e}")
+        return None
+    
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+# Metrics shared by the whole bot
+UPDATE_LATENCY = Histogram(
+    'bot_update_duration_seconds', 'Time spent handling an update, by command or callback prefix', ['command']
+)
+UPDATE_BUDGET_EXHAUSTED = Counter(
+    'bot_update_budget_exhausted_total', 'Updates and background lookups that ran out of their time budget, by command', ['command']
+)
+UPDATES_DROPPED = Counter(
+    'bot_updates_dropped_total', 'Updates dropped because too many were pending for the same user'
+)
+MONGO_OPERATIONS = Counter(
+    'mongo_operations_total', 'MongoDB commands sent, by collection and operation', ['collection', 'operation']
+)
+MONGO_FAILURES = Counter(
+    'mongo_operation_failures_total', 'MongoDB commands that failed, by collection and operation', ['collection', 'operation']
+)
+MONGO_LATENCY = Histogram(
+    'mongo_operation_duration_seconds', 'MongoDB command latency, by collection and operation', ['collection', 'operation']
+)
+RECIPE_API_REQUESTS = Counter(
+    'spoonacular_requests_total', 'Spoonacular API requests, by endpoint and HTTP status', ['endpoint', 'status']
+)
+RECIPE_API_LATENCY = Histogram(
+    'spoonacular_request_duration_seconds', 'Spoonacular API latency, by endpoint', ['endpoint']
+)
+RECIPE_API_QUOTA_USED = Gauge(
+    'spoonacular_quota_used_points', 'Spoonacular points used today, as reported by the API'
+)
+RECIPE_API_QUOTA_LEFT = Gauge(
+    'spoonacular_quota_left_points', 'Spoonacular points left today, as reported by the API'
+)
+RECIPE_API_CIRCUIT_STATE = Gauge(
+    'spoonacular_circuit_state', 'Circuit breaker of each Spoonacular endpoint, 0 closed, 1 half-open, 2 open', ['endpoint']
+)
+CHANGE_FEED_EVENTS = Counter(
+    'change_feed_events_total', 'Changes received from the MongoDB change stream, by collection and operation', ['collection', 'operation']
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups, by cache and result (hit or miss)', ['cache', 'result']
+)
+NOTIFICATIONS_SENT = Counter(
+    'notifications_sent_total', 'Notification messages sent to users'
+)
+NOTIFICATIONS_FAILED = Counter(
+    'notifications_failed_total', 'Notification send attempts that failed, by reason', ['reason']
+)
+ROUTED_UPDATES = Counter(
+    'router_updates_total', 'Updates handled by the router, by region and result', ['region', 'result']
+)
@@ -0,0 +1,218 @@
+import functools
+import inspect
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from config import SLOW_UPDATE_THRESHOLD_MS, TRACE_SAMPLE_RATE, TRACE_FILE
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on spans kept per trace, so a runaway loop can't exhaust memory
+MAX_SPANS_PER_TRACE = 5000
+
+# The span code is currently running in. Copied into asyncio tasks and
+# asyncio.to_thread calls, so spans opened there land in the right trace.
+_current_span = ContextVar('current_span', default=None)
+
+class Span:
+    """One timed operation and the operations it called."""
+    
+    __slots__ = ('name', 'trace', 'start', 'duration', 'children')
+    
+    def __init__(self, name, trace, start=None):
+        """Start the span."""
+        self.name = name
+        self.trace = trace
+        self.start = time.perf_counter() if start is None else start
+        self.duration = None
+        self.children = []
+    
+    def finish(self, end=None):
+        """Stop the span."""
+        self.duration = (time.perf_counter() if end is None else end) - self.start
+    
+    def child(self, name, start=None):
+        """Open a child span, or return None once the trace is full."""
+        if self.trace.span_count >= MAX_SPANS_PER_TRACE:
+            self.trace.dropped_spans += 1
+            return None
+        
+        self.trace.span_count += 1
+        span = Span(name, self.trace, start)
+        self.children.append(span)
+        return span
+    
+    def to_dict(self, origin):
+        """Convert the span tree to plain data, with times in ms from origin."""
+        return {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round((self.duration or 0) * 1000, 3),
+            'children': [child.to_dict(origin) for child in self.children]
+        }
+
+class Trace:
+    """The spans recorded while handling one update."""
+    
+    __slots__ = ('root', 'started_at', 'span_count', 'dropped_spans')
+    
+    def __init__(self, name):
+        """Start the trace with its root span."""
+        self.started_at = datetime.now()
+        self.span_count = 1
+        self.dropped_spans = 0
+        self.root = Span(name, self)
+
+@contextmanager
+def trace_update(name):
+    """
+    Trace everything done while handling one update.
+    
+    Logs the timing tree of updates slower than SLOW_UPDATE_THRESHOLD_MS and
+    writes a sample of all traces to TRACE_FILE when TRACE_SAMPLE_RATE is set.
+    
+    Parameters:
+    - name: Label of the update, e.g. the command name
+    """
+    trace = Trace(name)
+    token = _current_span.set(trace.root)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(token)
+        trace.root.finish()
+        _finish_trace(trace)
+
+def traced(func=None, *, name=None):
+    """
+    Record calls of a function as spans of the current update's trace.
+    
+    Works on plain and async functions. Outside of a traced update the
+    function is called directly, so the overhead is one context lookup.
+    
+    Usage: @traced or @traced(name="custom name")
+    """
+    if func is None:
+        return functools.partial(traced, name=name)
+    
+    span_name = name or func.__qualname__
+    
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            span = _open_span(span_name)
+            if span is None:
+                return await func(*args, **kwargs)
+            token = _current_span.set(span)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _current_span.reset(token)
+                span.finish()
+        return async_wrapper
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        span = _open_span(span_name)
+        if span is None:
+            return func(*args, **kwargs)
+        token = _current_span.set(span)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+            span.finish()
+    return wrapper
+
+def record_span(name, duration):
+    """
+    Add an already finished operation to the current trace.
+    
+    Used for operations timed elsewhere, like MongoDB commands reported
+    by the driver's command listener.
+    
+    Parameters:
+    - name: Span name
+    - duration: Duration in seconds, ending now
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return
+    
+    end = time.perf_counter()
+    span = parent.child(name, end - duration)
+    if span is not None:
+        span.finish(end)
+
+def format_span_tree(span, indent=0):
+    """
+    Render a span tree as text, one line per span.
+    
+    Sibling spans with the same name are merged into one line showing
+    how often they ran, so loops don't flood the log.
+    """
+    lines = [f"{'  ' * indent}{span.name}: {_ms(span.duration)}"]
+    lines.extend(_format_children(span.children, indent + 1))
+    return "\n".join(lines)
+
+def _format_children(spans, indent):
+    """Render sibling spans, merging those with the same name."""
+    groups = {}
+    for span in spans:
+        groups.setdefault(span.name, []).append(span)
+    
+    lines = []
+    for name, group in groups.items():
+        if len(group) == 1:
+            lines.append(f"{'  ' * indent}{name}: {_ms(group[0].duration)}")
+        else:
+            total = sum(span.duration or 0 for span in group)
+            slowest = max(span.duration or 0 for span in group)
+            lines.append(f"{'  ' * indent}{name} x{len(group)}: {_ms(total)} (max {_ms(slowest)})")
+        lines.extend(_format_children([child for span in group for child in span.children], indent + 1))
+    return lines
+
+def _ms(seconds):
+    """Format a duration in milliseconds."""
+    if seconds is None:
+        return "unfinished"
+    return f"{seconds * 1000:.1f} ms"
+
+def _open_span(name):
+    """Open a child of the current span, if there is one."""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return parent.child(name)
+
+def _finish_trace(trace):
+    """Log a slow trace and write sampled ones to the trace file."""
+    duration_ms = trace.root.duration * 1000
+    
+    if duration_ms >= SLOW_UPDATE_THRESHOLD_MS:
+        message = f"Slow update {trace.root.name} took {duration_ms:.1f} ms:\n{format_span_tree(trace.root)}"
+        if trace.dropped_spans:
+            message += f"\n({trace.dropped_spans} spans not recorded)"
+        logger.warning(message)
+    
+    if TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE:
+        _write_trace(trace)
+
+def _write_trace(trace):
+    """Append a trace to the trace file as one JSON line."""
+    record = {
+        'update': trace.root.name,
+        'started_at': trace.started_at.isoformat(),
+        'duration_ms': round(trace.root.duration * 1000, 3),
+        'dropped_spans': trace.dropped_spans,
+        'root': trace.root.to_dict(trace.root.start)
+    }
+    try:
+        with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logger.error(f"Error writing trace file: {e}")